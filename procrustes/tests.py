@@ -1,3 +1,61 @@
-from django.test import TestCase
+import json
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.test import TestCase, AsyncRequestFactory
+
+from . import views
+from .fit import TransformationType, ResidualCorrectionType
+
+# hatt and tm3 coordinates of the same points, the last ones are validation points
+POINTS = [
+    ('p1', 'R', -2053.94, -1260.15, 159888.702, 736744.476),
+    ('p2', 'R', -1967.90, -1392.66, 159973.964, 736611.664),
+    ('p3', 'R', -2160.13, -1378.92, 159781.925, 736626.378),
+    ('p4', 'R', -1628.33, -1596.61, 160312.523, 736406.113),
+    ('p5', 'R', -2113.55, -1546.32, 159827.647, 736458.800),
+    ('p6', 'R', -1753.39, -1610.69, 160187.401, 736392.744),
+    ('p7', 'R', -2072.28, -1280.96, 159870.290, 736723.760),
+    ('p8', 'R', -1678.26, -1769.90, 160261.670, 736233.160),
+    ('p9', 'V', -1896.61, -1794.73, 160043.120, 736209.400),
+    ('p10', 'V', -1836.68, -1550.86, 160104.330, 736452.960),
+]
+
+class ExecuteViewTest(TestCase):
+
+    def params(self, residual_correction_type):
+        return {
+            'transformation_type': TransformationType.Similarity.value,
+            'residual_correction_type': residual_correction_type.value,
+            'reference_points': StringIO(''.join('%s,%s,%.2f,%.2f,%.3f,%.3f\n' % p for p in POINTS)),
+        }
+
+    def test_execute(self):
+        response = self.client.post('/procrustes/execute/', self.params(ResidualCorrectionType.Hausbrandt))
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(len(result['input_coords']['cs_source']['reference_coords']), 8)
+        self.assertEqual(len(result['input_coords']['cs_source']['validation_coords']), 2)
+        self.assertEqual(len(result['transformation']['fitted_parameters']), 4)
+        self.assertIn('validation_statistics', result['transformation'])
+        self.assertIn('validation_statistics', result['residual_correction'])
+
+    def test_async_view(self):
+        self.assertTrue(views.execute_async.__wrapped__ is views.execute)
+
+        @async_to_sync
+        async def post(params):
+            response = await views.execute_async(AsyncRequestFactory().post('/procrustes/execute/', params))
+            self.assertFalse(response.streaming)
+            return response
+
+        for residual_correction_type in ResidualCorrectionType:
+            params = self.params(residual_correction_type)
+            if residual_correction_type == ResidualCorrectionType.Collocation:
+                params['cov_function_type'] = 1
+                params['collocation_noise'] = 0
+            expected = self.client.post('/procrustes/execute/', params).json()
+            params['reference_points'].seek(0)
+            response = post(params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), expected)
@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'procrustes'
 urlpatterns = [
 	path('', views.index, name='index'),
-	path('execute/', views.execute, name='execute'),
+	path('execute/', views.execute_async if settings.ASYNC_VIEWS else views.execute, name='execute'),
 ]
\ No newline at end of file
@@ -1,14 +1,24 @@
 import json
 import io
 import csv
+import time
 from dataclasses import dataclass
 import numpy as np
 import pandas as pd
 from django.shortcuts import render
 from django.http import HttpResponse
+from survgr.compression import PrefixedReader, decompressed, compress_response
+from survgr.async_views import async_view
+from survgr.metrics import registry, DURATION_BUCKETS, SIZE_BUCKETS
 from .forms import ReferencePointsForm
 from .fit import *
 
+FIT_DURATION = registry.histogram('survgr_procrustes_fit_duration_seconds',
+    'Duration of the procrustes fits (transformation, residual correction and statistics).',
+    ['transformation_type', 'residual_correction_type'], DURATION_BUCKETS)
+UPLOAD_SIZE = registry.histogram('survgr_procrustes_upload_size_bytes',
+    'Size of the uploaded reference point files (as sent, before decompression).', [], SIZE_BUCKETS)
+
 @dataclass
 class Point:
     id: str
@@ -27,8 +37,10 @@ def index(request):
     return render(request, 'procrustes/index.html', {'form': form})
 
 def _read_points(fp):
-    dialect = csv.Sniffer().sniff(fp.readline(), delimiters=";, \t")
-    fp.seek(0)
+    first_line = fp.readline()
+    dialect = csv.Sniffer().sniff(first_line, delimiters=";, \t")
+    # put the line back, fp may be a decompressed stream that cannot seek
+    fp = PrefixedReader(first_line, fp)
 
     if dialect.delimiter in [' ', '\t']:
         sep = '\s+'
@@ -69,13 +81,17 @@ def _read_points(fp):
     ]
     return pts
 
+@compress_response
 def execute(request):
     if request.method == 'POST':
         form_data = ReferencePointsForm(request.POST, request.FILES)
         if form_data.is_valid():
 
+            # gzip or zstd compressed files are decompressed as they are read
+            reference_points = form_data.cleaned_data['reference_points']
+            UPLOAD_SIZE.observe(reference_points.size)
             f = io.TextIOWrapper(
-                form_data.cleaned_data['reference_points'], encoding='utf-8')
+                decompressed(reference_points, reference_points.content_type), encoding='utf-8')
             pts = _read_points(f)
 
             source_coords = np.array([(pt.x_src, pt.y_src) for pt in
@@ -87,6 +103,7 @@ def execute(request):
             val_target_coords = np.array([(pt.x_dst, pt.y_dst) for pt in
                 filter(lambda pt: not pt.is_ref, pts)])
 
+            fit_start = time.perf_counter()
             transf_type = TransformationType(
                 int(form_data.cleaned_data['transformation_type']))
             if transf_type == TransformationType.Similarity:
@@ -119,6 +136,9 @@ def execute(request):
                     val_stats_rescor = ResidualStatistics(
                         val_source_coords, val_target_coords, rescor)
 
+            FIT_DURATION.observe(time.perf_counter() - fit_start,
+                transformation_type=transf_type.name, residual_correction_type=rescor_type.name)
+
             result = {
                 "version": '1.0',
                 "input_coords": {
@@ -162,3 +182,6 @@ def execute(request):
             return json_response(result)
 
     return index(request)
+
+# for ASGI servers, the fit runs on the compute executor
+execute_async = async_view(execute)
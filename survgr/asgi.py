@@ -0,0 +1,20 @@
+"""
+ASGI config for survgr project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Served this way, the transform and procrustes endpoints use their async views:
+uploads are received without holding a thread and the computations run on
+a bounded pool of threads (see survgr/async_views.py).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "survgr.settings")
+os.environ.setdefault("SURVGR_ASYNC_VIEWS", "True")
+
+application = get_asgi_application()
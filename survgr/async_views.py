@@ -0,0 +1,72 @@
+"""Async views that run the numpy and pyproj work on a bounded pool of threads"""
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+class ComputeExecutor(object):
+    """
+    Process wide thread pool of the async views (COMPUTE_WORKERS threads, the number of cores by default).
+    Requests wait for a free thread in the event loop, so a process can hold many slow
+    clients while only a fixed number of threads compute.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def workers(self):
+        return getattr(settings, 'COMPUTE_WORKERS', None) or os.cpu_count() or 1
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='compute')
+            return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Calls fn(*args, **kwargs) on the pool and returns its result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), partial(_call, fn, *args, **kwargs))
+
+def _call(fn, *args, **kwargs):
+    # the pool threads outlive the requests, their database connections are closed as in a request
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+compute_executor = ComputeExecutor()
+
+_END = object()
+
+async def _async_chunks(chunks):
+    # produces each chunk of a sync iterator on the pool
+    iterator = iter(chunks)
+    while True:
+        chunk = await compute_executor.run(next, iterator, _END)
+        if chunk is _END:
+            break
+        yield chunk
+
+def async_view(view):
+    """
+    Returns the async version of a sync view. The view, with the parsing of the request
+    (the body has already been received by the ASGI handler) runs on the compute executor
+    and the chunks of streaming responses are produced there as they are sent.
+    The attributes of the view (i.e. csrf_exempt) are kept.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        response = await compute_executor.run(view, request, *args, **kwargs)
+        if response.streaming and not response.is_async:
+            response.streaming_content = _async_chunks(response.streaming_content)
+        return response
+    return wrapper
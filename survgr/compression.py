@@ -0,0 +1,163 @@
+"""Compressed uploads and responses (gzip, and zstd if the zstandard package is installed)"""
+import io
+import gzip
+import re
+import shutil
+import tempfile
+from functools import wraps
+
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# content types of compressed uploads, for the files that are not recognized by their magic bytes
+CONTENT_TYPES = {
+    'application/gzip': 'gzip',
+    'application/x-gzip': 'gzip',
+    'application/zstd': 'zstd',
+}
+
+# responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 200
+
+class PrefixedReader(io.IOBase):
+    """
+    Reads prefix (str or bytes), then the rest of fp.
+    Puts back the start of a stream that has been read for sniffing, so that streams
+    that cannot seek back (i.e. decompressed uploads) can still be read from the start.
+    """
+    def __init__(self, prefix, fp):
+        self._prefix = prefix
+        self._fp = fp
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._fp.read(size)
+        if size is None or size < 0:
+            data = self._prefix + self._fp.read()
+        else:
+            data = self._prefix[:size]
+        self._prefix = self._prefix[len(data):]
+        return data
+
+    def readline(self, size=-1):
+        if not self._prefix:
+            return self._fp.readline(size)
+        end = self._prefix.find(b'\n' if isinstance(self._prefix, bytes) else '\n')
+        if end < 0:
+            line = self._prefix + self._fp.readline()
+        else:
+            line = self._prefix[:end + 1]
+        self._prefix = self._prefix[len(line):]
+        return line
+
+def compression_of(magic, content_type=None):
+    """
+    Returns 'gzip', 'zstd' or None for the first bytes of a file and its content type.
+    """
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return CONTENT_TYPES.get((content_type or '').split(';')[0].strip().lower())
+
+def decompressed(fp, content_type=None):
+    """
+    Returns a binary file object with the decompressed contents of fp (gzip or zstd,
+    recognized by the magic bytes or the content type), or fp if it is not compressed.
+    The data is decompressed incrementally as it is read.
+    """
+    magic = fp.read(4)
+    compression = compression_of(magic, content_type)
+    fp = PrefixedReader(magic, fp)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fp, mode='rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compressed files need the zstandard package')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fp))
+    return fp
+
+def decompressed_file(fp, content_type=None):
+    """
+    Same as decompressed, for the readers that need a seekable file: a compressed fp is
+    decompressed to a temporary file (kept in memory while small).
+    """
+    magic = fp.read(4)
+    fp.seek(0)
+    if compression_of(magic, content_type) is None:
+        return fp
+    output = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    shutil.copyfileobj(decompressed(fp, content_type), output)
+    output.seek(0)
+    return output
+
+def _accepted_encodings(request):
+    # the codings of the Accept-Encoding header, without the ones with q=0
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        q = re.search(r'q\s*=\s*(\d+(?:\.\d*)?)', params)
+        if coding.strip() and (q is None or float(q.group(1)) > 0):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def _zstd_sequence(sequence):
+    compressor = zstandard.ZstdCompressor().compressobj()
+    for item in sequence:
+        data = compressor.compress(item)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def compress_response(view):
+    """
+    View decorator that compresses the response with zstd or gzip, as accepted by the client.
+    Streaming responses are compressed as they are streamed.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200 or response.has_header('Content-Encoding'):
+            return response
+        # pages with csrf tokens are not compressed (BREACH)
+        if response.get('Content-Type', '').startswith('text/html'):
+            return response
+        if not response.streaming and len(response.content) < MIN_COMPRESS_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = _accepted_encodings(request)
+        if 'zstd' in accepted and zstandard is not None:
+            encoding = 'zstd'
+            if response.streaming:
+                response.streaming_content = _zstd_sequence(response.streaming_content)
+            else:
+                response.content = zstandard.ZstdCompressor().compress(response.content)
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+            if response.streaming:
+                response.streaming_content = compress_sequence(response.streaming_content)
+            else:
+                response.content = compress_string(response.content)
+        else:
+            return response
+
+        if response.streaming:
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+        else:
+            response['Content-Length'] = str(len(response.content))
+        response['Content-Encoding'] = encoding
+        return response
+    return wrapper
@@ -0,0 +1,170 @@
+"""In-process metrics registry, exposed in the Prometheus text format at /metrics/"""
+import hmac
+import math
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+
+# latency buckets (seconds), up to the minutes of very large files
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s expects the labels %s' % (self.name, ', '.join(self.labelnames)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        '''
+        Returns the (name, labels, value) samples of the metric, labels as (name, value) pairs.
+        '''
+        raise NotImplementedError
+
+class Counter(_Metric):
+    '''
+    Monotonically increasing value per set of labels.
+    '''
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, list(zip(self.labelnames, key)), value) for key, value in values]
+
+class Histogram(_Metric):
+    '''
+    Counts of the observed values in cumulative buckets, with their sum and count, per set of labels.
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, ([*counts[0]], counts[1], counts[2])) for key, counts in self._values.items())
+        samples = []
+        for key, (buckets, total, count) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                samples.append((self.name + '_bucket', labels + [('le', _format_value(float(bound)))], cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+class Registry(object):
+    '''
+    The metrics of the process, and collectors that report values kept elsewhere (i.e. cache statistics)
+    when the metrics are rendered. The metrics are per process, each worker of a server has its own.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('metric %s is already registered' % metric.name)
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        '''
+        collector() returns a list of (name, type, documentation, samples) with samples as in _Metric.samples.
+        '''
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = [(m.name, m.type, m.documentation, m.samples()) for m in metrics]
+        for collector in collectors:
+            families.extend(collector())
+        return families
+
+    def render(self):
+        '''
+        Returns the metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        for name, metric_type, documentation, samples in self.collect():
+            lines.append('# HELP %s %s' % (name, documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for sample_name, labels, value in samples:
+                lines.append('%s%s %s' % (sample_name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def metrics_view(request):
+    '''
+    Serves the metrics if METRICS_ENABLED, to the clients with the METRICS_TOKEN bearer token if it is set.
+    '''
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        raise Http404
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        authorization = request.headers.get('Authorization', '').encode('utf-8')
+        if not hmac.compare_digest(authorization, ('Bearer %s' % token).encode('utf-8')):
+            response = HttpResponse(status=401)
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -133,6 +133,38 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
+# Load the Hepos correction grid in RAM at startup instead of memory mapping it lazily
+HEPOS_GRID_IN_MEMORY = os.environ.get("SURVGR_HEPOS_GRID_IN_MEMORY", "False") == "True"
+
+# Add a Server-Timing header with the timings of the steps to the responses of the transform api
+TRANSFORM_SERVER_TIMING = os.environ.get("SURVGR_SERVER_TIMING", "False") == "True"
+
+# Log level of the transform app, INFO logs the timings of the steps of each request
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "transform": {
+            "handlers": ["console"],
+            "level": os.environ.get("SURVGR_TRANSFORM_LOG_LEVEL", "WARNING"),
+        },
+    },
+}
+
+# Serve the transform and procrustes endpoints with their async views (set by asgi.py)
+ASYNC_VIEWS = os.environ.get("SURVGR_ASYNC_VIEWS", "False") == "True"
+
+# Threads of the async views for the computations, the number of cores by default
+COMPUTE_WORKERS = int(os.environ.get("SURVGR_COMPUTE_WORKERS", "0")) or None
+
+# Serve the Prometheus metrics at /metrics/ (off by default), only to the clients that send
+# the token (if set) in an "Authorization: Bearer <token>" header
+METRICS_ENABLED = os.environ.get("SURVGR_METRICS_ENABLED", "False") == "True"
+METRICS_TOKEN = os.environ.get("SURVGR_METRICS_TOKEN") or None
+
 WEBPACK_LOADER = {
 	'DEFAULT': {
 		'STATS_FILE': os.path.join(BASE_DIR, 'frontend', 'webpack', 'webpack-stats.json')
@@ -3,9 +3,11 @@ from django.urls import include, path
 from django.contrib import admin
 
 import transform.urls
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('transform.urls')),
 	path('procrustes/', include('procrustes.urls')),
+    path('metrics/', metrics_view, name='metrics'),
 ]
@@ -1,4 +1,12 @@
 from django.apps import AppConfig
 
 class TransformConfig(AppConfig):
-    name = 'transform'
\ No newline at end of file
+    name = 'transform'
+
+    def ready(self):
+        from . import signals
+        from django.conf import settings
+        if getattr(settings, 'HEPOS_GRID_IN_MEMORY', False):
+            # pin the hepos grid in RAM at startup
+            from .htrs.hepos_transformer import HeposTransformer
+            HeposTransformer.load_grid()
@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from survgr.metrics import registry
+from .proj_pool import proj_pool
+from .hatt.registry import hattblock_registry
+from .htrs.grid import grid_stats
+
+class PipelineCache(object):
+	'''
+	Bounded, thread-safe LRU cache of compiled transformers.
+	Entries are keyed on a normalized parameter tuple and built with a factory
+	on a miss. The least recently used entry is evicted when the cache is full.
+	'''
+	def __init__(self, maxsize=128):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._generation = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, factory):
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return self._entries[key]
+			self.misses += 1
+			generation = self._generation
+
+		# compile outside the lock, so that a slow compile does not block other requests
+		value = factory()
+
+		with self._lock:
+			# do not store values compiled before an invalidation
+			if generation != self._generation or self.maxsize <= 0:
+				return value
+			self._entries[key] = value
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+		return value
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._generation += 1
+
+	def __len__(self):
+		return len(self._entries)
+
+	def stats(self):
+		with self._lock:
+			return {
+				'size': len(self._entries),
+				'maxsize': self.maxsize,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+			}
+
+# process wide cache of compiled WorkHorseTransformer pipelines
+pipeline_cache = PipelineCache(maxsize=getattr(settings, 'TRANSFORM_PIPELINE_CACHE_SIZE', 128))
+
+def _samples(families):
+	# (name, type, documentation, value) of metrics without labels, as the families of a collector
+	return [(name, metric_type, documentation, [(name, [], value)]) for name, metric_type, documentation, value in families]
+
+def _ratio(hits, misses):
+	return hits / (hits + misses) if hits + misses else 0.0
+
+def _pipeline_cache_metrics():
+	# the statistics of the pipeline cache, read when the metrics are rendered
+	stats = pipeline_cache.stats()
+	return _samples([
+		('survgr_pipeline_cache_hits_total', 'counter', 'Compiled transformers found in the pipeline cache.', stats['hits']),
+		('survgr_pipeline_cache_misses_total', 'counter', 'Transformers compiled on a miss of the pipeline cache.', stats['misses']),
+		('survgr_pipeline_cache_evictions_total', 'counter', 'Compiled transformers evicted from the pipeline cache.', stats['evictions']),
+		('survgr_pipeline_cache_size', 'gauge', 'Compiled transformers in the pipeline cache.', stats['size']),
+		('survgr_pipeline_cache_hit_ratio', 'gauge', 'Ratio of the pipeline cache lookups that were hits.', _ratio(stats['hits'], stats['misses'])),
+	])
+
+def _registry_metrics():
+	# the statistics of the pyproj pool, the hatt block registry and the hepos grids
+	proj = proj_pool.stats()
+	hatt = hattblock_registry.stats()
+	grids = grid_stats()
+	return _samples([
+		('survgr_proj_crs_hits_total', 'counter', 'CRS definitions found in the pyproj pool.', proj['crs_hits']),
+		('survgr_proj_crs_misses_total', 'counter', 'CRS definitions parsed on a miss of the pyproj pool.', proj['crs_misses']),
+		('survgr_proj_crs_size', 'gauge', 'CRS definitions in the pyproj pool.', proj['crs_size']),
+		('survgr_proj_transformer_hits_total', 'counter', 'pyproj transformers found in the per thread pools.', proj['transformer_hits']),
+		('survgr_proj_transformer_misses_total', 'counter', 'pyproj transformers created on a miss of the per thread pools.', proj['transformer_misses']),
+		('survgr_proj_transformer_size', 'gauge', 'pyproj transformers in the pools of the live threads.', proj['transformer_size']),
+		('survgr_proj_transformer_hit_ratio', 'gauge', 'Ratio of the pyproj transformer lookups that were hits.',
+			_ratio(proj['transformer_hits'], proj['transformer_misses'])),
+		('survgr_hattblock_registry_loads_total', 'counter', 'Loads of the hatt block registry from the database.', hatt['loads']),
+		('survgr_hattblock_registry_invalidations_total', 'counter', 'Invalidations of the hatt block registry by model changes.', hatt['invalidations']),
+		('survgr_hattblock_registry_size', 'gauge', 'Hatt blocks in the registry (0 if not loaded).', hatt['size']),
+		('survgr_hepos_grid_hits_total', 'counter', 'Lookups of the hepos grid served by the loaded grid.', grids['hits']),
+		('survgr_hepos_grid_loads_total', 'counter', 'Loads (or memory mappings) of the hepos grid.', grids['loads']),
+		('survgr_hepos_grid_memory_bytes', 'gauge', 'Bytes of the hepos grids loaded in RAM.', grids['memory_bytes']),
+		('survgr_hepos_grid_mapped_bytes', 'gauge', 'Bytes of the memory mapped hepos grids.', grids['mapped_bytes']),
+	])
+
+registry.register_collector(_pipeline_cache_metrics)
+registry.register_collector(_registry_metrics)
@@ -0,0 +1,91 @@
+import numpy as np
+from io import BytesIO
+
+from .npy_driver import transform_columns
+from ..timing import timed, timed_iter
+
+# pyarrow is optional, only needed for the arrow and parquet drivers
+try:
+	import pyarrow as pa
+	import pyarrow.ipc
+except ImportError:
+	pa = None
+
+_ARROW_FILE_MAGIC = b'ARROW1'
+
+def require_pyarrow():
+	if pa is None:
+		raise ValueError('the arrow and parquet formats need the pyarrow package')
+
+def output_schema(schema, hatt_ids, mark_invalid):
+	'''
+	Schema of the transformed tables: the coordinate columns become float64, with the "hatt_id" column
+	(with the automatic hatt block lookup to Hatt) and the "valid" column (with marking) appended.
+	'''
+	fields = []
+	for field in schema:
+		if field.name in ['hatt_id', 'valid']:
+			continue
+		fields.append(pa.field(field.name, pa.float64()) if field.name in ['x', 'y', 'z'] else field)
+	if hatt_ids:
+		fields.append(pa.field('hatt_id', pa.int64()))
+	if mark_invalid:
+		fields.append(pa.field('valid', pa.bool_()))
+	return pa.schema(fields, metadata=schema.metadata)
+
+def transform_batch(transformer, batch, schema, mark_invalid):
+	'''
+	Transforms the x, y, (z) columns of a record batch and returns the batch with the given output schema.
+	Float64 columns without nulls are passed to the transformer without copying their buffers,
+	invalid points (with marking) and missing values become nulls.
+	'''
+	names = batch.schema.names
+	if 'x' not in names or 'y' not in names:
+		raise ValueError('expected x and y columns')
+	xyz = [batch.column(name).to_numpy(zero_copy_only=False) for name in ['x', 'y', 'z'] if name in names]
+	coords, valid, hatt_ids = transform_columns(transformer, *xyz, mark_invalid=mark_invalid)
+
+	columns = dict(zip(['x', 'y', 'z'], coords))
+	arrays = []
+	for field in schema:
+		if field.name in columns:
+			column = columns[field.name]
+			arrays.append(pa.array(column, mask=~valid if valid is not None else None))
+		elif field.name == 'hatt_id':
+			arrays.append(pa.array(np.asarray(hatt_ids, dtype=np.int64), mask=~valid if valid is not None else None))
+		elif field.name == 'valid':
+			arrays.append(pa.array(valid))
+		else:
+			arrays.append(batch.column(field.name))
+	return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+# Arrow IPC driver, the input is an arrow file or stream with x, y and optional z columns
+# (other columns, e.g. an id, are kept). It is transformed batch by batch and
+# written back in the same format (file or stream).
+# invalid_points: 'fail' raises for the whole input if any point cannot be transformed,
+# 'mark' nulls the coordinates of the invalid points and appends a "valid" column.
+# With the automatic hatt block lookup to Hatt, a "hatt_id" column is appended.
+def transform(transformer, fp, invalid_points='fail'):
+	require_pyarrow()
+	mark_invalid = invalid_points == 'mark'
+	is_file = fp.read(len(_ARROW_FILE_MAGIC)) == _ARROW_FILE_MAGIC
+	fp.seek(0)
+
+	if is_file:
+		reader = pa.ipc.open_file(fp)
+		batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+	else:
+		reader = pa.ipc.open_stream(fp)
+		batches = iter(reader)
+
+	schema = output_schema(reader.schema, getattr(transformer, 'outputs_hatt_ids', False), mark_invalid)
+	output = BytesIO()
+	new_writer = pa.ipc.new_file if is_file else pa.ipc.new_stream
+	with new_writer(output, schema) as writer:
+		for batch in timed_iter('arrow_read', batches):
+			batch = transform_batch(transformer, batch, schema, mark_invalid)
+			with timed('arrow_write', batch.num_rows):
+				writer.write_batch(batch)
+
+	output.seek(0)
+	return output
@@ -3,9 +3,16 @@ import numpy as np
 import pandas as pd
 from io import StringIO
 
-def transform(transformer, fp, decimals=(3, 3, 3), fieldnames='x,y'):
-	dialect = csv.Sniffer().sniff(fp.readline(), delimiters=";, \t")
-	fp.seek(0)
+from survgr.compression import PrefixedReader
+from .float_format import format_fixed
+from ..timing import timed, timed_iter
+
+def _reader(fp, fieldnames, chunksize=None):
+	# guess the csv format from the first line and create the pandas reader,
+	# the line is put back instead of seeking, fp may be a decompressed stream
+	first_line = fp.readline()
+	dialect = csv.Sniffer().sniff(first_line, delimiters=";, \t")
+	fp = PrefixedReader(first_line, fp)
 
 	if dialect.delimiter in [' ', '\t']:
 		sep = '\s+'
@@ -20,37 +27,69 @@ def transform(transformer, fp, decimals=(3, 3, 3), fieldnames='x,y'):
 		'z': float
 	}
 	has_id = 'id' in fieldnames
-	has_z = 'z' in fieldnames
 
-	df = pd.read_csv(fp,
+	reader = pd.read_csv(fp,
 		sep=sep,
 		names=fieldnames,
 		dtype=field_dtype,
 		index_col='id' if has_id else False,
 		skipinitialspace=True,
 		skip_blank_lines=True,
-		decimal='.')
+		decimal='.',
+		chunksize=chunksize)
+	return reader, dialect.delimiter, has_id, 'z' in fieldnames
 
-	if df.isna().values.any():
+def _transform_frame(transformer, df, decimals, delimiter, has_id, has_z, mark_invalid):
+	# transforms the points of the dataframe and returns them as csv text
+	# with marking, rows with missing coordinates are just marked as invalid
+	if not mark_invalid and df.isna().values.any():
 		raise ValueError('missing values')
 
-	if has_z:
-		coords = transformer(df['x'], df['y'], df['z'])
+	xyz = (df['x'], df['y'], df['z']) if has_z else (df['x'], df['y'])
+	hatt_ids = [] if getattr(transformer, 'outputs_hatt_ids', False) else None
+	if mark_invalid:
+		coords, valid = transformer.transform_masked(*xyz, hatt_ids=hatt_ids)
 	else:
-		coords = transformer(df['x'], df['y'])
-
-	df['x'] = coords[0]
-	df['y'] = coords[1]
-	if has_z:
-		df['z'] = coords[2]
-
-	decx, decy, decz = decimals
-	df['x'] = df['x'].map(lambda x: np.format_float_positional(x, decx))
-	df['y'] = df['y'].map(lambda y: np.format_float_positional(y, decy))
-	if has_z:
-		df['z'] = df['z'].map(lambda z: np.format_float_positional(z, decz))
-
-	output = StringIO()
-	df.to_csv(output, sep=dialect.delimiter, header=False, index=has_id)
-	output.seek(0)
-	return output
\ No newline at end of file
+		coords = transformer(*xyz, hatt_ids=hatt_ids)
+
+	with timed('csv_format', len(df)):
+		df['x'] = coords[0]
+		df['y'] = coords[1]
+		if has_z:
+			df['z'] = coords[2]
+
+		# same text as np.format_float_positional(value, decimals) for each value
+		decx, decy, decz = decimals
+		df['x'] = format_fixed(df['x'].values, decx)
+		df['y'] = format_fixed(df['y'].values, decy)
+		if has_z:
+			df['z'] = format_fixed(df['z'].values, decz)
+
+		if hatt_ids is not None:
+			df['hatt_id'] = hatt_ids[0]
+
+		if mark_invalid:
+			df.loc[~valid, ['x', 'y', 'z'] if has_z else ['x', 'y']] = ''
+			if hatt_ids is not None:
+				df['hatt_id'] = np.where(valid, df['hatt_id'].astype(str), '')
+			df['status'] = np.where(valid, 'ok', 'invalid')
+
+		return df.to_csv(sep=delimiter, header=False, index=has_id)
+
+# invalid_points: 'fail' raises for the whole input if any point cannot be transformed,
+# 'mark' empties the coordinates of the invalid rows and appends a status column (ok / invalid)
+# with the automatic hatt block lookup to Hatt, the block id of each row is appended as a column
+def transform(transformer, fp, decimals=(3, 3, 3), fieldnames='x,y', invalid_points='fail'):
+	with timed('csv_read'):
+		df, delimiter, has_id, has_z = _reader(fp, fieldnames)
+	output = StringIO(_transform_frame(transformer, df, decimals, delimiter, has_id, has_z, invalid_points == 'mark'))
+	return output
+
+# Same as transform, but reads, transforms and yields the csv text in chunks of chunksize rows,
+# so memory does not grow with the input size.
+# Note that with invalid_points='fail' an error can happen after some chunks have already been yielded.
+def transform_stream(transformer, fp, decimals=(3, 3, 3), fieldnames='x,y', invalid_points='fail', chunksize=100000):
+	reader, delimiter, has_id, has_z = _reader(fp, fieldnames, chunksize=chunksize)
+	with reader:
+		for df in timed_iter('csv_read', reader):
+			yield _transform_frame(transformer, df, decimals, delimiter, has_id, has_z, invalid_points == 'mark')
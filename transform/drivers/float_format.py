@@ -0,0 +1,83 @@
+import numpy as np
+
+# Vectorized fixed decimals formatting of float arrays for the text drivers.
+#
+# format_fixed(values, decimals) gives the same text as np.format_float_positional(value, decimals)
+# for every value: the shortest representation of the value if it has at most decimals digits
+# (i.e. '1.5', '2.'), otherwise the value rounded half to even to decimals digits, where a rounding
+# up drops the trailing zeros it creates ('1.29999' -> '1.3', '1.0004' -> '1.000').
+#
+# The values are scaled by 10^decimals and rounded to integers, so the digits are assembled
+# in a byte matrix with array operations instead of a python call per value. Values for which the scaled
+# float cannot decide the rounding (ties, huge or non finite values) are formatted by numpy.
+
+_POW10 = 10 ** np.arange(19, dtype=np.int64)
+
+def format_fixed(values, decimals):
+	'''
+	Returns an object array with the text of the values with at most decimals digits.
+	'''
+	x = np.asarray(values, dtype=np.float64)
+	shape = x.shape
+	x = x.ravel()
+	scale = 10.0 ** decimals
+
+	a = np.abs(x)
+	with np.errstate(invalid='ignore', over='ignore'):
+		v = a * scale
+		r = np.rint(v)
+		# a few ulps of v, the error of the scaling
+		tol = v * 2.0**-48
+		# the value has at most decimals digits (its shortest representation is r / scale)
+		exact = r / scale == a
+		rounded_up = r > v
+		undecided = ~np.isfinite(v) | (v >= 2.0**52)
+		undecided |= ~exact & ((np.abs(v - r) <= tol) | (np.abs(v - np.floor(v) - 0.5) <= tol))
+	r[undecided] = 0
+
+	digits = r.astype(np.int64)
+	text = _assemble(np.signbit(x), digits // 10**decimals, digits % 10**decimals, decimals, strip=exact | rounded_up)
+	text = text.astype(object)
+	for i in np.flatnonzero(undecided):
+		text[i] = np.format_float_positional(x[i], decimals)
+	return text.reshape(shape)
+
+def _assemble(negative, integer_part, fraction, decimals, strip):
+	# the characters are written in a (width x n) byte matrix, one row per character position,
+	# right aligned: [sign][integer digits].[fraction digits], with zeros for the unused positions.
+	# then the characters of each value are shifted up over the leading zeros, so that
+	# each column, viewed as a unicode string, ends at the first zero.
+	n = integer_part.size
+	rows = np.arange(n)
+	integer_digits = np.searchsorted(_POW10[1:], integer_part, side='right') + 1
+	max_integer_digits = int(integer_digits.max()) if n else 1
+	width = 1 + max_integer_digits + 1 + decimals
+	chars = np.zeros((width, n), dtype=np.uint8)
+
+	padding = max_integer_digits - integer_digits
+	q = integer_part
+	for i in reversed(range(max_integer_digits)):
+		next_q = q // 10
+		chars[1 + i] = np.where(i >= padding, ord('0') + (q - next_q*10), 0)
+		q = next_q
+	chars[padding[negative], rows[negative]] = ord('-')
+	chars[1 + max_integer_digits] = ord('.')
+
+	if decimals > 0:
+		# trailing zeros of the fraction that are not printed
+		fraction_digits = np.full(n, decimals)
+		for i in range(1, decimals + 1):
+			fraction_digits -= strip & (fraction % _POW10[i] == 0)
+		q = fraction
+		for i in reversed(range(decimals)):
+			next_q = q // 10
+			chars[2 + max_integer_digits + i] = np.where(i < fraction_digits, ord('0') + (q - next_q*10), 0)
+			q = next_q
+
+	shift = padding + 1 - negative
+	flat = chars.ravel()
+	shifted = np.empty_like(chars)
+	for j in range(width):
+		source = j + shift
+		shifted[j] = np.where(source < width, flat[np.minimum(source, width - 1) * n + rows], 0)
+	return np.ascontiguousarray(shifted.T, dtype=np.uint32).view('U%d' % width).ravel()
@@ -0,0 +1,49 @@
+import time, argparse
+import numpy as np
+import pandas as pd
+
+from .float_format import format_fixed
+
+# Benchmarks the csv coordinate formatting: format_fixed against the previous
+# np.format_float_positional per value path, for x, y, z columns in meters (3 decimals)
+# and x, y in degrees (9 decimals) with z in meters, as the transform view uses them.
+# Run from the project folder: python -m transform.drivers.format_benchmark
+
+def legacy_format(df, decimals):
+	# the formatting of csv_driver before format_fixed
+	return {column: df[column].map(lambda v: np.format_float_positional(v, d)) for column, d in zip('xyz', decimals)}
+
+def vectorized_format(df, decimals):
+	return {column: format_fixed(df[column].values, d) for column, d in zip('xyz', decimals)}
+
+def best_time(func, repeat):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+def main():
+	parser = argparse.ArgumentParser(description='csv coordinate formatting benchmark')
+	parser.add_argument('--sizes', default='1e3,1e4,1e5,1e6', help='comma separated row counts')
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	rng = np.random.default_rng(0)
+	print('%10s %10s %14s %14s %8s' % ('rows', 'decimals', 'legacy rows/s', 'vector rows/s', 'speedup'))
+	for size in args.sizes.split(','):
+		n = int(float(size))
+		for decimals, df in [
+			((3, 3, 3), pd.DataFrame({'x': rng.uniform(100000, 900000, n), 'y': rng.uniform(3800000, 4700000, n), 'z': rng.uniform(0, 2000, n)})),
+			((9, 9, 3), pd.DataFrame({'x': rng.uniform(19, 29, n), 'y': rng.uniform(34, 42, n), 'z': rng.uniform(0, 2000, n)})),
+		]:
+			legacy, vectorized = legacy_format(df, decimals), vectorized_format(df, decimals)
+			if any(list(legacy[c]) != list(vectorized[c]) for c in 'xyz'):
+				raise AssertionError('vectorized formatting differs from np.format_float_positional')
+			legacy = best_time(lambda: legacy_format(df, decimals), args.repeat)
+			vectorized = best_time(lambda: vectorized_format(df, decimals), args.repeat)
+			print('%10d %10s %14.0f %14.0f %8.2f' % (n, '%d/%d' % decimals[1:], n/legacy, n/vectorized, legacy/vectorized))
+
+if __name__ == '__main__':
+	main()
@@ -1,25 +1,418 @@
-import geojson
-from shapely.ops import transform as shapely_transform
-from shapely.geometry import shape
-from shapely import speedups
-if speedups.available:
-	speedups.enable()
+import re
+import json
+import numpy as np
 
+from ..timing import timed, timed_iter
 
-def transform(transformer, fp):
-	js = geojson.load(fp)
-	# check type of geojson 
+# nesting levels of the positions in the coordinates of each geometry type
+_POSITION_DEPTH = {
+	'Point': 0,
+	'MultiPoint': 1,
+	'LineString': 1,
+	'MultiLineString': 2,
+	'Polygon': 2,
+	'MultiPolygon': 3,
+}
+
+def _collect_parts(geometry, parts):
+	# appends the parts of the geometry as (container, key, single): container[key] is a list of
+	# positions (a line, a ring or the points of a MultiPoint), or a single position (a Point) if single.
+	# the bbox of the geometry is dropped, it would be in the source system.
+	if geometry is None:
+		return
+	geometry.pop('bbox', None)
+	if geometry['type'] == 'GeometryCollection':
+		for child in geometry['geometries']:
+			_collect_parts(child, parts)
+		return
+	depth = _POSITION_DEPTH[geometry['type']]
+	if depth == 0:
+		parts.append((geometry, 'coordinates', True))
+		return
+	slots = [(geometry, 'coordinates')]
+	for _ in range(depth - 1):
+		slots = [(container[key], i) for container, key in slots for i in range(len(container[key]))]
+	parts.extend((container, key, False) for container, key in slots)
+
+def _part_arrays(parts):
+	'''
+	Returns the parts, the (n, dimension) float64 array of the positions of each list of positions,
+	built by numpy from the list (None for the single positions) and the index of the given part
+	of each part (None if they are the same). Lists of positions of different dimensions are split
+	in their single positions.
+	'''
+	arrays = [None] * len(parts)
+	ragged = set()
+	for i, (container, key, single) in enumerate(parts):
+		if single:
+			continue
+		try:
+			array = np.array(container[key], dtype=np.float64)
+		except ValueError:
+			# positions of different dimensions
+			array = None
+		if array is not None and array.ndim == 2:
+			arrays[i] = array
+		elif array is not None and array.size == 0:
+			arrays[i] = array.reshape(0, 2)
+		else:
+			ragged.add(i)
+	if not ragged:
+		return parts, arrays, None
+
+	split = []
+	split_arrays = []
+	sources = []
+	for i, part in enumerate(parts):
+		if i in ragged:
+			positions = part[0][part[1]]
+			split.extend((positions, j, True) for j in range(len(positions)))
+			split_arrays.extend([None] * len(positions))
+			sources.extend([i] * len(positions))
+		else:
+			split.append(part)
+			split_arrays.append(arrays[i])
+			sources.append(i)
+	return split, split_arrays, sources
+
+def _transform_parts(transformer, parts, arrays, mark_invalid, hatt_ids):
+	'''
+	Transforms the positions of all the parts in place, with one transformer call for the 2d positions
+	and one for the 3d positions (values after z, i.e. m, are kept). Returns the offset of each part
+	in the positions, the validity of each position and the hatt block id of each position (if hatt_ids).
+	'''
+	n = len(parts)
+	single = np.fromiter((array is None for array in arrays), dtype=bool, count=n)
+	singles = np.flatnonzero(single)
+	values = [parts[i][0][parts[i][1]] for i in singles]
+	sizes = np.fromiter((1 if array is None else len(array) for array in arrays), dtype=np.intp, count=n)
+	dimensions = np.fromiter((0 if array is None else array.shape[1] for array in arrays), dtype=np.intp, count=n)
+	dimensions[singles] = np.fromiter((len(value) for value in values), dtype=np.intp, count=len(values))
+	if np.any((dimensions < 2) & (sizes > 0)):
+		raise ValueError('invalid geojson: positions need at least 2 coordinates')
+	offsets = np.zeros(n + 1, dtype=np.intp)
+	np.cumsum(sizes, out=offsets[1:])
+	valid = np.ones(offsets[-1], dtype=bool)
+	position_hatt_ids = np.full(offsets[-1], -1, dtype=np.int64) if hatt_ids else None
+
+	for dimension in [2, 3]:
+		selected = ((dimensions > 2) == (dimension == 3)) & (sizes > 0)
+		single_members = np.flatnonzero(selected[singles])
+		members = np.flatnonzero(selected & ~single)
+		if single_members.size + members.size == 0:
+			continue
+		blocks = []
+		if single_members.size:
+			single_values = [values[i] for i in single_members]
+			if np.all(dimensions[singles[single_members]] == dimension):
+				blocks.append(np.array(single_values, dtype=np.float64))
+			else:
+				blocks.append(np.array([value[:dimension] for value in single_values], dtype=np.float64))
+		blocks.extend(arrays[i][:, :dimension] for i in members)
+		xyz = np.concatenate(blocks).T
+		# the positions of the members among all the positions
+		index = np.concatenate([offsets[singles[single_members]]] + [np.arange(offsets[i], offsets[i+1]) for i in members])
+		call_hatt_ids = [] if hatt_ids else None
+		if mark_invalid:
+			coords, valid[index] = transformer.transform_masked(*xyz, hatt_ids=call_hatt_ids)
+		else:
+			coords = transformer(*xyz, hatt_ids=call_hatt_ids)
+		if hatt_ids:
+			position_hatt_ids[index] = call_hatt_ids[0]
+		coords = np.column_stack(coords)
+
+		single_coords = coords[:single_members.size].tolist()
+		for i, coord in zip(single_members, single_coords):
+			container, key, _ = parts[singles[i]]
+			value = values[i]
+			container[key] = coord + value[dimension:] if len(value) > dimension else coord
+		line_coords = np.split(coords[single_members.size:], np.cumsum(sizes[members])[:-1])
+		for i, part_coords in zip(members, line_coords):
+			container, key, _ = parts[i]
+			if dimensions[i] > dimension:
+				part_coords = np.column_stack([part_coords, arrays[i][:, dimension:]])
+			container[key] = part_coords.tolist()
+	return offsets, valid, position_hatt_ids
+
+def _transform_geometries(transformer, geometries, mark_invalid, hatt_ids):
+	# transforms the geometries together, returns the first position of each geometry (and the end of the
+	# positions), the validity and the hatt block id of each position
+	parts = []
+	starts = []
+	for geometry in geometries:
+		starts.append(len(parts))
+		_collect_parts(geometry, parts)
+	parts, arrays, sources = _part_arrays(parts)
+	offsets, valid, position_hatt_ids = _transform_parts(transformer, parts, arrays, mark_invalid, hatt_ids)
+	if sources is not None:
+		# the first part of each geometry after the split of the parts
+		starts = np.searchsorted(np.array(sources, dtype=np.intp), starts)
+	return offsets[np.append(starts, len(parts)).astype(np.intp)], valid, position_hatt_ids
+
+def transform_features(transformer, features, mark_invalid):
+	'''
+	Transforms the geometries of a batch of features in place, all their vertices together.
+	'''
+	hatt_ids = getattr(transformer, 'outputs_hatt_ids', False)
+	for feat in features:
+		feat.pop('bbox', None)
+	bounds, valid, position_hatt_ids = _transform_geometries(
+		transformer, [feat['geometry'] for feat in features], mark_invalid, hatt_ids)
+	if not (mark_invalid or hatt_ids):
+		return
+
+	# the features without invalid positions
+	invalid_before = np.zeros(valid.size + 1, dtype=np.intp)
+	np.cumsum(~valid, out=invalid_before[1:])
+	features_valid = (invalid_before[bounds[1:]] == invalid_before[bounds[:-1]]).tolist()
+	bounds = bounds.tolist()
+	for feat, start, end, feature_valid in zip(features, bounds[:-1], bounds[1:], features_valid):
+		if feat.get('properties') is None:
+			feat['properties'] = {}
+		if mark_invalid:
+			if not feature_valid:
+				feat['geometry'] = None
+			feat['properties']['transform_status'] = 'ok' if feature_valid else 'invalid'
+		if hatt_ids:
+			# the hatt block of the feature, or the list of blocks if its points are in several blocks
+			ids = sorted(set(int(i) for i in position_hatt_ids[start:end] if i >= 0))
+			feat['properties']['hatt_id'] = ids[0] if len(ids) == 1 else ids
+
+# invalid_points: 'fail' raises for the whole input if any point cannot be transformed,
+# 'mark' nulls the geometry of the features with invalid points and sets their
+# "transform_status" property (ok / invalid). Only features can be marked.
+# With the automatic hatt block lookup to Hatt, features get the "hatt_id" property of their block.
+# The vertices of all the geometries are transformed together, so the number of
+# transformer calls does not grow with the number of features.
+def transform(transformer, fp, invalid_points='fail'):
+	# plain json: geojson.load would round the input coordinates to 6 decimals
+	with timed('geojson_read'):
+		js = json.load(fp)
+	return _transform_document(transformer, js, invalid_points == 'mark')
+
+def _transform_document(transformer, js, mark_invalid):
+	# check type of geojson
 	if js['type'] == 'Feature':
-		js['geometry'] = shapely_transform(transformer, shape(js['geometry'])).__geo_interface__
+		transform_features(transformer, [js], mark_invalid)
 	elif js['type'] == 'FeatureCollection':
-		for feat in js['features']:
-			feat['geometry'] = shapely_transform(transformer, shape(feat['geometry'])).__geo_interface__
-	elif js['type'] == 'GeometryCollection':
-		for i, geom in enumerate(js['geometries']):
-			js['geometries'][i] = shapely_transform(transformer, shape(geom)).__geo_interface__
+		# the bounding boxes would be in the source system
+		js.pop('bbox', None)
+		transform_features(transformer, js['features'], mark_invalid)
 	else: #point, linestring, polygon, multis, geometry collection
-		js = shapely_transform(transformer, shape(js)).__geo_interface__
+		_transform_geometries(transformer, [js], False, False)
 
 	return js
 
-	
\ No newline at end of file
+class _JSONReader(object):
+	'''
+	Incremental reader of a JSON text. Values are decoded from a buffer that is refilled
+	from the file as needed, so only the value being decoded is held in memory.
+	'''
+	# whitespace, and the record separator of geojson text sequences (RFC 8142)
+	_WHITESPACE = re.compile(r'[ \t\n\r\x1e]*')
+	# the longest text that can be cut at the end of the buffer: "Infinity", or a surrogate pair escape
+	_INCOMPLETE_MARGIN = 12
+
+	def __init__(self, fp, read_size=1 << 16):
+		self._fp = fp
+		self._read_size = read_size
+		self._buffer = ''
+		self._pos = 0
+		self._decoder = json.JSONDecoder()
+
+	def _fill(self):
+		# drops the consumed text and reads at least as much as is left, returns False at the end of the file
+		data = self._fp.read(max(self._read_size, len(self._buffer) - self._pos))
+		self._buffer = self._buffer[self._pos:] + data
+		self._pos = 0
+		return bool(data)
+
+	def peek(self):
+		# the next non whitespace character, '' at the end of the file
+		while True:
+			self._pos = self._WHITESPACE.match(self._buffer, self._pos).end()
+			if self._pos < len(self._buffer):
+				return self._buffer[self._pos]
+			if not self._fill():
+				return ''
+
+	def expect(self, chars):
+		c = self.peek()
+		if not c or c not in chars:
+			raise ValueError('invalid json: expected one of "%s"' % chars)
+		self._pos += 1
+		return c
+
+	def decode(self):
+		self.peek()
+		while True:
+			try:
+				value, end = self._decoder.raw_decode(self._buffer, self._pos)
+			except json.JSONDecodeError as e:
+				# maybe the value is not complete yet, errors before the end of the buffer are not
+				# (a string is reported at its start, a truncated literal or escape a few characters before the end)
+				incomplete = e.msg.startswith('Unterminated string') or e.pos >= len(self._buffer) - self._INCOMPLETE_MARGIN
+				if incomplete and self._fill():
+					continue
+				raise
+			# a number at the end of the buffer may continue in the file
+			if end == len(self._buffer) and self._fill():
+				continue
+			self._pos = end
+			return value
+
+def _read_geojson(reader):
+	'''
+	Parses geojson incrementally. Yields ('head', members) and ('tail', members) with the
+	top level members of a FeatureCollection before and after its features, ('feature', feature)
+	for each of its features and ('document', object) for other top level objects
+	(a Feature, a geometry, or the elements of a feature sequence).
+	'''
+	while reader.peek() == '{':
+		reader.expect('{')
+		members = {}
+		in_collection = False
+		end = reader.peek() == '}'
+		while not end:
+			key = reader.decode()
+			reader.expect(':')
+			if key == 'features' and not in_collection:
+				in_collection = True
+				yield 'head', members
+				members = {}
+				reader.expect('[')
+				if reader.peek() == ']':
+					reader.expect(']')
+				else:
+					end_features = False
+					while not end_features:
+						yield 'feature', reader.decode()
+						end_features = reader.expect(',]') == ']'
+			else:
+				members[key] = reader.decode()
+			end = reader.peek() == '}'
+			if not end:
+				reader.expect(',')
+		reader.expect('}')
+		yield ('tail' if in_collection else 'document'), members
+	if reader.peek():
+		raise ValueError('invalid geojson')
+
+class _CollectionWriter(object):
+	# writes the features in a FeatureCollection, with the other members of the input collection
+
+	def __init__(self):
+		self.started = False
+
+	def start(self, members):
+		self.started = True
+		text = '{"type": "FeatureCollection", '
+		for key, value in members.items():
+			# the bbox would be in the source system
+			if key not in ['type', 'bbox']:
+				text += '%s: %s, ' % (json.dumps(key), json.dumps(value, ensure_ascii=False))
+		self._separator = ''
+		return text + '"features": ['
+
+	def features(self, features):
+		if not features:
+			return ''
+		text = self._separator + ', '.join(json.dumps(feat, ensure_ascii=False) for feat in features)
+		self._separator = ', '
+		return text
+
+	def end(self, members):
+		text = ']'
+		for key, value in members.items():
+			if key == 'bbox':
+				continue
+			text += ', %s: %s' % (json.dumps(key), json.dumps(value, ensure_ascii=False))
+		return text + '}'
+
+class _NDJSONWriter(object):
+	# writes one feature per line
+
+	def __init__(self):
+		self.started = False
+
+	def start(self, members):
+		self.started = True
+		return ''
+
+	def features(self, features):
+		return ''.join(json.dumps(feat, ensure_ascii=False) + '\n' for feat in features)
+
+	def end(self, members):
+		return ''
+
+def _as_feature(document):
+	if document.get('type') == 'Feature':
+		return document
+	return {'type': 'Feature', 'properties': None, 'geometry': document}
+
+# Streaming version of transform: reads the features incrementally from fp, transforms them
+# in batches of batch_size and yields the output text as the batches complete, so memory
+# does not grow with the number of features.
+# The output is a FeatureCollection, or newline delimited features (ndjson=True).
+# The input can be a FeatureCollection, or a sequence of features (newline delimited or RFC 8142);
+# a single Feature or geometry is returned as is, as with transform.
+# Nothing is yielded before the first batch is transformed, the start of the output comes with it,
+# so that errors in the first batch happen before the response starts.
+# Note that with invalid_points='fail' an error can happen after the first batches have already been yielded.
+def transform_stream(transformer, fp, invalid_points='fail', batch_size=10000, ndjson=False):
+	mark_invalid = invalid_points == 'mark'
+	writer = _NDJSONWriter() if ndjson else _CollectionWriter()
+	batch = []
+	tail = {}
+	# the start of the output, not yielded yet
+	head = ''
+	# a single top level document is kept until we know if others follow it
+	single = None
+	documents = 0
+
+	for event, value in timed_iter('geojson_read', _read_geojson(_JSONReader(fp))):
+		if event == 'head':
+			if not writer.started:
+				head = writer.start(value)
+			continue
+		elif event == 'tail':
+			tail.update(value)
+			continue
+		elif event == 'document':
+			documents += 1
+			if documents == 1:
+				single = value
+				continue
+			if single is not None:
+				batch.append(_as_feature(single))
+				single = None
+			value = _as_feature(value)
+
+		batch.append(value)
+		if len(batch) >= batch_size:
+			if not writer.started:
+				head = writer.start({})
+			transform_features(transformer, batch, mark_invalid)
+			with timed('geojson_write', len(batch)):
+				text = head + writer.features(batch)
+			yield text
+			head = ''
+			batch = []
+
+	if single is not None:
+		if writer.started:
+			batch.append(_as_feature(single))
+		else:
+			# a single Feature or geometry, transformed as by transform
+			single = _transform_document(transformer, single, mark_invalid)
+			yield json.dumps(single, ensure_ascii=False) + ('\n' if ndjson else '')
+			return
+
+	if not writer.started:
+		head = writer.start({})
+	transform_features(transformer, batch, mark_invalid)
+	with timed('geojson_write', len(batch)):
+		text = head + writer.features(batch)
+	yield text
+	yield writer.end(tail)
+
@@ -0,0 +1,355 @@
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+from urllib.request import pathname2url
+import numpy as np
+import pyproj
+
+from ..timing import timed
+
+# GeoPackage driver: the geometries of all the feature tables are transformed and written
+# to a copy of the input GeoPackage, with its srs metadata updated for the output reference system.
+#
+# Each feature table is read with a cursor in batches of rows. The WKB of the geometries of a batch
+# is concatenated in one buffer, the byte offsets of its coordinates are found (a python loop
+# over the parts of the geometries, not over their vertices), and the coordinates are
+# gathered from / scattered to the buffer as numpy arrays, with one transformer call per batch.
+
+# size of the envelope of the geopackage geometry header for each envelope indicator
+_ENVELOPE_SIZE = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+_EMPTY_FLAG = 0x10
+
+# wkb geometry types
+_POINT, _LINESTRING, _POLYGON = 1, 2, 3
+
+def _parse_header(blob):
+	# returns (header size, envelope (minx, maxx, miny, maxy) or None, empty flag) of a geopackage geometry blob
+	if blob[:2] != b'GP':
+		raise ValueError('invalid geopackage geometry')
+	flags = blob[3]
+	indicator = (flags >> 1) & 0x07
+	if indicator not in _ENVELOPE_SIZE:
+		raise ValueError('invalid geopackage geometry envelope')
+	endian = '<' if flags & 0x01 else '>'
+	envelope = struct.unpack_from(endian + '4d', blob, 8) if indicator else None
+	return 8 + _ENVELOPE_SIZE[indicator], envelope, bool(flags & _EMPTY_FLAG)
+
+def _wkb_type(code):
+	# base geometry type, has z, has m of an iso or extended wkb geometry type code
+	has_z = bool(code & 0x80000000)
+	has_m = bool(code & 0x40000000)
+	code &= 0x0fffffff
+	has_z |= code // 1000 in [1, 3]
+	has_m |= code // 1000 in [2, 3]
+	return code % 1000, has_z, has_m
+
+def _wkb_sequences(wkb, offset, sequences):
+	'''
+	Appends (byte offset, number of points, point size in doubles, has z, big endian) for each
+	coordinate sequence of the wkb geometry at offset. Returns the offset after the geometry.
+	'''
+	endian = '<' if wkb[offset] == 1 else '>'
+	base, has_z, has_m = _wkb_type(struct.unpack_from(endian + 'I', wkb, offset + 1)[0])
+	size = 2 + has_z + has_m
+	offset += 5
+	if base == _POINT:
+		sequences.append((offset, 1, size, has_z, endian == '>'))
+		return offset + 8*size
+	if base == _LINESTRING:
+		n = struct.unpack_from(endian + 'I', wkb, offset)[0]
+		sequences.append((offset + 4, n, size, has_z, endian == '>'))
+		return offset + 4 + 8*size*n
+	if base == _POLYGON:
+		rings = struct.unpack_from(endian + 'I', wkb, offset)[0]
+		offset += 4
+		for _ in range(rings):
+			n = struct.unpack_from(endian + 'I', wkb, offset)[0]
+			sequences.append((offset + 4, n, size, has_z, endian == '>'))
+			offset += 4 + 8*size*n
+		return offset
+	if base in [4, 5, 6, 7]: # multi geometries and geometry collections
+		parts = struct.unpack_from(endian + 'I', wkb, offset)[0]
+		offset += 4
+		for _ in range(parts):
+			offset = _wkb_sequences(wkb, offset, sequences)
+		return offset
+	raise ValueError('unsupported wkb geometry type %d' % base)
+
+class _WKBBatch(object):
+	'''
+	The wkb of a batch of geometries in one buffer, with the byte offsets of their vertices.
+	'''
+	def __init__(self, wkbs):
+		data = b''.join(wkbs)
+		self.starts = np.cumsum([0] + [len(wkb) for wkb in wkbs])
+		sequences = []
+		sequence_counts = []
+		for start in self.starts[:-1]:
+			n_sequences = len(sequences)
+			_wkb_sequences(data, int(start), sequences)
+			sequence_counts.append(len(sequences) - n_sequences)
+		self.buffer = np.frombuffer(data, dtype=np.uint8).copy()
+
+		sequences = np.array(sequences, dtype=np.intp).reshape(-1, 5)
+		counts = sequences[:, 1]
+		first = np.cumsum(counts) - counts
+		position = np.arange(counts.sum()) - np.repeat(first, counts)
+		# byte offset of the x of each vertex, then y and z (if any)
+		self.offsets = np.repeat(sequences[:, 0], counts) + position * np.repeat(sequences[:, 2] * 8, counts)
+		self.has_z = np.repeat(sequences[:, 3], counts).astype(bool)
+		self.big_endian = np.repeat(sequences[:, 4], counts).astype(bool)
+		# the geometry of each vertex
+		self.geometry = np.repeat(np.repeat(np.arange(len(wkbs)), sequence_counts), counts)
+
+	def _byte_index(self, k):
+		# the indices of the bytes of the k-th ordinate (x, y, z of the 3d vertices) of the vertices in the buffer
+		if k < 2:
+			offsets, big_endian = self.offsets + 8*k, self.big_endian
+		else:
+			offsets, big_endian = self.offsets[self.has_z] + 8*k, self.big_endian[self.has_z]
+		index = offsets[:, None] + np.arange(8)
+		index[big_endian] = index[big_endian, ::-1]
+		return index
+
+	def get(self, k):
+		return self.buffer[self._byte_index(k)].view('<f8').ravel()
+
+	def set(self, k, values):
+		self.buffer[self._byte_index(k)] = np.ascontiguousarray(values, dtype='<f8').view(np.uint8).reshape(-1, 8)
+
+	def wkb(self, i):
+		return self.buffer[self.starts[i]:self.starts[i + 1]].tobytes()
+
+def _envelope(blob):
+	# the (minx, maxx, miny, maxy) of a geopackage geometry, from its header or from its vertices
+	header_size, envelope, empty = _parse_header(blob)
+	if empty or envelope is not None:
+		return envelope
+	batch = _WKBBatch([bytes(blob[header_size:])])
+	x, y = batch.get(0), batch.get(1)
+	if x.size == 0:
+		return None
+	return x.min(), x.max(), y.min(), y.max()
+
+def _st_is_empty(blob):
+	if blob is None:
+		return None
+	return _envelope(blob) is None
+
+def _st_function(i):
+	def function(blob):
+		if blob is None:
+			return None
+		envelope = _envelope(blob)
+		return envelope[i] if envelope is not None else None
+	return function
+
+def _register_functions(connection):
+	# the functions used by the triggers of the geopackage rtree spatial index extension
+	connection.create_function('ST_IsEmpty', 1, _st_is_empty, deterministic=True)
+	for i, name in enumerate(['ST_MinX', 'ST_MaxX', 'ST_MinY', 'ST_MaxY']):
+		connection.create_function(name, 1, _st_function(i), deterministic=True)
+
+def _quote(name):
+	return '"%s"' % name.replace('"', '""')
+
+def transform_geometries(transformer, blobs, srs_id, mark_invalid=False):
+	'''
+	Transforms a batch of geopackage geometry blobs (None for null geometries) with one transformer call.
+	Returns the new blobs (with the output srs_id and their envelope), the validity of each geometry
+	(invalid geometries become None with marking) and the hatt block id of each geometry (None if not
+	in a single block) or None if the output is not in automatically found hatt blocks.
+	'''
+	with timed('wkb_decode', len(blobs)):
+		headers = [_parse_header(blob) if blob is not None else None for blob in blobs]
+		# the geometries with coordinates
+		todo = [i for i, header in enumerate(headers) if header is not None and not header[2]]
+		batch = _WKBBatch([bytes(blobs[i][headers[i][0]:]) for i in todo])
+
+	x, y = batch.get(0), batch.get(1)
+	if batch.has_z.any():
+		# one call for all the vertices, zero height for the 2d ones
+		z = np.zeros(x.size)
+		z[batch.has_z] = batch.get(2)
+		xyz = (x, y, z)
+	else:
+		xyz = (x, y)
+	if not mark_invalid and any(np.isnan(c).any() for c in xyz):
+		raise ValueError('missing values')
+
+	hatt_ids = [] if getattr(transformer, 'outputs_hatt_ids', False) else None
+	if mark_invalid:
+		coords, valid = transformer.transform_masked(*xyz, hatt_ids=hatt_ids)
+	else:
+		coords = transformer(*xyz, hatt_ids=hatt_ids)
+		valid = np.ones(x.size, dtype=bool)
+	with timed('wkb_encode', len(blobs)):
+		return _encode_geometries(batch, blobs, headers, todo, coords, valid, hatt_ids, srs_id)
+
+def _encode_geometries(batch, blobs, headers, todo, coords, valid, hatt_ids, srs_id):
+	# the transformed blobs of transform_geometries
+	batch.set(0, coords[0])
+	batch.set(1, coords[1])
+	if len(coords) == 3:
+		batch.set(2, coords[2][batch.has_z])
+
+	# per geometry validity, envelope and hatt block, over the (consecutive) vertices of each geometry
+	n_geometries = len(todo)
+	geometry_valid = np.bincount(batch.geometry[~valid], minlength=n_geometries) == 0
+	counts = np.bincount(batch.geometry, minlength=n_geometries)
+	has_vertices = counts > 0
+	starts = (np.cumsum(counts) - counts)[has_vertices]
+	envelopes = np.full((n_geometries, 4), np.nan)
+	block_ids = np.full(n_geometries, -1, dtype=np.int64)
+	if starts.size:
+		envelopes[has_vertices] = np.column_stack([
+			np.minimum.reduceat(coords[0], starts), np.maximum.reduceat(coords[0], starts),
+			np.minimum.reduceat(coords[1], starts), np.maximum.reduceat(coords[1], starts)])
+		if hatt_ids is not None:
+			lowest = np.minimum.reduceat(hatt_ids[0], starts)
+			highest = np.maximum.reduceat(hatt_ids[0], starts)
+			block_ids[has_vertices] = np.where(lowest == highest, lowest, -1)
+
+	result = list(blobs)
+	all_valid = [True] * len(blobs)
+	all_block_ids = [None] * len(blobs)
+	for j, i in enumerate(todo):
+		all_valid[i] = bool(geometry_valid[j])
+		all_block_ids[i] = int(block_ids[j]) if block_ids[j] >= 0 else None
+		if not all_valid[i]:
+			result[i] = None
+		elif has_vertices[j]:
+			# little endian header with an xy envelope
+			result[i] = struct.pack('<2sBBi4d', b'GP', 0, 0x03, srs_id, *envelopes[j]) + batch.wkb(j)
+		else:
+			result[i] = struct.pack('<2sBBi', b'GP', 0, 0x01, srs_id) + batch.wkb(j)
+	for i, header in enumerate(headers):
+		if header is not None and header[2]:
+			# empty geometries keep their flags, without an envelope
+			result[i] = struct.pack('<2sBBi', b'GP', 0, (blobs[i][3] & 0x30) | 0x01, srs_id) + bytes(blobs[i][header[0]:])
+	return result, all_valid, (all_block_ids if hatt_ids is not None else None)
+
+def _output_srs(connection, transformer):
+	# adds the output reference system to the geopackage and returns its srs_id
+	refsys = transformer.output_refsys
+	proj4text = refsys.proj4text
+	if not proj4text:
+		# the points are in different reference systems (automatic hatt blocks) or an unknown one (procrustes),
+		# -1 is the undefined cartesian srs of every geopackage
+		return -1
+	srid = transformer.to_srid
+	if srid < 1000000:
+		organization, crs = 'EPSG', pyproj.CRS.from_epsg(srid)
+	else:
+		organization, crs = 'SURVGR', pyproj.CRS.from_proj4(proj4text)
+	connection.execute('INSERT OR REPLACE INTO gpkg_spatial_ref_sys '
+		'(srs_name, srs_id, organization, organization_coordsys_id, definition, description) VALUES (?, ?, ?, ?, ?, ?)',
+		(refsys.name, srid, organization, srid, crs.to_wkt(pyproj.enums.WktVersion.WKT1_GDAL), proj4text))
+	return srid
+
+def _add_column(connection, table, column, column_type):
+	columns = [row[1] for row in connection.execute('PRAGMA table_info(%s)' % _quote(table))]
+	if column not in columns:
+		connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (_quote(table), _quote(column), column_type))
+
+def _transform_table(transformer, source, target, table, column, srs_id, mark_invalid, batch_size):
+	# transforms the geometries of a feature table, returns the extent of the transformed geometries
+	assignments = ['%s = ?' % _quote(column)]
+	if mark_invalid:
+		_add_column(target, table, 'transform_status', 'TEXT')
+		assignments.append('transform_status = ?')
+	if getattr(transformer, 'outputs_hatt_ids', False):
+		_add_column(target, table, 'hatt_id', 'INTEGER')
+		assignments.append('hatt_id = ?')
+	update = 'UPDATE %s SET %s WHERE rowid = ?' % (_quote(table), ', '.join(assignments))
+
+	# the rtree spatial index (if any) is filled once at the end, instead of row by row by its triggers
+	rtree = 'rtree_%s_%s' % (table, column)
+	has_rtree = target.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (rtree,)).fetchone() is not None
+	triggers = []
+	if has_rtree:
+		triggers = [(name, sql) for name, sql in target.execute(
+			"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table,)) if name.startswith(rtree + '_')]
+		for name, _ in triggers:
+			target.execute('DROP TRIGGER %s' % _quote(name))
+
+	extent = [np.inf, -np.inf, np.inf, -np.inf]
+	rows = source.execute('SELECT rowid, %s FROM %s' % (_quote(column), _quote(table)))
+	while True:
+		with timed('gpkg_read'):
+			batch = rows.fetchmany(batch_size)
+		if not batch:
+			break
+		rowids = [row[0] for row in batch]
+		blobs, valid, block_ids = transform_geometries(transformer, [row[1] for row in batch], srs_id, mark_invalid)
+		parameters = [blobs]
+		if mark_invalid:
+			parameters.append(['ok' if v else 'invalid' for v in valid])
+		if block_ids is not None:
+			parameters.append(block_ids)
+		with timed('gpkg_write', len(rowids)):
+			target.executemany(update, zip(*parameters, rowids))
+
+		for blob in blobs:
+			envelope = _envelope(blob) if blob is not None else None
+			if envelope is not None:
+				extent = [min(extent[0], envelope[0]), max(extent[1], envelope[1]), min(extent[2], envelope[2]), max(extent[3], envelope[3])]
+
+	if has_rtree:
+		with timed('gpkg_rtree'):
+			# same statement as the one that creates the index in the geopackage specification
+			target.execute('DELETE FROM %s' % _quote(rtree))
+			target.execute('INSERT OR REPLACE INTO %s SELECT rowid, ST_MinX(%s), ST_MaxX(%s), ST_MinY(%s), ST_MaxY(%s) FROM %s '
+				'WHERE %s NOT NULL AND NOT ST_IsEmpty(%s)' % ((_quote(rtree),) + (_quote(column),) * 4 + (_quote(table),) + (_quote(column),) * 2))
+			for _, sql in triggers:
+				target.execute(sql)
+	return extent if np.isfinite(extent).all() else [None] * 4
+
+# invalid_points: 'fail' raises for the whole input if any point cannot be transformed,
+# 'mark' nulls the invalid geometries and adds a "transform_status" column (ok / invalid) to the tables.
+# With the automatic hatt block lookup to Hatt, a "hatt_id" column with the block of each geometry is added
+# (null if its vertices are in several blocks) and the srs of the tables becomes the undefined one.
+def transform_file(transformer, input_path, output_path, invalid_points='fail', batch_size=10000):
+	mark_invalid = invalid_points == 'mark'
+	shutil.copyfile(input_path, output_path)
+	# the input is only read, through its own connection, while the output copy gets updated
+	source = sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(input_path)), uri=True)
+	target = sqlite3.connect(output_path, isolation_level=None)
+	try:
+		_register_functions(target)
+		target.execute('BEGIN')
+		try:
+			srs_id = _output_srs(target, transformer)
+			layers = source.execute('SELECT table_name, column_name FROM gpkg_geometry_columns').fetchall()
+			for table, column in layers:
+				extent = _transform_table(transformer, source, target, table, column, srs_id, mark_invalid, batch_size)
+				target.execute('UPDATE gpkg_geometry_columns SET srs_id = ? WHERE table_name = ?', (srs_id, table))
+				target.execute('UPDATE gpkg_contents SET srs_id = ?, min_x = ?, max_x = ?, min_y = ?, max_y = ?, '
+					"last_change = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE table_name = ?",
+					[srs_id] + extent + [table])
+		except Exception:
+			target.execute('ROLLBACK')
+			raise
+		target.execute('COMMIT')
+	finally:
+		source.close()
+		target.close()
+
+# Same as transform_file for a file object, returns the output geopackage as a temporary file object.
+def transform(transformer, fp, invalid_points='fail', batch_size=10000):
+	directory = tempfile.mkdtemp()
+	try:
+		input_path = os.path.join(directory, 'input.gpkg')
+		output_path = os.path.join(directory, 'output.gpkg')
+		with open(input_path, 'wb') as f:
+			shutil.copyfileobj(fp, f)
+		transform_file(transformer, input_path, output_path, invalid_points=invalid_points, batch_size=batch_size)
+		output = tempfile.TemporaryFile()
+		with open(output_path, 'rb') as f:
+			shutil.copyfileobj(f, output)
+		output.seek(0)
+		return output
+	finally:
+		shutil.rmtree(directory)
@@ -0,0 +1,72 @@
+import numpy as np
+from io import BytesIO
+
+from ..timing import timed
+
+def transform_columns(transformer, x, y, z=None, mark_invalid=False):
+	'''
+	Transforms coordinate columns of the binary drivers. Contiguous float64 columns are passed to
+	the transformer as they are, other columns (e.g. the strided columns of an (n, 3) array)
+	are copied once into contiguous float64 arrays.
+	Returns the transformed coordinates (nan for the invalid points), the validity of the points
+	(None if not mark_invalid) and the hatt block id of each point (None unless the
+	output is in automatically found hatt blocks).
+	'''
+	x = np.ascontiguousarray(x, dtype=np.float64)
+	y = np.ascontiguousarray(y, dtype=np.float64)
+	xyz = (x, y) if z is None else (x, y, np.ascontiguousarray(z, dtype=np.float64))
+	if not mark_invalid and any(np.isnan(column).any() for column in xyz):
+		raise ValueError('missing values')
+
+	hatt_ids = [] if getattr(transformer, 'outputs_hatt_ids', False) else None
+	valid = None
+	if mark_invalid:
+		coords, valid = transformer.transform_masked(*xyz, hatt_ids=hatt_ids)
+		coords = tuple(np.where(valid, column, np.nan) for column in coords)
+	else:
+		coords = transformer(*xyz, hatt_ids=hatt_ids)
+	return coords, valid, (hatt_ids[0] if hatt_ids is not None else None)
+
+# Numpy driver, the input is either:
+#  - an .npy file with a (n, 2) or (n, 3) array of x, y, (z) columns, written back as the same array,
+#  - an .npz archive with the x, y and optional z arrays, written back with the other arrays of the archive
+#    and the "valid" (with invalid_points='mark') and "hatt_id" (with the automatic hatt block lookup to Hatt) arrays,
+#    all in the shape of the x array.
+# Unlike the streaming csv and geojson drivers, the input is loaded and the output is written to a BytesIO
+# as a whole, so both the input and the result of a request are held in memory.
+# invalid_points: 'fail' raises for the whole input if any point cannot be transformed,
+# 'mark' sets the coordinates of the invalid points to nan.
+def transform(transformer, fp, invalid_points='fail'):
+	mark_invalid = invalid_points == 'mark'
+	with timed('npy_read'):
+		data = np.load(fp, allow_pickle=False)
+	output = BytesIO()
+
+	if isinstance(data, np.ndarray):
+		if data.ndim != 2 or data.shape[1] not in [2, 3]:
+			raise ValueError('expected a (n, 2) or (n, 3) array')
+		coords, _, _ = transform_columns(transformer, *data.T, mark_invalid=mark_invalid)
+		with timed('npy_write', data.shape[0]):
+			np.save(output, np.column_stack(coords))
+	else:
+		with data, timed('npy_read'):
+			arrays = {name: data[name] for name in data.files}
+		if 'x' not in arrays or 'y' not in arrays:
+			raise ValueError('expected x and y arrays')
+		shape = arrays['x'].shape
+		if any(arrays[name].shape != shape for name in ['y', 'z'] if name in arrays):
+			raise ValueError('expected x, y and z arrays of the same shape')
+		coords, valid, hatt_ids = transform_columns(transformer,
+			arrays['x'].ravel(), arrays['y'].ravel(), arrays['z'].ravel() if 'z' in arrays else None,
+			mark_invalid=mark_invalid)
+		for name, column in zip(['x', 'y', 'z'], coords):
+			arrays[name] = column.reshape(shape)
+		if hatt_ids is not None:
+			arrays['hatt_id'] = np.asarray(hatt_ids).reshape(shape)
+		if valid is not None:
+			arrays['valid'] = valid.reshape(shape)
+		with timed('npy_write', arrays['x'].size):
+			np.savez(output, **arrays)
+
+	output.seek(0)
+	return output
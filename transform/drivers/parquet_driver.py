@@ -0,0 +1,28 @@
+from io import BytesIO
+
+from .arrow_driver import output_schema, transform_batch, require_pyarrow
+from ..timing import timed, timed_iter
+
+# pyarrow is optional, only needed for the arrow and parquet drivers
+try:
+	import pyarrow.parquet as pq
+except ImportError:
+	pq = None
+
+# Parquet driver, same as the arrow driver: the x, y and optional z columns are transformed
+# and the table is written back as parquet. The row groups are read and transformed in batches of batch_size rows.
+def transform(transformer, fp, invalid_points='fail', batch_size=65536):
+	require_pyarrow()
+	mark_invalid = invalid_points == 'mark'
+	parquet_file = pq.ParquetFile(fp)
+	schema = output_schema(parquet_file.schema_arrow, getattr(transformer, 'outputs_hatt_ids', False), mark_invalid)
+
+	output = BytesIO()
+	with pq.ParquetWriter(output, schema) as writer:
+		for batch in timed_iter('parquet_read', parquet_file.iter_batches(batch_size=batch_size)):
+			batch = transform_batch(transformer, batch, schema, mark_invalid)
+			with timed('parquet_write', batch.num_rows):
+				writer.write_batch(batch)
+
+	output.seek(0)
+	return output
@@ -1,4 +1,6 @@
+import numpy as np
 import pyproj
+from ..proj_pool import proj_pool, pipeline_steps, invert_steps
 
 """
 OKXETransformer transforms projected coordinates of a point
@@ -24,7 +26,7 @@ class OKXETransformer(object):
         A = coeffs[0:6]
         B = coeffs[6:12]
         if iterative_inverse:
-            self._transformer = pyproj.Transformer.from_pipeline('''
+            self._pipeline = '''
                 +proj=pipeline
                 +step +proj=horner +ellps=bessel +deg=2 +range=10000000
                     +fwd_origin=0.0,0.0
@@ -33,11 +35,11 @@ class OKXETransformer(object):
                 '''.format(
                     A0=A[0], A1=A[1], A2=A[2], A3=A[3], A4=A[4], A5=A[5],
                     B0=B[0], B1=B[1], B2=B[2], B3=B[3], B4=B[4], B5=B[5],
-                ))
+                )
         else:
             C = coeffs[12:17]
             D = coeffs[17:22]
-            self._transformer = pyproj.Transformer.from_pipeline('''
+            self._pipeline = '''
                 +proj=pipeline
                 +step +proj=horner +ellps=bessel +deg=2 +range=10000000
                     +fwd_origin=0.0,0.0
@@ -51,10 +53,98 @@ class OKXETransformer(object):
                     B0=B[0], B1=B[1], B2=B[2], B3=B[3], B4=B[4], B5=B[5],
                     C1=C[0], C2=C[1], C3=C[2], C4=C[3], C5=C[4],
                     D1=D[0], D2=D[1], D3=D[2], D4=D[3], D5=D[4]
-                ))
+                )
+        # pipeline transformers are handed out per thread by the proj pool
+        proj_pool.pipeline(self._pipeline)
+
+    def proj_steps(self):
+        # the horner step(s) in the direction of this transformer, used for pipeline fusion
+        steps = pipeline_steps(self._pipeline)
+        return invert_steps(steps) if self._inverse else steps
 
     def __call__(self, x, y, z=None):
+        transformer = proj_pool.pipeline(self._pipeline)
         if (self._inverse):
-            return self._transformer.transform(x, y, z, direction=pyproj.enums.TransformDirection.INVERSE)
+            return transformer.transform(x, y, z, direction=pyproj.enums.TransformDirection.INVERSE)
+        else:
+            return transformer.transform(x, y, z, direction=pyproj.enums.TransformDirection.FORWARD)
+
+def _poly(P, x, y):
+    # okxe polynomial: P0 + P1*x + P2*y + P3*x^2 + P4*y^2 + P5*x*y
+    return P[0] + x*(P[1] + P[3]*x + P[5]*y) + y*(P[2] + P[4]*y)
+
+class OKXEBatchTransformer(object):
+    '''
+    Vectorized version of OKXETransformer for points that belong to different hatt blocks.
+    The coefficients of all the blocks are stacked in a (n_blocks x 22) matrix
+    (see HattblockRegistry.coeffs) and each point selects its own row with a block index.
+    The inverse either uses the C/D coefficients (iterative_inverse=False), or solves
+    the forward polynomials with Newton iterations. Points that do not converge become nan.
+    '''
+    def __init__(self, coeffs, inverse, iterative_inverse=True, tolerance=1e-9, max_iterations=20):
+        coeffs = np.atleast_2d(np.asarray(coeffs, dtype=np.float64))
+        if coeffs.shape[1] < (12 if iterative_inverse or not inverse else 22):
+            raise IndexError('OKXE coefficients missing')
+        self._coeffs = coeffs
+        self._inverse = inverse
+        self._iterative_inverse = iterative_inverse
+        self._tolerance = tolerance
+        self._max_iterations = max_iterations
+
+    def __call__(self, block_index, x, y, z=None):
+        shape = np.broadcast(block_index, x, y).shape
+        block_index = np.broadcast_to(block_index, shape).ravel()
+        x = np.broadcast_to(np.asarray(x, dtype=np.float64), shape).ravel()
+        y = np.broadcast_to(np.asarray(y, dtype=np.float64), shape).ravel()
+        # one gather for all the points, rows of c are the coefficients A0...D5
+        c = self._coeffs.take(block_index, axis=0).T
+        A, B = c[0:6], c[6:12]
+
+        if not self._inverse:
+            x, y = _poly(A, x, y), _poly(B, x, y)
+        elif not self._iterative_inverse:
+            C, D = c[12:17], c[17:22]
+            u, v = x - A[0], y - B[0]
+            x, y = _poly((0.0,) + tuple(C), u, v), _poly((0.0,) + tuple(D), u, v)
         else:
-            return self._transformer.transform(x, y, z, direction=pyproj.enums.TransformDirection.FORWARD)
\ No newline at end of file
+            x, y = self._newton(A, B, x, y)
+
+        x, y = x.reshape(shape)[()], y.reshape(shape)[()]
+        return (x, y) if z is None else (x, y, z)
+
+    def _newton(self, A, B, E, N):
+        # initial guess from the linear part of the polynomials
+        u, v = E - A[0], N - B[0]
+        det = A[1]*B[2] - A[2]*B[1]
+        x = (B[2]*u - A[2]*v) / det
+        y = (A[1]*v - B[1]*u) / det
+
+        converged = np.zeros(x.shape, dtype=bool)
+        active = np.arange(x.size)
+        for _ in range(self._max_iterations):
+            # iterate only the points that have not converged yet
+            a, b = A[:, active], B[:, active]
+            xa, ya = x[active], y[active]
+            fE = _poly(a, xa, ya) - E[active]
+            fN = _poly(b, xa, ya) - N[active]
+            # jacobian of the forward polynomials
+            j11 = a[1] + 2.0*a[3]*xa + a[5]*ya
+            j12 = a[2] + 2.0*a[4]*ya + a[5]*xa
+            j21 = b[1] + 2.0*b[3]*xa + b[5]*ya
+            j22 = b[2] + 2.0*b[4]*ya + b[5]*xa
+            det = j11*j22 - j12*j21
+            dx = (j22*fE - j12*fN) / det
+            dy = (j11*fN - j21*fE) / det
+            x[active] = xa - dx
+            y[active] = ya - dy
+
+            done = (np.abs(dx) < self._tolerance) & (np.abs(dy) < self._tolerance)
+            converged[active[done]] = True
+            active = active[~done & np.isfinite(dx) & np.isfinite(dy)]
+            if active.size == 0:
+                break
+
+        x[~converged] = np.nan
+        y[~converged] = np.nan
+        return x, y
+
@@ -0,0 +1,135 @@
+import threading
+import numpy as np
+
+from .models import Hattblock, OKXECoefficient
+from .proj_generate import proj_text
+from .spatial_index import HattblockIndex
+
+# okxe coefficient types in the order of Hattblock.get_coeffs
+COEFF_TYPES = ['A%d' % i for i in range(6)] + ['B%d' % i for i in range(6)] + \
+	['C%d' % i for i in range(1, 6)] + ['D%d' % i for i in range(1, 6)]
+COEFF_INDEX = {ctype: i for i, ctype in enumerate(COEFF_TYPES)}
+
+class HattblockInfo(object):
+	'''
+	Read only, in-memory copy of a Hattblock row.
+	Can be used in place of a Hattblock model object by the transformers.
+	'''
+	def __init__(self, id, name, center_lon, center_lat, geometry, okxe_id, coeffs):
+		self.id = id
+		self.name = name
+		self.center_lon = center_lon
+		self.center_lat = center_lat
+		self.geometry = geometry
+		self.okxe_id = okxe_id
+		self.coeffs = coeffs # row of the registry coefficient matrix, nan for missing coefficients
+
+	@property
+	def proj4text(self):
+		return proj_text(self.center_lat, self.center_lon)
+
+	def get_coeffs(self):
+		return self.coeffs[~np.isnan(self.coeffs)]
+
+	def get_coeff_dict(self):
+		return {ctype: float(value) for ctype, value in zip(COEFF_TYPES, self.coeffs) if not np.isnan(value)}
+
+	def __str__(self):
+		return self.name
+
+class HattblockRegistry(object):
+	'''
+	Process wide registry of all the hatt blocks with their okxe coefficients
+	stacked in a dense (n_blocks x 22) float64 matrix and a spatial index of their polygons.
+	It is loaded from the database on first use (the database is not available yet while the apps load)
+	and reloaded after it is invalidated by the model save/delete signals.
+	'''
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._data = None
+		self.loads = 0
+		self.invalidations = 0
+
+	def _load(self):
+		rows = Hattblock.objects.order_by('id').values_list(
+			'id', 'name', 'center_lon', 'center_lat', 'geometry', 'okxe_id')
+		ids = [row[0] for row in rows]
+		index = {block_id: i for i, block_id in enumerate(ids)}
+
+		coeffs = np.full((len(ids), len(COEFF_TYPES)), np.nan)
+		for block_id, ctype, value in OKXECoefficient.objects.values_list('block_id', 'type', 'value'):
+			coeffs[index[block_id], COEFF_INDEX[ctype]] = value
+		coeffs.flags.writeable = False
+
+		blocks = [HattblockInfo(*row, coeffs=coeffs[i]) for i, row in enumerate(rows)]
+		spatial_index = HattblockIndex([block.geometry for block in blocks])
+		return blocks, index, coeffs, spatial_index
+
+	def _get_data(self):
+		data = self._data
+		if data is None:
+			with self._lock:
+				if self._data is None:
+					self._data = self._load()
+					self.loads += 1
+				data = self._data
+		return data
+
+	def invalidate(self):
+		with self._lock:
+			self._data = None
+			self.invalidations += 1
+
+	def stats(self):
+		'''
+		Returns the number of loaded blocks (0 if not loaded) and the loads and invalidations of the registry.
+		'''
+		with self._lock:
+			data = self._data
+			return {
+				'size': len(data[0]) if data is not None else 0,
+				'loads': self.loads,
+				'invalidations': self.invalidations,
+			}
+
+	def get(self, id):
+		'''
+		Returns the HattblockInfo with the given id, raises Hattblock.DoesNotExist if there is no such block.
+		'''
+		blocks, index = self._get_data()[:2]
+		try:
+			return blocks[index[int(id)]]
+		except (KeyError, ValueError, TypeError):
+			raise Hattblock.DoesNotExist('Hatt block with id=%s does not exist' % id)
+
+	@property
+	def blocks(self):
+		return self._get_data()[0]
+
+	@property
+	def coeffs(self):
+		return self._get_data()[2]
+
+	def index_of(self, ids):
+		'''
+		Returns the rows of the coefficient matrix for the given block ids.
+		'''
+		index = self._get_data()[1]
+		return np.array([index[int(i)] for i in np.ravel(ids)], dtype=np.intp).reshape(np.shape(ids))
+
+	def snapshot(self):
+		'''
+		Returns the current (blocks, coeffs, spatial_index), consistent with each other
+		even if the registry gets invalidated meanwhile.
+		'''
+		blocks, _, coeffs, spatial_index = self._get_data()
+		return blocks, coeffs, spatial_index
+
+	def locate(self, lon, lat):
+		'''
+		Returns the rows of the coefficient matrix (the positions in blocks) of the blocks
+		that contain the given old greek datum points (longitude from Athens, latitude), -1 if none.
+		'''
+		return self._get_data()[3].locate(lon, lat)
+
+hattblock_registry = HattblockRegistry()
@@ -0,0 +1,90 @@
+import json
+import numpy as np
+
+class HattblockIndex(object):
+	'''
+	Spatial index of the hatt block polygons (Hattblock.geometry, longitude from Athens / latitude
+	in degrees of the old greek datum) for vectorized point in block lookups.
+	A uniform bucket grid holds the candidate blocks of each cell, so that each point
+	is tested only against the few polygons whose bounding box covers its cell.
+	'''
+	def __init__(self, geometries, cell_size=0.25):
+		rings = [np.array(json.loads(geometry)['coordinates'][0], dtype=np.float64) for geometry in geometries]
+		# pad the closed rings to the same number of vertices by repeating their last vertex,
+		# the padding edges have zero length and never cross a ray
+		n_vertices = max(len(ring) for ring in rings) if rings else 1
+		self._vertices = np.zeros((len(rings), n_vertices, 2))
+		for i, ring in enumerate(rings):
+			self._vertices[i, :len(ring)] = ring
+			self._vertices[i, len(ring):] = ring[-1]
+
+		self.cell_size = cell_size
+		if not rings:
+			self._origin = np.zeros(2)
+			self._candidates = np.full((0, 0, 0), -1, dtype=np.intp)
+			return
+
+		lower = self._vertices.min(axis=1)
+		upper = self._vertices.max(axis=1)
+		self._origin = lower.min(axis=0)
+		first_cells = np.floor((lower - self._origin) / cell_size).astype(np.intp)
+		last_cells = np.floor((upper - self._origin) / cell_size).astype(np.intp)
+		cols, rows = last_cells.max(axis=0) + 1
+
+		cells = [[[] for _ in range(cols)] for _ in range(rows)]
+		for i, ((col0, row0), (col1, row1)) in enumerate(zip(first_cells, last_cells)):
+			for row in range(row0, row1 + 1):
+				for col in range(col0, col1 + 1):
+					cells[row][col].append(i)
+
+		# dense (rows, cols, max candidates) array, padded with -1
+		depth = max(len(cell) for row in cells for cell in row)
+		self._candidates = np.full((rows, cols, depth), -1, dtype=np.intp)
+		for row in range(rows):
+			for col in range(cols):
+				self._candidates[row, col, :len(cells[row][col])] = cells[row][col]
+
+	def locate(self, lon, lat):
+		'''
+		Returns the index of the block (in the order of the geometries) that contains each point, -1 if none.
+		'''
+		lon = np.asarray(lon, dtype=np.float64)
+		lat = np.asarray(lat, dtype=np.float64)
+		shape = np.broadcast(lon, lat).shape
+		lon = np.broadcast_to(lon, shape).ravel()
+		lat = np.broadcast_to(lat, shape).ravel()
+		result = np.full(lon.size, -1, dtype=np.intp)
+
+		rows, cols, depth = self._candidates.shape
+		with np.errstate(invalid='ignore'):
+			col = np.floor((lon - self._origin[0]) / self.cell_size)
+			row = np.floor((lat - self._origin[1]) / self.cell_size)
+		# nan coordinates fail the comparisons as well
+		pending = np.flatnonzero((col >= 0) & (col < cols) & (row >= 0) & (row < rows))
+		row = row[pending].astype(np.intp)
+		col = col[pending].astype(np.intp)
+
+		for k in range(depth):
+			candidate = self._candidates[row, col, k]
+			has_candidate = candidate >= 0
+			pending, row, col, candidate = pending[has_candidate], row[has_candidate], col[has_candidate], candidate[has_candidate]
+			if pending.size == 0:
+				break
+			inside = self._contains(candidate, lon[pending], lat[pending])
+			result[pending[inside]] = candidate[inside]
+			pending, row, col = pending[~inside], row[~inside], col[~inside]
+
+		return result.reshape(shape)[()]
+
+	def _contains(self, polygon, x, y):
+		# even-odd rule, each point against its own polygon
+		vertices = self._vertices[polygon]
+		inside = np.zeros(x.shape, dtype=bool)
+		for i in range(vertices.shape[1] - 1):
+			x1, y1 = vertices[:, i, 0], vertices[:, i, 1]
+			x2, y2 = vertices[:, i+1, 0], vertices[:, i+1, 1]
+			crosses = (y1 > y) != (y2 > y)
+			with np.errstate(divide='ignore', invalid='ignore'):
+				x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+			inside ^= crosses & (x < x_cross)
+		return inside
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 from django.test import TestCase
 
-from .models import Hattblock
-from .okxe_transformer import OKXETransformer
+from .models import Hattblock, OKXECoefficient
+from .registry import hattblock_registry
+from .okxe_transformer import OKXETransformer, OKXEBatchTransformer
 
 class OKXETransformTest(TestCase):
 
@@ -82,4 +84,74 @@ class HattBlockTest(TestCase):
         coeffs = [1.0002212,-0.0114449,6.07E-10,-9.42E-10,-5.06E-10,\
             0.0114486,1.0002216,6.77E-10,-3.21E-10,1.70E-09]
         for i,j in zip(coeffs, hb.get_coeffs()[12:22]):
-            self.assertEqual(i, j)
\ No newline at end of file
+            self.assertEqual(i, j)
+
+class HattblockRegistryTest(TestCase):
+
+    def test_registry_matches_db(self):
+        self.assertEqual(len(hattblock_registry.blocks), Hattblock.objects.count())
+        self.assertEqual(hattblock_registry.coeffs.shape, (Hattblock.objects.count(), 22))
+        for hb in Hattblock.objects.all():
+            info = hattblock_registry.get(hb.id)
+            self.assertEqual(info.name, hb.name)
+            self.assertEqual(info.proj4text, hb.proj4text)
+            self.assertEqual(list(info.get_coeffs()), list(hb.get_coeffs()))
+
+    def test_missing_block(self):
+        with self.assertRaises(Hattblock.DoesNotExist):
+            hattblock_registry.get(100000)
+
+    def test_refresh_on_save(self):
+        # the test transaction is rolled back, do not leave the changed coefficient in the registry
+        self.addCleanup(hattblock_registry.invalidate)
+        self.assertEqual(hattblock_registry.get(27).get_coeff_dict()['A0'],
+            OKXECoefficient.objects.get(block_id=27, type='A0').value)
+        c = OKXECoefficient.objects.get(block_id=27, type='A0')
+        c.value += 1.0
+        c.save()
+        self.assertEqual(hattblock_registry.get(27).get_coeff_dict()['A0'], c.value)
+
+class OKXEBatchTransformTest(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.coeffs = hattblock_registry.coeffs
+        self.block_index = rng.integers(0, len(self.coeffs), 5000)
+        self.x = rng.uniform(-20000, 20000, 5000)
+        self.y = rng.uniform(-15000, 15000, 5000)
+
+    def test_matches_okxe_transformer(self):
+        E, N = OKXEBatchTransformer(self.coeffs, inverse=False)(self.block_index, self.x, self.y)
+        x_cd, y_cd = OKXEBatchTransformer(self.coeffs, inverse=True, iterative_inverse=False)(self.block_index, E, N)
+        x_it, y_it = OKXEBatchTransformer(self.coeffs, inverse=True)(self.block_index, E, N)
+        for i in np.unique(self.block_index)[::25]:
+            s = self.block_index == i
+            block_coeffs = hattblock_registry.blocks[i].get_coeffs()
+            E1, N1 = OKXETransformer(block_coeffs, inverse=False)(self.x[s], self.y[s])
+            np.testing.assert_allclose(E[s], E1, rtol=0, atol=1e-6)
+            np.testing.assert_allclose(N[s], N1, rtol=0, atol=1e-6)
+            x1, y1 = OKXETransformer(block_coeffs, inverse=True, iterative_inverse=False)(E1, N1)
+            np.testing.assert_allclose(x_cd[s], x1, rtol=0, atol=1e-6)
+            np.testing.assert_allclose(y_cd[s], y1, rtol=0, atol=1e-6)
+            x1, y1 = OKXETransformer(block_coeffs, inverse=True)(E1, N1)
+            np.testing.assert_allclose(x_it[s], x1, rtol=0, atol=1e-6)
+            np.testing.assert_allclose(y_it[s], y1, rtol=0, atol=1e-6)
+
+    def test_newton_inverse(self):
+        E, N = OKXEBatchTransformer(self.coeffs, inverse=False)(self.block_index, self.x, self.y)
+        E[:10] = np.nan
+        x, y = OKXEBatchTransformer(self.coeffs, inverse=True)(self.block_index, E, N)
+        self.assertTrue(np.isnan(x[:10]).all() and np.isnan(y[:10]).all())
+        np.testing.assert_allclose(x[10:], self.x[10:], rtol=0, atol=1e-6)
+        np.testing.assert_allclose(y[10:], self.y[10:], rtol=0, atol=1e-6)
+
+    def test_single_block(self):
+        coeffs = hattblock_registry.get(27).get_coeffs()
+        x, y, z = OKXEBatchTransformer(coeffs, inverse=False)(0, 1013.0, 1500.0, 10.0)
+        E, N = OKXETransformer(coeffs, inverse=False)(1013.0, 1500.0)
+        self.assertAlmostEqual(x, E, places=6)
+        self.assertAlmostEqual(y, N, places=6)
+        self.assertEqual(z, 10.0)
+        with self.assertRaises(IndexError):
+            OKXEBatchTransformer(coeffs[:12], inverse=True, iterative_inverse=False)
+
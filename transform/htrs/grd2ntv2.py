@@ -0,0 +1,133 @@
+import os, struct
+import numpy as np
+import pyproj
+
+from .grid import GridFile
+from .hepos_transformer import HeposTransformer
+
+# This module converts the Hepos shift grid (htrs07.grb, made from the grd files by grd2bin.py)
+# to a NTv2 horizontal shift grid (htrs07.gsb) that PROJ can apply with +proj=hgridshift.
+# Run from the project folder: python -m transform.htrs.grd2ntv2
+#
+# The Hepos grid holds de, dn shifts in cm on a regular TM07 grid, added after the approximate
+# 7 param. transformation. NTv2 grids are regular in geographic coordinates, so the shifts are
+# resampled on a geographic HTRS07 grid and expressed as the latitude/longitude shift that,
+# applied before the 7 param. transformation, gives the same GGRS87 / TM87 coordinates.
+# Because of the resampling, the PROJ grid deviates from the Hepos grid by a few mm
+# (worst cells ~3 cm where the shifts change rapidly), see the statistics printed at the end.
+
+folder = os.path.dirname(__file__)
+grb_path = os.path.join(folder, "htrs07.grb")
+gsb_path = os.path.join(folder, "htrs07.gsb")
+
+# geographic grid extent and spacing in arc seconds (covers the whole Hepos TM07 grid)
+S_LAT, N_LAT = 34.5*3600, 42.25*3600
+W_LONG, E_LONG = 18.25*3600, 28.75*3600
+LAT_INC, LONG_INC = 60.0, 80.0
+
+GRS80_MAJOR = 6378137.0
+GRS80_MINOR = 6356752.314140356
+
+def record(name, value):
+	# ntv2 header records are 16 bytes: 8 chars name, 8 bytes value
+	name = name.ljust(8).encode('ascii')
+	if isinstance(value, int):
+		return name + struct.pack('<i4x', value)
+	elif isinstance(value, float):
+		return name + struct.pack('<d', value)
+	return name + value.ljust(8).encode('ascii')
+
+def compute_shifts(grid):
+	info = grid.info
+	lats = np.arange(S_LAT, N_LAT + LAT_INC/2, LAT_INC)
+	lons = np.arange(W_LONG, E_LONG + LONG_INC/2, LONG_INC)
+	lon, lat = np.meshgrid(lons/3600.0, lats/3600.0) # rows from south to north, columns from west to east
+	lon, lat = lon.ravel(), lat.ravel()
+	zeros = np.zeros_like(lon)
+
+	to_tm07 = pyproj.Transformer.from_pipeline('''
+		+proj=pipeline
+		+step +proj=unitconvert +xy_in=deg +xy_out=rad
+		+step +proj=tmerc +lat_0=0 +lon_0=24 +k=0.9996 +x_0=500000 +y_0=-2000000 +ellps=GRS80 +units=m
+		''')
+	htrs_geo_to_ggrs_approx = pyproj.Transformer.from_pipeline('''
+		+proj=pipeline
+		+step +proj=unitconvert +xy_in=deg +xy_out=rad
+		''' + HeposTransformer.htrs_geo_to_ggrs_approx)
+	htrs_to_ggrs_approx = pyproj.Transformer.from_pipeline(HeposTransformer.htrs_to_ggrs_approx)
+
+	x, y = to_tm07.transform(lon, lat)
+	# nodes outside the Hepos grid take the shifts of the nearest grid border
+	x_clamped = np.clip(x, info.min_x, info.min_x + (info.cols-1)*info.res - 1e-6)
+	y_clamped = np.clip(y, info.min_y, info.min_y + (info.rows-1)*info.res - 1e-6)
+	de, dn = grid.interpolate(x_clamped, y_clamped)
+
+	# the GGRS87 / TM87 coordinates of each node according to Hepos...
+	g_x, g_y, _ = htrs_to_ggrs_approx.transform(x, y, zeros)
+	g_x += de / 100.0
+	g_y += dn / 100.0
+	# ...and the HTRS07 geographic coordinates that give them without the grid correction
+	s_lon, s_lat, _ = htrs_geo_to_ggrs_approx.transform(g_x, g_y, zeros, direction=pyproj.enums.TransformDirection.INVERSE)
+
+	shape = (lats.size, lons.size)
+	return lats, lons, ((s_lat - lat)*3600.0).reshape(shape), ((s_lon - lon)*3600.0).reshape(shape)
+
+def write_ntv2(path, lats, lons, dlat, dlon):
+	header = b''.join([
+		record('NUM_OREC', 11),
+		record('NUM_SREC', 11),
+		record('NUM_FILE', 1),
+		record('GS_TYPE', 'SECONDS'),
+		record('VERSION', 'NTv2.0'),
+		record('SYSTEM_F', 'HTRS07'),
+		record('SYSTEM_T', 'HGRS87'),
+		record('MAJOR_F', GRS80_MAJOR),
+		record('MINOR_F', GRS80_MINOR),
+		record('MAJOR_T', GRS80_MAJOR),
+		record('MINOR_T', GRS80_MINOR),
+		record('SUB_NAME', 'HEPOS'),
+		record('PARENT', 'NONE'),
+		record('CREATED', ''),
+		record('UPDATED', ''),
+		# ntv2 longitudes are positive west
+		record('S_LAT', float(lats[0])),
+		record('N_LAT', float(lats[-1])),
+		record('E_LONG', float(-lons[-1])),
+		record('W_LONG', float(-lons[0])),
+		record('LAT_INC', LAT_INC),
+		record('LONG_INC', LONG_INC),
+		record('GS_COUNT', lats.size*lons.size),
+	])
+
+	# nodes start at the south east corner, proceeding west along each row, then north
+	# each node: lat shift, lon shift (positive west), lat accuracy, lon accuracy
+	nodes = np.zeros(dlat.shape + (4,), dtype='<f4')
+	nodes[:, :, 0] = dlat
+	nodes[:, :, 1] = -dlon
+	nodes = nodes[:, ::-1, :]
+
+	with open(path, 'wb') as gsb:
+		gsb.write(header)
+		gsb.write(nodes.tobytes())
+		gsb.write(record('END', 0.0))
+
+def check(grid, samples=100000):
+	# compare the PROJ grid with the Hepos grid at random points inside it
+	info = grid.info
+	rng = np.random.default_rng(0)
+	x = rng.uniform(info.min_x, info.min_x + (info.cols-1)*info.res, samples)
+	y = rng.uniform(info.min_y, info.min_y + (info.rows-1)*info.res, samples)
+	z = np.zeros(samples)
+	g_x, g_y, _ = pyproj.Transformer.from_pipeline(HeposTransformer.htrs_to_ggrs_approx).transform(x, y, z)
+	de, dn = grid.interpolate(x, y)
+	g_x += de / 100.0
+	g_y += dn / 100.0
+	p_x, p_y, _ = pyproj.Transformer.from_pipeline(HeposTransformer.htrs_to_ggrs_pipeline(gsb_path)).transform(x, y, z)
+	diff = np.hypot(p_x - g_x, p_y - g_y)
+	print('difference from the Hepos grid (m): mean %.4f, 99%% %.4f, max %.4f' % (
+		diff.mean(), np.percentile(diff, 99), diff.max()))
+
+if __name__ == '__main__':
+	grid = GridFile(grb_path)
+	write_ntv2(gsb_path, *compute_shifts(grid))
+	check(grid)
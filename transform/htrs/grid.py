@@ -1,4 +1,4 @@
-import struct, math
+import os, struct, math, threading
 import numpy as np
 
 class GridInfo(object):
@@ -17,49 +17,121 @@ class GridInfo(object):
 
 class GridFile(object):
 
-	def __init__(self, name):
+	def __init__(self, name, in_memory=False):
 		# read the header
 		with open(name,'rb') as f:
 			self.info = GridInfo(f)
 
 		assert self.info.header_struct.size == 32 # bytes
 
-		# memory map the grid for faster lazy access
 		shape = (self.info.rows, self.info.cols)
 		dtype = [('de', np.float32), ('dn', np.float32)]
-		self._map = np.memmap(name, dtype=dtype, mode='r',
-			offset=self.info.header_struct.size, shape=shape)
+		self.in_memory = in_memory
+		# the (de, dn) float32 pairs of the nodes are read as a flat array of complex64 numbers
+		# (real: de, imag: dn), so that one gather fetches both shifts of a node
+		# and the interpolation arithmetic runs on both shifts at once.
+		if in_memory:
+			# load the whole grid in a contiguous array, no page faults on first reads
+			self._cells = np.fromfile(name, dtype=np.complex64, count=shape[0]*shape[1],
+				offset=self.info.header_struct.size)
+		else:
+			# memory map the grid for faster lazy access, the gathers read only the nodes they need
+			self._cells = np.memmap(name, dtype=np.complex64, mode='r',
+				offset=self.info.header_struct.size, shape=(shape[0]*shape[1],))
+		# the nodes by row and column, a view of the same memory
+		self._map = self._cells.view(dtype).reshape(shape)
 
 	# returns corrections de, dn in centimeters
-	def interpolate(self, x, y):
-		# raises IndexError if out of bounds
-		x = np.asarray(x)
-		y = np.asarray(y)
-
-		pixel_x = (x-self.info.min_x) / self.info.res
-		pixel_y = (y-self.info.min_y) / self.info.res
-
-		pixel_x0 = np.floor(pixel_x).astype(int)
-		pixel_y0 = np.floor(pixel_y).astype(int)
-
-		if np.any((pixel_x0 < 0)) or np.any((pixel_y0 < 0)):
-			raise IndexError
-
-		pixel_x1 = pixel_x0 + 1
-		pixel_y1 = pixel_y0 + 1
-
-		values_ll = self._map[pixel_y0, pixel_x0]
-		values_ul = self._map[pixel_y1, pixel_x0]
-		values_lr = self._map[pixel_y0, pixel_x1]
-		values_ur = self._map[pixel_y1, pixel_x1]
-
-		weight_ll = (pixel_x1-pixel_x) * (pixel_y1-pixel_y)
-		weight_ul = (pixel_x1-pixel_x) * (pixel_y-pixel_y0)
-		weight_lr = (pixel_x-pixel_x0) * (pixel_y1-pixel_y)
-		weight_ur = (pixel_x-pixel_x0) * (pixel_y-pixel_y0)
-
-		dx = weight_ll*values_ll['de'] + weight_ul*values_ul['de'] + weight_lr*values_lr['de'] + weight_ur*values_ur['de']
-		dy = weight_ll*values_ll['dn'] + weight_ul*values_ul['dn'] + weight_lr*values_lr['dn'] + weight_ur*values_ur['dn']
-
-		return (dx, dy)
-
+	# out: optional float64 array with shape (2, *x.shape) that receives de, dn
+	# masked: if True, points outside the grid get nan corrections instead of raising IndexError
+	def interpolate(self, x, y, out=None, masked=False):
+		# raises IndexError if out of bounds (and not masked)
+		x = np.asarray(x, dtype=np.float64)
+		y = np.asarray(y, dtype=np.float64)
+		shape = x.shape
+		info = self.info
+
+		pixel_x = (x.ravel()-info.min_x) / info.res
+		pixel_y = (y.ravel()-info.min_y) / info.res
+
+		# the upper-right corner of each cell must also be inside the grid (nan fails the comparisons)
+		invalid = None
+		if pixel_x.size and not (pixel_x.min() >= 0 and pixel_y.min() >= 0 and
+				pixel_x.max() < info.cols-1 and pixel_y.max() < info.rows-1):
+			if not masked:
+				raise IndexError
+			invalid = ~((pixel_x >= 0) & (pixel_y >= 0) & (pixel_x < info.cols-1) & (pixel_y < info.rows-1))
+			# interpolate the invalid points at the grid origin and discard them below
+			pixel_x[invalid] = 0
+			pixel_y[invalid] = 0
+
+		# truncation is floor for non negative pixels
+		pixel_x0 = pixel_x.astype(np.intp)
+		pixel_y0 = pixel_y.astype(np.intp)
+		pixel_x -= pixel_x0 # fractional parts
+		pixel_y -= pixel_y0
+
+		# flat indices of the 4 corners, gathered in one pass
+		index = np.empty((4, pixel_x0.size), dtype=np.intp)
+		np.multiply(pixel_y0, info.cols, out=index[0])
+		index[0] += pixel_x0
+		np.add(index[0], 1, out=index[1])
+		np.add(index[0], info.cols, out=index[2])
+		np.add(index[2], 1, out=index[3])
+		# the arithmetic runs in double precision, as with the float64 corrections
+		values_ll, values_lr, values_ul, values_ur = self._cells.take(index).astype(np.complex128)
+
+		# bilinear interpolation as two linear interpolations along x and one along y
+		values_lr -= values_ll
+		values_lr *= pixel_x
+		values_lr += values_ll
+		values_ur -= values_ul
+		values_ur *= pixel_x
+		values_ur += values_ul
+		values_ur -= values_lr
+		values_ur *= pixel_y
+		values_ur += values_lr
+
+		if invalid is not None:
+			values_ur[invalid] = complex(np.nan, np.nan)
+
+		if out is None:
+			out = np.empty((2,) + shape, dtype=np.float64)
+		out[0] = values_ur.real.reshape(shape)
+		out[1] = values_ur.imag.reshape(shape)
+		return (out[0][()], out[1][()])
+
+_grids = {}
+_grids_lock = threading.Lock()
+# lookups of get_grid served by an already mapped or loaded grid, and grids mapped or loaded
+_grids_counts = [0, 0]
+
+def get_grid(name, in_memory=False):
+	'''
+	Returns the process wide GridFile of the given grid path, mapping it once on first use.
+	If in_memory is requested for an already mapped grid, the grid is reloaded in RAM.
+	'''
+	key = os.path.abspath(name)
+	with _grids_lock:
+		grid = _grids.get(key)
+		if grid is None or (in_memory and not grid.in_memory):
+			grid = _grids[key] = GridFile(name, in_memory)
+			_grids_counts[1] += 1
+		else:
+			_grids_counts[0] += 1
+		return grid
+
+def grid_stats():
+	'''
+	Returns the hits and loads of get_grid, the number of grids and their bytes in RAM and memory mapped.
+	'''
+	with _grids_lock:
+		grids = list(_grids.values())
+		hits, loads = _grids_counts
+	return {
+		'hits': hits,
+		'loads': loads,
+		'size': len(grids),
+		'memory_bytes': sum(grid._cells.nbytes for grid in grids if grid.in_memory),
+		'mapped_bytes': sum(grid._cells.nbytes for grid in grids if not grid.in_memory),
+	}
@@ -0,0 +1,72 @@
+import os, time, argparse
+import numpy as np
+
+from .grid import GridFile
+
+# Benchmarks GridFile.interpolate against the previous interpolation routine.
+# Run from the project folder: python -m transform.htrs.grid_benchmark
+
+def legacy_interpolate(grid, x, y):
+	# the interpolation routine of GridFile before the single gather kernel
+	x = np.asarray(x)
+	y = np.asarray(y)
+
+	pixel_x = (x-grid.info.min_x) / grid.info.res
+	pixel_y = (y-grid.info.min_y) / grid.info.res
+
+	pixel_x0 = np.floor(pixel_x).astype(int)
+	pixel_y0 = np.floor(pixel_y).astype(int)
+
+	if np.any((pixel_x0 < 0)) or np.any((pixel_y0 < 0)):
+		raise IndexError
+
+	pixel_x1 = pixel_x0 + 1
+	pixel_y1 = pixel_y0 + 1
+
+	values_ll = grid._map[pixel_y0, pixel_x0]
+	values_ul = grid._map[pixel_y1, pixel_x0]
+	values_lr = grid._map[pixel_y0, pixel_x1]
+	values_ur = grid._map[pixel_y1, pixel_x1]
+
+	weight_ll = (pixel_x1-pixel_x) * (pixel_y1-pixel_y)
+	weight_ul = (pixel_x1-pixel_x) * (pixel_y-pixel_y0)
+	weight_lr = (pixel_x-pixel_x0) * (pixel_y1-pixel_y)
+	weight_ur = (pixel_x-pixel_x0) * (pixel_y-pixel_y0)
+
+	dx = weight_ll*values_ll['de'] + weight_ul*values_ul['de'] + weight_lr*values_lr['de'] + weight_ur*values_ur['de']
+	dy = weight_ll*values_ll['dn'] + weight_ul*values_ul['dn'] + weight_lr*values_lr['dn'] + weight_ur*values_ur['dn']
+
+	return (dx, dy)
+
+def best_time(func, repeat):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+def main():
+	parser = argparse.ArgumentParser(description='Hepos grid interpolation benchmark')
+	parser.add_argument('--sizes', default='1e4,1e5,1e6,1e7', help='comma separated point counts')
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--in-memory', action='store_true', help='load the grid in RAM instead of memory mapping it')
+	args = parser.parse_args()
+
+	grid = GridFile(os.path.join(os.path.dirname(__file__), 'htrs07.grb'), in_memory=args.in_memory)
+	info = grid.info
+	rng = np.random.default_rng(0)
+
+	print('%10s %14s %14s %8s' % ('points', 'legacy pts/s', 'kernel pts/s', 'speedup'))
+	for size in args.sizes.split(','):
+		n = int(float(size))
+		x = rng.uniform(info.min_x, info.min_x + (info.cols-1)*info.res, n)
+		y = rng.uniform(info.min_y, info.min_y + (info.rows-1)*info.res, n)
+		out = np.empty((2, n))
+
+		legacy = best_time(lambda: legacy_interpolate(grid, x, y), args.repeat)
+		kernel = best_time(lambda: grid.interpolate(x, y, out=out), args.repeat)
+		print('%10d %14.0f %14.0f %8.2f' % (n, n/legacy, n/kernel, legacy/kernel))
+
+if __name__ == '__main__':
+	main()
@@ -1,6 +1,8 @@
 import os
 import pyproj
-from .grid import GridFile
+from django.conf import settings
+from .grid import get_grid
+from ..proj_pool import proj_pool, pipeline_steps, invert_steps
 
 class HeposTransformer(object):
 	'''
@@ -9,43 +11,85 @@ class HeposTransformer(object):
 	or from GGRS87 / GG to HTRS / TM07 (inverse=True)
 	'''
 	grid_path = os.path.join(os.path.dirname(__file__), "htrs07.grb")
+	# the same grid converted to a PROJ horizontal shift grid by grd2ntv2.py
+	proj_grid_path = os.path.join(os.path.dirname(__file__), "htrs07.gsb")
 
-	def __init__(self, inverse):
-		# grid containing the shifts de, dn in cm
-		self._grid = GridFile(self.grid_path)
-		self._inverse = inverse
-		# extended better ggrs - htrs 7 param. transformation provided by Hepos service
-		self._htrs_to_ggrs_approx = pyproj.Transformer.from_pipeline(
-			'''
-			+proj=pipeline
-			+step +inv +proj=tmerc +lat_0=0 +lon_0=24 +k=0.9996 +x_0=500000 +y_0=-2000000 +ellps=GRS80 +units=m
+	tm07 = '+proj=tmerc +lat_0=0 +lon_0=24 +k=0.9996 +x_0=500000 +y_0=-2000000 +ellps=GRS80 +units=m'
+
+	# extended better ggrs - htrs 7 param. transformation provided by Hepos service
+	# (pipeline steps starting from htrs geographic coordinates)
+	htrs_geo_to_ggrs_approx = '''
 			+step +proj=cart
 			+step +proj=helmert +convention=coordinate_frame
 				+x=203.437 +y=-73.461 +z=-243.594
 				+rx=-0.170 +ry=-0.060 +rz=-0.151 +s=-0.294
 			+step +inv +proj=cart
 			+step +proj=tmerc +lat_0=0 +lon_0=24 +k=0.9996 +x_0=500000 +y_0=0 +ellps=GRS80 +units=m
-			''')
+			'''
+
+	htrs_to_ggrs_approx = '+proj=pipeline +step +inv ' + tm07 + htrs_geo_to_ggrs_approx
+
+	@classmethod
+	def htrs_to_ggrs_pipeline(cls, proj_grid_path):
+		# the approximate transformation together with the grid shift, entirely in PROJ
+		return '+proj=pipeline +step +inv %s +step +proj=hgridshift +grids="%s" %s' % (
+			cls.tm07, proj_grid_path, cls.htrs_geo_to_ggrs_approx)
 
-	def __call__(self, x, y, z=None):
+	# mode: 'grid' applies the Hepos grid shifts with numpy after the approximate transformation,
+	# 'proj' runs everything as one PROJ pipeline with the converted grid (few mm deviations, see grd2ntv2.py)
+	def __init__(self, inverse, mode='grid'):
+		self._inverse = inverse
+		self._mode = mode
+		if mode == 'grid':
+			# grid containing the shifts de, dn in cm, shared by all instances
+			self._grid = self.load_grid()
+			self._pipeline = self.htrs_to_ggrs_approx
+		elif mode == 'proj':
+			self._grid = None
+			self._pipeline = self.htrs_to_ggrs_pipeline(self.proj_grid_path)
+		else:
+			raise ValueError('Parameter Error: unknown hepos mode "%s"' % mode)
+		# pipeline transformers are handed out per thread by the proj pool
+		proj_pool.pipeline(self._pipeline)
+
+	@classmethod
+	def load_grid(cls):
+		return get_grid(cls.grid_path, in_memory=getattr(settings, 'HEPOS_GRID_IN_MEMORY', False))
+
+	# masked calls give nan coordinates for points outside the grid instead of raising IndexError
+	supports_masked = True
+
+	def proj_steps(self):
+		# only the proj mode can be fused with other PROJ steps
+		if self._mode != 'proj':
+			return None
+		steps = pipeline_steps(self._pipeline)
+		return invert_steps(steps) if self._inverse else steps
+
+	def __call__(self, x, y, z=None, masked=False):
 		grid = self._grid
+		htrs_to_ggrs_approx = proj_pool.pipeline(self._pipeline)
+		if grid is None: # proj mode, points outside the grid get inf coordinates
+			direction = pyproj.enums.TransformDirection.INVERSE if self._inverse else pyproj.enums.TransformDirection.FORWARD
+			return htrs_to_ggrs_approx.transform(x, y, z, direction=direction)
+
 		if self._inverse: #ggrs -> htrs
 			# first apply the approximate tranformation
-			h_xyz = self._htrs_to_ggrs_approx.transform(x, y, z, direction=pyproj.enums.TransformDirection.INVERSE)
+			h_xyz = htrs_to_ggrs_approx.transform(x, y, z, direction=pyproj.enums.TransformDirection.INVERSE)
 			h_x, h_y = h_xyz[0], h_xyz[1]
 			# we need to interpolate with htrs coords
-			de, dn = grid.interpolate(h_x, h_y)
+			de, dn = grid.interpolate(h_x, h_y, masked=masked)
 			h_x -= de / 100.0
 			h_y -= dn / 100.0
 			return h_xyz
 
 		else: # htrs -> ggrs
 			# first apply the approximate transformation
-			g_xyz = self._htrs_to_ggrs_approx.transform(x, y, z, direction=pyproj.enums.TransformDirection.FORWARD)
+			g_xyz = htrs_to_ggrs_approx.transform(x, y, z, direction=pyproj.enums.TransformDirection.FORWARD)
 			# then apply shift correction
 			g_x, g_y = g_xyz[0], g_xyz[1]
 			#again we need to interpolate with htrs coords
-			de, dn = grid.interpolate(x, y)
+			de, dn = grid.interpolate(x, y, masked=masked)
 			g_x += de / 100.0
 			g_y += dn / 100.0
 			return g_xyz
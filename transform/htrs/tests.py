@@ -1,7 +1,9 @@
 import os
 import numpy as np
 from django.test import TestCase
-from .grid import GridFile
+from .grid import GridFile, get_grid
+from .hepos_transformer import HeposTransformer
+from .grid_benchmark import legacy_interpolate
 
 class HTRSGridFileTest(TestCase):
 
@@ -79,3 +81,53 @@ class HTRSGridFileTest(TestCase):
 		self.assertEqual(round(de[1]/100, 3), -0.122)
 		self.assertEqual(round(dn[1]/100, 3), -0.184)
 
+	def test_in_memory_grid(self):
+		self.setup()
+		grid = GridFile(os.path.join(os.path.dirname(__file__), "htrs07.grb"), in_memory=True)
+		self.assertTrue(grid._map.flags['C_CONTIGUOUS'])
+		self.assertFalse(isinstance(grid._map, np.memmap))
+		# the nodes are loaded once, the interpolation gathers from them
+		self.assertTrue(np.shares_memory(grid._map, grid._cells))
+		self.assertTrue(isinstance(self.grid._cells, np.memmap))
+		x = [41600.0+2000, 566446.108]
+		y = [1845619.0+2000, 2529618.096]
+		self.assertTrue(np.array_equal(grid.interpolate(x, y), self.grid.interpolate(x, y)))
+
+	def test_interpolate_kernel(self):
+		self.setup()
+		rng = np.random.default_rng(0)
+		info = self.grid.info
+		x = rng.uniform(info.min_x, info.min_x + (info.cols-1)*info.res, 1000)
+		y = rng.uniform(info.min_y, info.min_y + (info.rows-1)*info.res, 1000)
+		de_ref, dn_ref = legacy_interpolate(self.grid, x, y)
+
+		out = np.empty((2, 1000))
+		de, dn = self.grid.interpolate(x, y, out=out)
+		self.assertTrue(np.shares_memory(de, out))
+		self.assertTrue(np.allclose(de, de_ref, rtol=0, atol=1e-9))
+		self.assertTrue(np.allclose(dn, dn_ref, rtol=0, atol=1e-9))
+
+		de, dn = self.grid.interpolate(x.reshape(10, 100), y.reshape(10, 100))
+		self.assertEqual(de.shape, (10, 100))
+		self.assertTrue(np.array_equal(de.ravel(), out[0]))
+
+		with self.assertRaises(IndexError):
+			self.grid.interpolate([x[0], np.nan], [y[0], y[1]])
+
+	def test_masked_out_of_bounds(self):
+		self.setup()
+		x = [0, 41600.0, 41600.0+421*2000, np.nan]
+		y = [0, 1845619.0, 1845619.0, 1845619.0]
+		de, dn = self.grid.interpolate(x, y, masked=True)
+		self.assertEqual(list(np.isnan(de)), [True, False, True, True])
+		self.assertEqual(list(np.isnan(dn)), [True, False, True, True])
+		self.assertEqual(round(de[1], 2), -33.20)
+		self.assertEqual(round(dn[1], 2), -38.75)
+
+class HTRSGridRegistryTest(TestCase):
+
+	def test_shared_grid(self):
+		t1 = HeposTransformer(inverse=False)
+		t2 = HeposTransformer(inverse=True)
+		self.assertIs(t1._grid, t2._grid)
+		self.assertIs(t1._grid, get_grid(HeposTransformer.grid_path))
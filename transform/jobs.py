@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Background transformation jobs, for files too large for a synchronous request.
+#
+# Each job is a directory in TRANSFORM_JOBS_DIR with its uploaded files, a job.json with
+# its form fields, state and progress, and its result when done. The state is kept only
+# in the filesystem, so any process can report the status of a job and send its result,
+# while the job runs in the pool of worker threads of the process that accepted it.
+# Finished jobs are deleted TRANSFORM_JOBS_TTL seconds after they finish.
+#
+# A maintenance thread of each process that uses the queue keeps touching the job.json of
+# its queued and running jobs and periodically cleans up the directory. Jobs that have not
+# been touched for TRANSFORM_JOBS_STALE_TIMEOUT seconds were lost with their process
+# (i.e. a restart): queued jobs are claimed and run by the process that finds them,
+# running jobs (and jobs lost again after they were claimed) are marked as failed, so that they expire too.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# the file fields of the api, the only uploaded files that are stored, under these names
+FILE_FIELDS = ['input', 'procrustes']
+
+class UploadTooLarge(ValueError):
+	pass
+
+# response headers that are kept with the result
+_RESULT_HEADERS = ['X-Transformation-Steps', 'Content-Disposition']
+
+class _StoredFile(object):
+	# stands in for an uploaded file with a stored job file
+	def __init__(self, path, content_type):
+		self.file = open(path, 'rb')
+		self.content_type = content_type
+		self.size = os.path.getsize(path)
+
+	def read(self, *args):
+		return self.file.read(*args)
+
+class JobQueue(object):
+	'''
+	Filesystem backed queue of transformation jobs, run by a local thread pool.
+	runner is the import path of run(fields, files), that returns the response of a job.
+	'''
+	def __init__(self, runner='transform.views.run_transform'):
+		self.runner = runner
+		self._lock = threading.Lock()
+		self._executor = None
+		# the ids of the queued and running jobs of this process, kept alive by the maintenance thread
+		self._active = set()
+		self._maintenance = None
+
+	@property
+	def directory(self):
+		return getattr(settings, 'TRANSFORM_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'survgr-jobs'))
+
+	@property
+	def ttl(self):
+		return getattr(settings, 'TRANSFORM_JOBS_TTL', 3600)
+
+	@property
+	def stale_timeout(self):
+		return getattr(settings, 'TRANSFORM_JOBS_STALE_TIMEOUT', 60)
+
+	@property
+	def max_upload_size(self):
+		# bytes of the uploaded files of a job
+		return getattr(settings, 'TRANSFORM_JOBS_MAX_UPLOAD_SIZE', 1 << 30)
+
+	def _get_executor(self):
+		with self._lock:
+			if self._executor is None:
+				self._executor = ThreadPoolExecutor(max_workers=getattr(settings, 'TRANSFORM_JOBS_WORKERS', 2),
+					thread_name_prefix='transform-job')
+			return self._executor
+
+	def _path(self, job_id, *names):
+		return os.path.join(self.directory, job_id, *names)
+
+	def _save(self, job):
+		# atomic, so that the status is never read half written
+		path = self._path(job['id'], 'job.json')
+		with open(path + '.tmp', 'w', encoding='utf-8') as f:
+			json.dump(job, f, ensure_ascii=False)
+		os.replace(path + '.tmp', path)
+
+	def _load(self, job_id):
+		# the state of the job, lost jobs are resumed or marked as failed
+		path = self._path(job_id, 'job.json')
+		try:
+			with open(path, encoding='utf-8') as f:
+				job = json.load(f)
+			touched = os.path.getmtime(path)
+		except (OSError, ValueError):
+			return None
+		if job.get('status') in [QUEUED, RUNNING] and touched < time.time() - self.stale_timeout:
+			with self._lock:
+				lost = job_id not in self._active
+			if lost and not (job['status'] == QUEUED and self._claim(job, touched)):
+				job['status'] = FAILED
+				job['error'] = 'the job was interrupted, the server was restarted'
+				job['finished'] = time.time()
+				job['expires'] = job['finished'] + self.ttl
+				self._save(job)
+		return job
+
+	def _claim(self, job, touched):
+		# queues a lost job in this process, the claim directory is created by only one process.
+		# returns False if the job cannot be resumed (it was claimed before and lost again)
+		claim = self._path(job['id'], 'claim')
+		try:
+			os.mkdir(claim)
+		except FileExistsError:
+			# claimed by another process since it was lost, or claimed before it was lost again
+			try:
+				return os.path.getmtime(claim) > touched
+			except OSError:
+				return False
+		except OSError:
+			return False
+		self._queue(job)
+		return True
+
+	def _queue(self, job):
+		self._save(job)
+		self._keep_alive(job['id'], True)
+		self._get_executor().submit(self._run, job, import_string(self.runner))
+
+	def get(self, job_id):
+		'''
+		Returns the state of the job (a dict), None if there is no such job or it has expired.
+		'''
+		self.start()
+		job = self._load(job_id)
+		if job is None:
+			return None
+		if job.get('expires') is not None and job['expires'] < time.time():
+			return None
+		return job
+
+	def start(self):
+		'''
+		Starts the maintenance thread of the process, on the first use of the queue.
+		Its first cleanup resumes the lost queued jobs.
+		'''
+		with self._lock:
+			if self._maintenance is None:
+				self._maintenance = threading.Thread(target=self._maintain, name='transform-job-maintenance', daemon=True)
+				self._maintenance.start()
+
+	def _keep_alive(self, job_id, active):
+		# adds (or removes) a job of this process
+		with self._lock:
+			if active:
+				self._active.add(job_id)
+			else:
+				self._active.discard(job_id)
+
+	def _maintain(self):
+		while True:
+			try:
+				self.cleanup()
+			except Exception:
+				logger.exception('cleanup of the transformation jobs failed')
+			time.sleep(self.stale_timeout / 4)
+			with self._lock:
+				job_ids = list(self._active)
+			for job_id in job_ids:
+				try:
+					os.utime(self._path(job_id, 'job.json'))
+				except OSError:
+					pass
+
+	def submit(self, fields, files):
+		'''
+		Stores the form fields and the uploaded files of a new job and queues it.
+		Returns the state of the job. Raises ValueError for files of other fields than FILE_FIELDS
+		and UploadTooLarge if the files are larger than max_upload_size.
+		'''
+		unknown = sorted(set(files) - set(FILE_FIELDS))
+		if unknown:
+			raise ValueError('unexpected file fields: %s' % ', '.join(unknown))
+		if sum(files[name].size for name in files) > self.max_upload_size:
+			raise UploadTooLarge('the files of a job are limited to %d bytes' % self.max_upload_size)
+		self.start()
+		self.cleanup()
+		job_id = uuid.uuid4().hex
+		os.makedirs(self._path(job_id, 'files'))
+		stored = {}
+		for name in FILE_FIELDS:
+			if name not in files:
+				continue
+			upload = files[name]
+			with open(self._path(job_id, 'files', name), 'wb') as f:
+				for chunk in upload.chunks():
+					f.write(chunk)
+			stored[name] = upload.content_type
+		job = {
+			'id': job_id,
+			'status': QUEUED,
+			'fields': dict(fields),
+			'files': stored,
+			'created': time.time(),
+			'started': None,
+			'finished': None,
+			'expires': None,
+			'error': None,
+			'progress': {'input_bytes': 0, 'input_size': 0, 'output_bytes': 0, 'chunks': 0},
+			'result': None,
+		}
+		self._queue(job)
+		return job
+
+	def _run(self, job, run):
+		job['status'] = RUNNING
+		job['started'] = time.time()
+		self._save(job)
+		files = {name: _StoredFile(self._path(job['id'], 'files', name), content_type) for name, content_type in job['files'].items()}
+		progress = job['progress']
+		if 'input' in files:
+			progress['input_size'] = files['input'].size
+		try:
+			# the chunked drivers keep the memory flat, the result is the same
+			fields = dict(job['fields'], stream='true')
+			response = run(fields, files)
+			if response.status_code != 200:
+				raise ValueError(response.content.decode('utf-8', 'replace') or 'failed')
+			saved = time.time()
+			with open(self._path(job['id'], 'result'), 'wb') as f:
+				for chunk in (response.streaming_content if response.streaming else [response.content]):
+					f.write(chunk)
+					progress['chunks'] += 1
+					progress['output_bytes'] += len(chunk)
+					if 'input' in files:
+						progress['input_bytes'] = files['input'].file.tell()
+					# the progress is saved at most every half second
+					if time.time() - saved > 0.5:
+						saved = time.time()
+						self._save(job)
+			response.close()
+			if 'input' in files:
+				progress['input_bytes'] = progress['input_size']
+			job['result'] = {
+				'content_type': response['Content-Type'],
+				'headers': {name: response[name] for name in _RESULT_HEADERS if response.has_header(name)},
+			}
+			job['status'] = DONE
+		except Exception as e:
+			job['status'] = FAILED
+			job['error'] = str(e)
+		finally:
+			for stored in files.values():
+				stored.file.close()
+		job['finished'] = time.time()
+		job['expires'] = job['finished'] + self.ttl
+		self._save(job)
+		self._keep_alive(job['id'], False)
+
+	def result_path(self, job_id):
+		return self._path(job_id, 'result')
+
+	def cleanup(self):
+		'''
+		Deletes the expired jobs (and resumes or fails the lost jobs).
+		'''
+		try:
+			job_ids = os.listdir(self.directory)
+		except FileNotFoundError:
+			return
+		now = time.time()
+		for job_id in job_ids:
+			job = self._load(job_id)
+			if job is None:
+				continue
+			expires = job.get('expires')
+			if expires is not None and expires < now:
+				shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+job_queue = JobQueue()
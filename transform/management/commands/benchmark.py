@@ -0,0 +1,234 @@
+import io
+import os
+import json
+import time
+import platform
+import statistics
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyproj
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from transform.transform import WorkHorseTransformer, get_transformer, HATT_NEW_SRID, HATT_OLD_SRID, NEW_BESSEL_SRID, TM87_SRID, TM07_SRID
+from transform.hatt.registry import hattblock_registry
+from transform.drivers import csv_driver, geojson_driver
+from transform.drivers.float_format import format_fixed
+
+# the distinct routes of WorkHorseTransformer._compile: name, parameters and the region of the points
+# ('greece': around all the hatt blocks, 'block': around the hatt block of the benchmark)
+ROUTES = [
+	('same_datum', dict(from_srid=TM87_SRID, to_srid=4121), 'greece'),
+	('htrs07_to_hgrs87_hepos', dict(from_srid=TM07_SRID, to_srid=TM87_SRID), 'greece'),
+	('hgrs87_to_htrs07_hepos', dict(from_srid=TM87_SRID, to_srid=TM07_SRID), 'greece'),
+	('htrs07_to_hgrs87_hepos_proj', dict(from_srid=TM07_SRID, to_srid=TM87_SRID, hepos_mode='proj'), 'greece'),
+	('hatt_to_hgrs87_okxe', dict(from_hatt_id='block', to_srid=TM87_SRID), 'block'),
+	('hgrs87_to_hatt_okxe_iterative', dict(from_srid=TM87_SRID, to_hatt_id='block', okxe_inverse_type='iterative'), 'block'),
+	('hgrs87_to_hatt_okxe_coeffs', dict(from_srid=TM87_SRID, to_hatt_id='block', okxe_inverse_type='coeffs'), 'block'),
+	('tm3_to_hgrs87_okxe_auto', dict(from_srid=1000002, from_hatt_id='auto', to_srid=TM87_SRID), 'greece'),
+	('hgrs87_to_hatt_okxe_auto', dict(from_srid=TM87_SRID, to_hatt_id='auto'), 'greece'),
+	('hgrs87_to_wgs84_approx', dict(from_srid=TM87_SRID, to_srid=4326), 'greece'),
+	('hgrs87_to_ed50_approx', dict(from_srid=TM87_SRID, to_srid=23034), 'greece'),
+	('old_bessel_centroid_to_hgrs87', dict(from_srid=HATT_OLD_SRID, from_hatt_centroid='block', to_srid=TM87_SRID), 'block'),
+]
+
+# end to end driver runs, on the points of the htrs07 to hgrs87 route
+DRIVERS = ['csv', 'csv_stream', 'geojson', 'geojson_stream']
+
+DEFAULT_SIZES = '1e2,1e3,1e4,1e5,1e6'
+
+def _route_params(params, block):
+	# the parameters of a route, with the hatt block of the benchmark
+	params = dict(params)
+	for side in ['from', 'to']:
+		if params.get('%s_hatt_id' % side) == 'block':
+			params['%s_hatt_id' % side] = block.id
+		if params.get('%s_hatt_centroid' % side) == 'block':
+			params['%s_hatt_centroid' % side] = (block.center_lat, block.center_lon)
+	return params
+
+def _source_params(params):
+	# the parameters of the transformation from New Bessel (λ,φ) to the source system of a route
+	source = {'from_srid': NEW_BESSEL_SRID, 'from_hatt_id': 'auto'}
+	if 'from_hatt_id' in params and params['from_hatt_id'] != 'auto':
+		source['to_hatt_id'] = params['from_hatt_id']
+	else:
+		source['to_srid'] = params.get('from_srid', HATT_NEW_SRID)
+	if 'from_hatt_centroid' in params:
+		source['to_hatt_centroid'] = params['from_hatt_centroid']
+	return source
+
+def _points(rng, n, centers, spread=0.2):
+	'''
+	Returns n synthetic points (λ, φ, h) of New Bessel around the centers (the hatt block centers, in degrees).
+	'''
+	index = rng.integers(0, len(centers), n)
+	lon = centers[index, 0] + rng.uniform(-spread, spread, n)
+	lat = centers[index, 1] + rng.uniform(-spread, spread, n)
+	return lon, lat, rng.uniform(0, 2000, n)
+
+def _source_points(rng, n, centers, params, route):
+	# n points in the source system of the route that are valid through the route,
+	# synthetic points outside of the grids or blocks are replaced
+	transformer = get_transformer(**_source_params(params))
+	coords = [np.empty(0)] * 3
+	while coords[0].size < n:
+		lon, lat, h = _points(rng, n, centers)
+		(x, y), valid = transformer.transform_masked(lon, lat)
+		x, y, h = x[valid], y[valid], h[valid]
+		_, valid = route.transform_masked(x.copy(), y.copy(), h.copy())
+		coords = [np.concatenate([c, v[valid]]) for c, v in zip(coords, [x, y, h])]
+	return [c[:n].copy() for c in coords]
+
+def _time(fn, repeat, setup=None):
+	# the wall time of each of repeat calls of fn, with the arguments returned by setup (not timed)
+	seconds = []
+	for _ in range(repeat):
+		args = setup() if setup is not None else ()
+		start = time.perf_counter()
+		fn(*args)
+		seconds.append(time.perf_counter() - start)
+	return seconds
+
+def _csv_text(x, y, z):
+	return pd.DataFrame({'x': format_fixed(x, 3), 'y': format_fixed(y, 3), 'z': format_fixed(z, 3)}).to_csv(header=False, index=False)
+
+def _geojson_text(x, y, z):
+	# format_fixed may leave a trailing point ('2.'), which is not json
+	features = ['{"type": "Feature", "properties": {"id": %d}, "geometry": {"type": "Point", "coordinates": [%.3f, %.3f, %.3f]}}' % item
+		for item in zip(range(x.size), x.tolist(), y.tolist(), z.tolist())]
+	return '{"type": "FeatureCollection", "features": [%s]}' % ', '.join(features)
+
+def _driver_run(name, transformer, text):
+	# the end to end run of a driver on the input text, the output is produced as by the api
+	decimals = (3, 3, 3)
+	if name == 'csv':
+		return lambda: csv_driver.transform(transformer, io.StringIO(text), decimals, fieldnames='x,y,z').read()
+	if name == 'csv_stream':
+		return lambda: ''.join(csv_driver.transform_stream(transformer, io.StringIO(text), decimals, fieldnames='x,y,z',
+			chunksize=getattr(settings, 'TRANSFORM_CSV_CHUNK_SIZE', 100000)))
+	if name == 'geojson':
+		return lambda: json.dumps(geojson_driver.transform(transformer, io.StringIO(text)), ensure_ascii=False)
+	return lambda: ''.join(geojson_driver.transform_stream(transformer, io.StringIO(text),
+		batch_size=getattr(settings, 'TRANSFORM_GEOJSON_BATCH_SIZE', 10000)))
+
+def _result(group, name, params, points, seconds, **extra):
+	best = min(seconds)
+	result = {
+		'group': group,
+		'name': name,
+		'params': params,
+		'points': points,
+		'seconds': seconds,
+		'best_seconds': best,
+		'median_seconds': statistics.median(seconds),
+		'points_per_second': points / best if best > 0 else None,
+	}
+	result.update(extra)
+	return result
+
+class Command(BaseCommand):
+	help = ('Times the transformation routes and the csv and geojson drivers on synthetic points over Greece '
+		'and writes the results as json, to compare runs across releases.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sizes', default=DEFAULT_SIZES,
+			help='comma separated numbers of points (default %s, up to 1e7)' % DEFAULT_SIZES)
+		parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the best is reported (default 3)')
+		parser.add_argument('--routes', nargs='*', choices=[name for name, _, _ in ROUTES],
+			help='the routes to time (default: all)')
+		parser.add_argument('--drivers', nargs='*', choices=DRIVERS, help='the drivers to time (default: all)')
+		parser.add_argument('--max-driver-points', type=float, default=1e6,
+			help='larger sizes are not run through the drivers (default 1e6)')
+		parser.add_argument('--hatt-id', type=int, help='the hatt block of the block routes (default: the most central block)')
+		parser.add_argument('--serial', action='store_true', help='disable the parallel chunked execution of large arrays')
+		parser.add_argument('--seed', type=int, default=0)
+		parser.add_argument('--label', default='', help='label of the run, i.e. the release')
+		parser.add_argument('--output', help='json file of the results (default: standard output)')
+
+	def handle(self, *args, **options):
+		try:
+			sizes = [int(float(size)) for size in options['sizes'].split(',')]
+		except ValueError:
+			raise CommandError('--sizes expects comma separated numbers, i.e. 1e2,1e3')
+		if options['serial']:
+			settings.TRANSFORM_PARALLEL_THRESHOLD = None
+		repeat = max(1, options['repeat'])
+		routes = [route for route in ROUTES if options['routes'] is None or route[0] in options['routes']]
+		drivers = DRIVERS if options['drivers'] is None else options['drivers']
+
+		blocks = hattblock_registry.blocks
+		if not blocks:
+			raise CommandError('there are no hatt blocks, run the migrations first')
+		centers = np.array([[block.center_lon, block.center_lat] for block in blocks])
+		if options['hatt_id'] is not None:
+			block = hattblock_registry.get(options['hatt_id'])
+		else:
+			block = blocks[int(np.argmin(np.hypot(*(centers - centers.mean(axis=0)).T)))]
+		block_centers = np.array([[block.center_lon, block.center_lat]])
+
+		rng = np.random.default_rng(options['seed'])
+		results = []
+		for name, params, region in routes:
+			params = _route_params(params, block)
+			compile_seconds = min(_time(lambda: WorkHorseTransformer(**params), repeat))
+			transformer = WorkHorseTransformer(**params)
+			for n in sizes:
+				x, y, z = _source_points(rng, n, centers if region == 'greece' else block_centers, params, transformer)
+				# some steps transform in place, each run gets its own copy
+				seconds = _time(transformer, repeat, lambda: (x.copy(), y.copy(), z.copy()))
+				results.append(_result('route', name, params, n, seconds,
+					compile_seconds=compile_seconds, steps=transformer.step_names))
+				self._progress(results[-1])
+
+		transformer = WorkHorseTransformer(from_srid=TM07_SRID, to_srid=TM87_SRID)
+		for n in [n for n in sizes if n <= options['max_driver_points']] if drivers else []:
+			x, y, z = _source_points(rng, n, centers, {'from_srid': TM07_SRID}, transformer)
+			texts = {}
+			for name in drivers:
+				kind = name.split('_')[0]
+				if kind not in texts:
+					texts[kind] = _csv_text(x, y, z) if kind == 'csv' else _geojson_text(x, y, z)
+				seconds = _time(_driver_run(name, transformer, texts[kind]), repeat)
+				results.append(_result('driver', name, {'from_srid': TM07_SRID, 'to_srid': TM87_SRID}, n, seconds,
+					input_bytes=len(texts[kind].encode('utf-8'))))
+				self._progress(results[-1])
+
+		report = {
+			'label': options['label'],
+			'created': datetime.now(timezone.utc).isoformat(),
+			'environment': {
+				'python': platform.python_version(),
+				'platform': platform.platform(),
+				'machine': platform.machine(),
+				'cpu_count': os.cpu_count(),
+				'django': django.get_version(),
+				'numpy': np.__version__,
+				'pandas': pd.__version__,
+				'pyproj': pyproj.__version__,
+				'proj': pyproj.proj_version_str,
+				'parallel_threshold': getattr(settings, 'TRANSFORM_PARALLEL_THRESHOLD', 1000000),
+				'parallel_workers': getattr(settings, 'TRANSFORM_PARALLEL_WORKERS', None),
+			},
+			'options': {
+				'sizes': sizes,
+				'repeat': repeat,
+				'seed': options['seed'],
+				'hatt_id': block.id,
+			},
+			'results': results,
+		}
+		text = json.dumps(report, ensure_ascii=False, indent=2)
+		if options['output']:
+			with open(options['output'], 'w', encoding='utf-8') as f:
+				f.write(text + '\n')
+		else:
+			self.stdout.write(text)
+
+	def _progress(self, result):
+		# progress on stderr, the json is the output
+		self.stderr.write('%-8s %-32s %10d points %10.4f s %14.0f points/s' % (
+			result['group'], result['name'], result['points'], result['best_seconds'], result['points_per_second'] or 0))
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import shutil
+import multiprocessing
+from io import TextIOWrapper
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from survgr.compression import decompressed, decompressed_file
+from transform.transform import get_transformer
+from transform.views import transformer_params
+from transform.drivers import csv_driver, geojson_driver, npy_driver, arrow_driver, parquet_driver, gpkg_driver
+
+# input types of the file extensions
+INPUT_TYPES = {
+	'.csv': 'csv',
+	'.txt': 'csv',
+	'.geojson': 'geojson',
+	'.json': 'geojson',
+	'.npy': 'npy',
+	'.npz': 'npz',
+	'.arrow': 'arrow',
+	'.parquet': 'parquet',
+	'.gpkg': 'gpkg',
+}
+
+BINARY_DRIVERS = {
+	'npy': npy_driver,
+	'npz': npy_driver,
+	'arrow': arrow_driver,
+	'parquet': parquet_driver,
+}
+
+# compressed inputs are decompressed, the output is not compressed
+COMPRESSED_EXTENSIONS = ['.gz', '.zst']
+
+class _CountingTransformer(object):
+	# counts the points that go through the transformer, for the points/sec of each file
+	def __init__(self, transformer):
+		self._transformer = transformer
+		self.points = 0
+
+	def __getattr__(self, name):
+		return getattr(self._transformer, name)
+
+	def __call__(self, x, *args, **kwargs):
+		self.points += len(x)
+		return self._transformer(x, *args, **kwargs)
+
+	def transform_masked(self, x, *args, **kwargs):
+		self.points += len(x)
+		return self._transformer.transform_masked(x, *args, **kwargs)
+
+# the transformer of the process, compiled once (inherited by forked workers)
+_transformer = None
+
+def _init_worker(params):
+	global _transformer
+	# spawned workers compile the transformer themselves
+	if _transformer is None:
+		import django
+		django.setup()
+		_transformer = get_transformer(**params)
+	# the files are the unit of parallelism, the transformer runs each file serially
+	settings.TRANSFORM_PARALLEL_THRESHOLD = None
+
+def _transform_file(input_type, input_path, output_path, options):
+	'''
+	Transforms the input file to the output file, returns the number of points and the seconds it took.
+	'''
+	transformer = _CountingTransformer(_transformer)
+	start = time.perf_counter()
+	os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+	try:
+		_write_output(transformer, input_type, input_path, output_path, options)
+	except BaseException:
+		# no partial outputs of failed files
+		if os.path.exists(output_path):
+			os.remove(output_path)
+		raise
+	return transformer.points, time.perf_counter() - start
+
+def _write_output(transformer, input_type, input_path, output_path, options):
+	invalid_points = options['invalid_points']
+	if input_type == 'gpkg':
+		with open(input_path, 'rb') as f:
+			plain = decompressed_file(f)
+			if plain is f:
+				gpkg_driver.transform_file(transformer, input_path, output_path, invalid_points=invalid_points)
+			else:
+				with gpkg_driver.transform(transformer, plain, invalid_points=invalid_points) as result, open(output_path, 'wb') as out:
+					shutil.copyfileobj(result, out)
+	elif input_type in BINARY_DRIVERS:
+		with open(input_path, 'rb') as f, open(output_path, 'wb') as out:
+			result = BINARY_DRIVERS[input_type].transform(transformer, decompressed_file(f), invalid_points=invalid_points)
+			shutil.copyfileobj(result, out)
+	else:
+		with open(input_path, 'rb') as f, open(output_path, 'w', encoding='utf-8') as out:
+			inp = TextIOWrapper(decompressed(f), encoding='utf-8')
+			if input_type == 'csv':
+				# degrees need 9 decimals for ~1mm accuracy, meters need 3
+				xy_decimals = 9 if transformer.to_refsys.is_longlat() else 3
+				chunks = csv_driver.transform_stream(transformer, inp, (xy_decimals, xy_decimals, 3),
+					fieldnames=options['csv_fields'],
+					invalid_points=invalid_points,
+					chunksize=getattr(settings, 'TRANSFORM_CSV_CHUNK_SIZE', 100000))
+			else:
+				chunks = geojson_driver.transform_stream(transformer, inp,
+					invalid_points=invalid_points,
+					batch_size=getattr(settings, 'TRANSFORM_GEOJSON_BATCH_SIZE', 10000))
+			for chunk in chunks:
+				out.write(chunk)
+
+class Command(BaseCommand):
+	help = 'Transforms coordinate files (or directories of files) with the parameters of the web api, on a pool of processes.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('inputs', nargs='+', help='input files or directories')
+		parser.add_argument('--from-srid', type=int)
+		parser.add_argument('--to-srid', type=int)
+		parser.add_argument('--from-hatt-id', help='id of the hatt block or "auto"')
+		parser.add_argument('--to-hatt-id', help='id of the hatt block or "auto"')
+		parser.add_argument('--from-hatt-centroid', help='"lat,lon" of the old bessel hatt projection')
+		parser.add_argument('--to-hatt-centroid', help='"lat,lon" of the old bessel hatt projection')
+		parser.add_argument('--okxe-inverse-type', choices=['iterative', 'coeffs'])
+		parser.add_argument('--hepos-mode', choices=['grid', 'proj'])
+		parser.add_argument('--procrustes', help='procrustes session file (json)')
+		parser.add_argument('--csv-fields', default='x,y', help='field order of the csv files, i.e. id,x,y,z (default x,y)')
+		parser.add_argument('--input-type', choices=sorted(set(INPUT_TYPES.values())),
+			help='type of the input files (default: from the file extension)')
+		parser.add_argument('--invalid-points', choices=['fail', 'mark'], default='fail')
+		parser.add_argument('--output-dir',
+			help='directory of the output files (default: next to the input files, with a "_transformed" suffix)')
+		parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes (default: number of cores)')
+
+	def handle(self, *args, **options):
+		post = {}
+		for name in ['from_srid', 'to_srid', 'from_hatt_id', 'to_hatt_id', 'okxe_inverse_type', 'hepos_mode']:
+			if options[name] is not None:
+				post[name] = str(options[name])
+		for name in ['from_hatt_centroid', 'to_hatt_centroid']:
+			if options[name] is not None:
+				lat, lon = options[name].split(',')
+				post[name] = json.dumps({'lat': float(lat), 'lon': float(lon)})
+		params = transformer_params(post)
+		if options['procrustes']:
+			with open(options['procrustes'], encoding='utf-8') as f:
+				params['procrustes'] = json.load(f)
+
+		global _transformer
+		try:
+			_transformer = get_transformer(**params)
+		except (KeyError, ValueError) as e:
+			raise CommandError(e)
+		for step in _transformer.transformation_steps:
+			self.stdout.write(step)
+
+		files = list(self._files(options))
+		if not files:
+			raise CommandError('no input files')
+		# an output that is an input file would be truncated before (or while) it is read
+		inputs = {os.path.realpath(input_path) for _, input_path, _ in files}
+		outputs = set()
+		for _, input_path, output_path in files:
+			output_path = os.path.realpath(output_path)
+			if output_path in inputs or output_path in outputs:
+				raise CommandError('%s: the output %s is an input file or the output of another input' % (input_path, output_path))
+			outputs.add(output_path)
+
+		workers = max(1, min(options['workers'] or 1, len(files)))
+		failed = 0
+		total_points = 0
+		start = time.perf_counter()
+		if workers == 1:
+			results = ((f, self._run(_transform_file, *f, options)) for f in files)
+		else:
+			# forked workers inherit the compiled transformer, the db connections are not shared
+			connections.close_all()
+			methods = multiprocessing.get_all_start_methods()
+			context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+			executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+				initializer=_init_worker, initargs=(params,))
+			futures = [(f, executor.submit(_transform_file, *f, options)) for f in files]
+			results = ((f, self._run(future.result)) for f, future in futures)
+
+		try:
+			for (input_type, input_path, output_path), (result, error) in results:
+				if error is not None:
+					failed += 1
+					self.stderr.write('%s: failed (%s)' % (input_path, error))
+					continue
+				points, seconds = result
+				total_points += points
+				self.stdout.write('%s -> %s: %d points in %.2f s (%.0f points/s)' % (
+					input_path, output_path, points, seconds, points / seconds if seconds > 0 else 0))
+		finally:
+			if workers > 1:
+				executor.shutdown(cancel_futures=True)
+
+		seconds = time.perf_counter() - start
+		self.stdout.write('%d files, %d points in %.2f s (%.0f points/s)' % (
+			len(files) - failed, total_points, seconds, total_points / seconds if seconds > 0 else 0))
+		if failed:
+			raise CommandError('%d of %d files failed' % (failed, len(files)))
+
+	def _run(self, fn, *args):
+		# returns the result and the error of fn(*args)
+		try:
+			return fn(*args), None
+		except Exception as e:
+			return None, str(e) or type(e).__name__
+
+	def _files(self, options):
+		# yields (input type, input path, output path) for the inputs and the files of the input directories
+		output_dir = os.path.realpath(options['output_dir']) if options['output_dir'] else None
+		for path in options['inputs']:
+			if os.path.isdir(path):
+				# skip the outputs of previous runs: the files of an output directory below the input directory,
+				# and the "_transformed" files next to their inputs, or in an output directory that is the input directory
+				top = os.path.realpath(path)
+				suffixed = output_dir is None or output_dir == top
+				for root, dirs, names in os.walk(path):
+					dirs[:] = sorted(d for d in dirs if suffixed or os.path.realpath(os.path.join(root, d)) != output_dir)
+					for name in sorted(names):
+						input_path = os.path.join(root, name)
+						input_type = options['input_type'] or self._input_type(input_path)
+						if input_type is None or (suffixed and '_transformed.' in name):
+							continue
+						yield input_type, input_path, self._output_path(input_path, os.path.relpath(input_path, path), options)
+			elif os.path.isfile(path):
+				input_type = options['input_type'] or self._input_type(path)
+				if input_type is None:
+					raise CommandError('%s: unknown input type, use --input-type' % path)
+				yield input_type, path, self._output_path(path, os.path.basename(path), options)
+			else:
+				raise CommandError('%s: no such file or directory' % path)
+
+	def _input_type(self, path):
+		root, ext = os.path.splitext(path)
+		if ext.lower() in COMPRESSED_EXTENSIONS:
+			root, ext = os.path.splitext(root)
+		return INPUT_TYPES.get(ext.lower())
+
+	def _output_path(self, input_path, relative_path, options):
+		root, ext = os.path.splitext(relative_path)
+		if ext.lower() in COMPRESSED_EXTENSIONS:
+			root, ext = os.path.splitext(root)
+		if options['output_dir']:
+			output_path = os.path.join(options['output_dir'], root + ext)
+			# i.e. the output directory is the input directory, the output would be the input
+			# or its uncompressed name
+			plain_path, compression = os.path.splitext(input_path)
+			if compression.lower() not in COMPRESSED_EXTENSIONS:
+				plain_path = input_path
+			if os.path.realpath(output_path) != os.path.realpath(plain_path):
+				return output_path
+			return os.path.join(options['output_dir'], root + '_transformed' + ext)
+		return os.path.join(os.path.dirname(input_path), os.path.basename(root) + '_transformed' + ext)
@@ -0,0 +1,78 @@
+import os
+import math
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+class ChunkExecutor(object):
+	'''
+	Process wide thread pool that runs the steps of a transformer on chunks of large coordinate arrays.
+	The steps spend their time in PROJ and numpy, which release the GIL, so the chunks run on all
+	the cores while sharing the compiled transformer and the input arrays (chunks are views, not copies).
+	Configured with:
+		-TRANSFORM_PARALLEL_THRESHOLD: arrays with at least this many points are split (None disables it)
+		-TRANSFORM_PARALLEL_WORKERS: number of threads, the number of cores by default
+		-TRANSFORM_PARALLEL_CHUNK_SIZE: minimum number of points of a chunk
+	'''
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._executor = None
+		self._workers = None
+
+	@property
+	def workers(self):
+		return getattr(settings, 'TRANSFORM_PARALLEL_WORKERS', None) or os.cpu_count() or 1
+
+	@property
+	def threshold(self):
+		return getattr(settings, 'TRANSFORM_PARALLEL_THRESHOLD', 1000000)
+
+	@property
+	def chunk_size(self):
+		return getattr(settings, 'TRANSFORM_PARALLEL_CHUNK_SIZE', 65536)
+
+	def should_split(self, num_points):
+		threshold = self.threshold
+		return threshold is not None and num_points >= threshold and num_points > self.chunk_size and self.workers > 1 \
+			and not getattr(_worker, 'active', False)
+
+	def chunks(self, num_points):
+		'''
+		Returns the (start, stop) slices of num_points, one per worker unless that would make them too small.
+		'''
+		size = max(math.ceil(num_points / self.workers), self.chunk_size, 1)
+		return [(start, min(start + size, num_points)) for start in range(0, num_points, size)]
+
+	def _get_executor(self):
+		with self._lock:
+			workers = self.workers
+			if self._executor is None or self._workers != workers:
+				if self._executor is not None:
+					self._executor.shutdown(wait=False)
+				self._executor = ThreadPoolExecutor(max_workers=workers,
+					thread_name_prefix='transform-chunk', initializer=_mark_worker)
+				self._workers = workers
+			return self._executor
+
+	def map(self, fn, slices):
+		'''
+		Calls fn(start, stop) for each slice on the pool and returns the results in order.
+		If a chunk fails, the exception of the first failed chunk is raised and the pending chunks are cancelled.
+		'''
+		# the chunks run in the context of the caller (i.e. its timings)
+		futures = [self._get_executor().submit(contextvars.copy_context().run, fn, start, stop) for start, stop in slices]
+		try:
+			return [future.result() for future in futures]
+		finally:
+			for future in futures:
+				future.cancel()
+
+# marks the pool threads, a transformer called from a chunk is run serially instead of waiting for the pool
+_worker = threading.local()
+
+def _mark_worker():
+	_worker.active = True
+
+chunk_executor = ChunkExecutor()
@@ -0,0 +1,124 @@
+import weakref
+import threading
+from collections import OrderedDict
+
+import pyproj
+
+class _ThreadTransformers(object):
+	# the transformers of a thread, with the hits and misses of its lookups
+	def __init__(self):
+		self.transformers = OrderedDict()
+		self.counts = [0, 0]
+
+class ProjPool(object):
+	'''
+	Process wide registry of pyproj objects.
+	Each proj4 definition is parsed into a CRS once and shared by all threads.
+	Transformers are created lazily once per thread and keyed by (source, target)
+	proj4 texts (or by the pipeline text), so threaded workers can reuse them without locking.
+	Both registries are bounded and drop their least recently used entries,
+	as user given hatt centroids can create an unbounded number of definitions.
+	'''
+	def __init__(self, maxsize=512):
+		self.maxsize = maxsize
+		self._crs = OrderedDict()
+		self._crs_counts = [0, 0]
+		self._lock = threading.Lock()
+		self._local = threading.local()
+		# the counts of all the threads (also of the finished ones), the registries of the live threads
+		self._thread_counts = []
+		self._threads = weakref.WeakSet()
+
+	def crs(self, proj4text):
+		with self._lock:
+			crs = self._crs.get(proj4text)
+			if crs is not None:
+				self._crs.move_to_end(proj4text)
+				self._crs_counts[0] += 1
+				return crs
+			self._crs_counts[1] += 1
+
+		crs = pyproj.CRS.from_user_input(proj4text)
+
+		with self._lock:
+			crs = self._crs.setdefault(proj4text, crs)
+			self._crs.move_to_end(proj4text)
+			while len(self._crs) > self.maxsize:
+				self._crs.popitem(last=False)
+		return crs
+
+	def transformer(self, from_proj4text, to_proj4text):
+		key = (from_proj4text, to_proj4text)
+		return self._thread_get(key, lambda: pyproj.Transformer.from_crs(
+			self.crs(from_proj4text), self.crs(to_proj4text)))
+
+	def pipeline(self, pipeline_text):
+		return self._thread_get(pipeline_text, lambda: pyproj.Transformer.from_pipeline(pipeline_text))
+
+	def _thread_get(self, key, factory):
+		# only the current thread touches its own registry, no locking needed
+		local = getattr(self._local, 'registry', None)
+		if local is None:
+			local = self._local.registry = _ThreadTransformers()
+			with self._lock:
+				self._thread_counts.append(local.counts)
+				self._threads.add(local)
+		transformers = local.transformers
+
+		transformer = transformers.get(key)
+		if transformer is None:
+			local.counts[1] += 1
+			transformer = transformers[key] = factory()
+			if len(transformers) > self.maxsize:
+				transformers.popitem(last=False)
+		else:
+			local.counts[0] += 1
+			transformers.move_to_end(key)
+		return transformer
+
+	def stats(self):
+		'''
+		Returns the size, hits and misses of the crs registry and of the transformer registries of all the threads.
+		'''
+		with self._lock:
+			threads = list(self._threads)
+			counts = [list(c) for c in self._thread_counts]
+			return {
+				'crs_size': len(self._crs),
+				'crs_hits': self._crs_counts[0],
+				'crs_misses': self._crs_counts[1],
+				'transformer_size': sum(len(local.transformers) for local in threads),
+				'transformer_hits': sum(c[0] for c in counts),
+				'transformer_misses': sum(c[1] for c in counts),
+			}
+
+def pipeline_steps(definition):
+	'''
+	Splits a PROJ definition into the list of its steps (without the leading "+step").
+	Returns None if the definition has global pipeline options and cannot be merged with other steps.
+	'''
+	definition = ' '.join(definition.split())
+	if not definition.startswith('+proj=pipeline'):
+		return [definition]
+	head, *steps = definition.split(' +step ')
+	if head != '+proj=pipeline' or not steps:
+		return None
+	return steps
+
+def invert_steps(steps):
+	'''
+	Returns the steps of the inverse pipeline: reversed, with their direction toggled.
+	'''
+	inverse = []
+	for step in reversed(steps):
+		params = step.split()
+		if '+inv' in params:
+			params.remove('+inv')
+		else:
+			params.insert(0, '+inv')
+		params = ['+omit_inv' if p == '+omit_fwd' else '+omit_fwd' if p == '+omit_inv' else p for p in params]
+		inverse.append(' '.join(params))
+	return inverse
+
+# process wide pool used by all the sub-transformers
+proj_pool = ProjPool()
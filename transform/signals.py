@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .hatt.models import Hattblock, OKXECoefficient
+from .hatt.registry import hattblock_registry
+from .cache import pipeline_cache
+
+# the hatt block registry and the compiled pipelines hold hatt block projections and okxe coefficients,
+# so they must be dropped whenever these rows change.
+# note: bulk operations (i.e. the initial data migrations) do not send signals.
+@receiver([post_save, post_delete], sender=Hattblock)
+@receiver([post_save, post_delete], sender=OKXECoefficient)
+def invalidate_hatt_caches(sender, **kwargs):
+	hattblock_registry.invalidate()
+	pipeline_cache.clear()
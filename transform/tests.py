@@ -1,9 +1,39 @@
+import os
+import gzip
 import json
-from io import StringIO
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from io import StringIO, BytesIO
 import pandas as pd
 import numpy as np
-from django.test import TestCase
-from .transform import WorkHorseTransformer
+import shapely.wkb
+from shapely.geometry import Point, LineString, Polygon
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, AsyncRequestFactory, override_settings
+from . import views
+from .transform import WorkHorseTransformer, get_transformer, ProjTransformer, ProjPipelineTransformer, REF_SYS
+from .hatt.okxe_transformer import OKXETransformer
+from .htrs.hepos_transformer import HeposTransformer
+from .cache import PipelineCache, pipeline_cache
+from .parallel import chunk_executor
+from .jobs import job_queue, UploadTooLarge
+from . import timing
+from .proj_pool import ProjPool
+from .drivers.float_format import format_fixed
+from .drivers import geojson_driver, gpkg_driver
+from .drivers.arrow_driver import pa
+from survgr import compression
+from survgr.metrics import Registry
+from .hatt.models import Hattblock
+from .hatt.registry import hattblock_registry
 
 def dms2decdeg(d, m, s):
     sign = 1.0 if d > 0.0 else -1.0
@@ -587,6 +617,819 @@ class TransformWorkHorseTest(TestCase):
 
         horse = WorkHorseTransformer(from_srid=GGRS_SRID, to_srid=HATT_SRID, to_hatt_id=2)
 
+class TransformMaskedTest(TestCase):
+
+    def test_masked_hepos_points(self):
+        t = WorkHorseTransformer(from_srid=1000005, to_srid=2100)
+        E = [566446.108, 0.0, 525000.011]
+        N = [2529618.096, 0.0, 2650967.938]
+        h = [51.610, 0.0, 172.591]
+        with self.assertRaises(IndexError):
+            t(E, N, h)
+        (Et, Nt, ht), valid = t.transform_masked(E, N, h)
+        self.assertEqual(list(valid), [True, False, True])
+        self.assertEqual([round(Et[0], 3), round(Et[2], 3)], [566296.537, 524849.996])
+        self.assertTrue(np.isnan(Et[1]) and np.isnan(Nt[1]))
+
+        t = WorkHorseTransformer(from_srid=2100, to_srid=1000005)
+        (Et, Nt, ht), valid = t.transform_masked([566296.537, 1e7], [4529332.307, 1e7], [6.501, 0.0])
+        self.assertEqual(list(valid), [True, False])
+        self.assertEqual(round(Et[0], 3), 566446.108)
+
+class ProjPipelineFusionTest(TestCase):
+
+    def test_fused_steps_match_separate_steps(self):
+        t = WorkHorseTransformer(from_srid=4326, to_srid=1000000, to_hatt_id=185)
+        self.assertEqual(len(t.transformers), 1)
+        self.assertIsInstance(t.transformers[0], ProjPipelineTransformer)
+        self.assertEqual(len(t.log), 2)
+        self.assertEqual(len(t.transformation_steps), 2)
+
+        block = Hattblock.objects.get(id=185)
+        to_tm87 = ProjTransformer(REF_SYS[4326].proj4text, REF_SYS[2100].proj4text)
+        to_hatt = OKXETransformer(block.get_coeffs(), inverse=True)
+        lon = np.array([22.40, 22.45, 22.52])
+        lat = np.array([38.85, 38.90, 38.95])
+        x, y = t(lon, lat)
+        xe, ye = to_hatt(*to_tm87(lon, lat))
+        self.assertTrue(np.allclose(x, xe, rtol=0, atol=1e-6))
+        self.assertTrue(np.allclose(y, ye, rtol=0, atol=1e-6))
+
+    def test_hepos_is_not_fused(self):
+        t = WorkHorseTransformer(from_srid=4326, to_srid=1000004)
+        self.assertEqual([type(f) for f in t.transformers], [ProjTransformer, HeposTransformer, ProjTransformer])
+
+class HeposProjModeTest(TestCase):
+
+    def test_proj_mode_matches_grid_mode(self):
+        E = [566446.108, 525000.011]
+        N = [2529618.096, 2650967.938]
+        h = [51.610, 172.591]
+        t = WorkHorseTransformer(from_srid=1000005, to_srid=2100, hepos_mode='proj')
+        Et, Nt, ht = t(E, N, h)
+        self.assertTrue(np.allclose(Et, [566296.537, 524849.996], rtol=0, atol=0.01))
+        self.assertTrue(np.allclose(Nt, [4529332.307, 4650682.000], rtol=0, atol=0.01))
+        self.assertTrue(np.allclose(ht, [6.501, 123.000], rtol=0, atol=0.01))
+
+        t = WorkHorseTransformer(from_srid=2100, to_srid=1000005, hepos_mode='proj')
+        Eb, Nb, hb = t(Et, Nt, ht)
+        self.assertTrue(np.allclose(Eb, E, rtol=0, atol=1e-4))
+        self.assertTrue(np.allclose(Nb, N, rtol=0, atol=1e-4))
+
+    def test_proj_mode_is_fused(self):
+        t = WorkHorseTransformer(from_srid=4326, to_srid=1000004, hepos_mode='proj')
+        self.assertEqual([type(f) for f in t.transformers], [ProjPipelineTransformer])
+        self.assertEqual(len(t.log), 3)
+        grid = WorkHorseTransformer(from_srid=4326, to_srid=1000004)
+        lon, lat = [23.72, 21.73, 25.13], [37.98, 38.24, 35.34]
+        x, y = t(lon, lat)
+        xe, ye = grid(lon, lat)
+        self.assertTrue(np.allclose(x, xe, rtol=0, atol=1e-6)) # degrees
+        self.assertTrue(np.allclose(y, ye, rtol=0, atol=1e-6))
+
+        with self.assertRaises(ValueError):
+            WorkHorseTransformer(from_srid=4326, to_srid=1000004, hepos_mode='fast')
+
+class AutoHattTest(TestCase):
+
+    def setUp(self):
+        # hatt points of Alexandria (27) and the same points in ggrs87 / tm87
+        self.x = np.array([-10157.950, -16090.967, -2162.917])
+        self.y = np.array([-21121.093, -19478.049, -19596.748])
+        self.E = np.array([360028.794, 354126.164, 368047.902])
+        self.N = np.array([4490989.862, 4492735.790, 4492374.342])
+
+    def test_spatial_index(self):
+        rows = hattblock_registry.locate([-1.3, -1.3, 50.0, np.nan], [40.6, 40.6, 40.6, 40.6])
+        self.assertEqual(hattblock_registry.blocks[rows[0]].id, 27)
+        self.assertEqual(list(rows[1:]), [rows[0], -1, -1])
+
+    def test_to_hatt(self):
+        t = WorkHorseTransformer(from_srid=2100, to_hatt_id='auto')
+        self.assertTrue(t.outputs_hatt_ids)
+        hatt_ids = []
+        x, y = t(self.E, self.N, hatt_ids=hatt_ids)
+        self.assertEqual(list(hatt_ids[0]), [27, 27, 27])
+        self.assertTrue(np.allclose(x, self.x, rtol=0, atol=0.001))
+        self.assertTrue(np.allclose(y, self.y, rtol=0, atol=0.001))
+
+        with self.assertRaises(IndexError):
+            t(np.append(self.E, 0.0), np.append(self.N, 0.0))
+        hatt_ids = []
+        (x, y), valid = t.transform_masked(np.append(self.E, 0.0), np.append(self.N, 0.0), hatt_ids=hatt_ids)
+        self.assertEqual(list(valid), [True, True, True, False])
+        self.assertEqual(list(hatt_ids[0]), [27, 27, 27, -1])
+
+    def test_tm3_matches_explicit_block(self):
+        auto = WorkHorseTransformer(from_srid=2100, to_srid=1000002, to_hatt_id='auto')
+        block = WorkHorseTransformer(from_srid=2100, to_srid=1000002, to_hatt_id=27)
+        self.assertFalse(auto.outputs_hatt_ids)
+        x, y = auto(self.E, self.N)
+        xe, ye = block(self.E, self.N)
+        self.assertTrue(np.allclose(x, xe, rtol=0, atol=1e-6))
+        self.assertTrue(np.allclose(y, ye, rtol=0, atol=1e-6))
+
+        E, N = WorkHorseTransformer(from_srid=1000002, from_hatt_id='auto', to_srid=2100)(x, y)
+        self.assertTrue(np.allclose(E, self.E, rtol=0, atol=0.001))
+        self.assertTrue(np.allclose(N, self.N, rtol=0, atol=0.001))
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            WorkHorseTransformer(from_hatt_id='auto', to_srid=2100)
+        with self.assertRaises(ValueError):
+            WorkHorseTransformer(from_hatt_id=27, to_hatt_id='auto')
+
+class ParallelRunTest(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.E = rng.uniform(300000, 700000, 5000)
+        self.N = rng.uniform(4000000, 4600000, 5000)
+        self.h = rng.uniform(0, 1000, 5000)
+        # some points outside of the hepos grid and the hatt blocks
+        self.E[::97] = 1e7
+        settings = self.settings(TRANSFORM_PARALLEL_THRESHOLD=1000, TRANSFORM_PARALLEL_WORKERS=4, TRANSFORM_PARALLEL_CHUNK_SIZE=700)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def serial(self, f, *args, **kwargs):
+        with self.settings(TRANSFORM_PARALLEL_THRESHOLD=None):
+            return f(*args, **kwargs)
+
+    def test_chunks(self):
+        self.assertTrue(chunk_executor.should_split(5000))
+        self.assertFalse(chunk_executor.should_split(999))
+        self.assertEqual(chunk_executor.chunks(5000), [(0, 1250), (1250, 2500), (2500, 3750), (3750, 5000)])
+        self.assertEqual(chunk_executor.chunks(1500), [(0, 700), (700, 1400), (1400, 1500)])
+
+    def test_identical_to_serial(self):
+        for params, has_invalid in [(dict(from_srid=2100, to_srid=1000005), True), (dict(from_srid=2100, to_srid=4326), False),
+                                    (dict(from_srid=2100, to_srid=1000000, to_hatt_id='auto'), True)]:
+            t = WorkHorseTransformer(**params)
+            hatt_ids, serial_hatt_ids = [], []
+            coords, valid = t.transform_masked(self.E, self.N, self.h, hatt_ids=hatt_ids)
+            serial_coords, serial_valid = self.serial(t.transform_masked, self.E, self.N, self.h, hatt_ids=serial_hatt_ids)
+            self.assertEqual(valid.all(), not has_invalid)
+            self.assertEqual(valid.tolist(), serial_valid.tolist())
+            for a, b in zip(coords, serial_coords):
+                self.assertEqual(a.tobytes(), b.tobytes())
+            self.assertEqual([ids.tolist() for ids in hatt_ids], [ids.tolist() for ids in serial_hatt_ids])
+
+    def test_failed_chunk(self):
+        t = WorkHorseTransformer(from_srid=2100, to_srid=1000005)
+        with self.assertRaises(IndexError):
+            t(self.E, self.N, self.h)
+
+class TimingTest(TestCase):
+
+    def test_steps(self):
+        E = np.array([566446.108, 525000.011])
+        N = np.array([2529618.096, 2650967.938])
+        with timing.collect() as timings:
+            t = WorkHorseTransformer(from_srid=1000005, to_srid=4326)
+            t(E, N)
+            t(E, N)
+        self.assertEqual(t.step_names, ['hepos', 'proj'])
+        phases = timings.as_dict()
+        self.assertEqual(list(phases), ['compile', 'hepos', 'proj', 'transform'])
+        self.assertEqual(phases['transform']['points'], 4)
+        self.assertEqual(phases['hepos']['points'], 4)
+        self.assertEqual(phases['hepos']['calls'], 2)
+        self.assertIn('hepos;dur=', timings.server_timing())
+
+        # nothing is collected outside of a block
+        t(E, N)
+        self.assertIsNone(timing.current())
+        with t.timings() as timings:
+            t(E, N)
+        self.assertEqual(list(timings.as_dict()), ['hepos', 'proj', 'transform'])
+
+        t = WorkHorseTransformer(from_srid=4326, to_srid=1000004)
+        self.assertEqual(t.step_names, ['proj', 'hepos', 'proj_2'])
+
+    def test_parallel_chunks(self):
+        t = WorkHorseTransformer(from_srid=2100, to_srid=1000005)
+        E = np.full(3000, 566296.537)
+        N = np.full(3000, 4529332.307)
+        with self.settings(TRANSFORM_PARALLEL_THRESHOLD=1000, TRANSFORM_PARALLEL_WORKERS=3, TRANSFORM_PARALLEL_CHUNK_SIZE=100):
+            with t.timings() as timings:
+                t(E, N)
+        phases = timings.as_dict()
+        self.assertEqual(phases['parallel']['points'], 3000)
+        self.assertEqual(phases['hepos']['points'], 3000)
+        self.assertEqual(phases['hepos']['calls'], 3)
+
+class FloatFormatTest(TestCase):
+
+    def assertSameText(self, values, decimals):
+        expected = [np.format_float_positional(v, decimals) for v in values]
+        self.assertEqual(list(format_fixed(values, decimals)), expected)
+
+    def test_rounding_rules(self):
+        values = np.array([0.125, 2.675, 1.5, 2.0, 1.29999999, -0.0, 0.0, -1.0004, 0.0005, 0.0015,
+            123456.9999, 0.5, 2.5, 1e-20, -1e-5, 0.1 + 0.2, 0.9999999999999999, 9.9996,
+            1e20, np.nan, -np.inf, 4503599627370495.5])
+        for decimals in [0, 1, 2, 3, 9]:
+            self.assertSameText(values, decimals)
+        self.assertEqual(list(format_fixed([2.0, 1.5, -1.0004, 1.29999], 3)), ['2.', '1.5', '-1.000', '1.3'])
+
+    def test_random_values(self):
+        rng = np.random.default_rng(0)
+        for decimals, values in [
+                (3, rng.uniform(-1e6, 1e7, 20000)),
+                (3, np.round(rng.uniform(-1e6, 1e7, 20000), 2)),
+                (3, rng.integers(-10**6, 10**6, 20000) / 16.0), # ties
+                (9, rng.uniform(19, 30, 20000)),
+                (9, np.round(rng.uniform(19, 30, 20000), 10))]:
+            self.assertSameText(values, decimals)
+
+class GeoJSONDriverTest(TestCase):
+
+    def test_batched_vertices(self):
+        t = get_transformer(from_srid=4326, to_srid=2100)
+        ring = [[22.0, 38.0], [22.1, 38.0], [22.1, 38.1], [22.0, 38.0]]
+        geometries = [
+            {'type': 'Point', 'coordinates': [22.05, 38.05, 100.0]},
+            {'type': 'Polygon', 'coordinates': [ring]},
+            {'type': 'MultiLineString', 'coordinates': [ring[:2], ring[2:]]},
+            {'type': 'GeometryCollection', 'geometries': [
+                {'type': 'MultiPoint', 'coordinates': [[22.2, 38.2, 5.0], [22.3, 38.3, 6.0]]},
+                {'type': 'MultiPolygon', 'coordinates': [[ring], [ring]]},
+            ]},
+        ]
+        features = [{'type': 'Feature', 'properties': None, 'geometry': g} for g in geometries]
+        result = geojson_driver.transform(t, StringIO(json.dumps({'type': 'FeatureCollection', 'features': features})))
+
+        x, y, z = t(22.05, 38.05, 100.0)
+        self.assertEqual(result['features'][0]['geometry']['coordinates'], [x, y, z])
+        x, y = t([p[0] for p in ring], [p[1] for p in ring])
+        self.assertEqual(result['features'][1]['geometry']['coordinates'], [np.column_stack([x, y]).tolist()])
+        self.assertEqual(result['features'][2]['geometry']['coordinates'][1], np.column_stack([x, y]).tolist()[2:])
+        collection = result['features'][3]['geometry']['geometries']
+        x, y, z = t([22.2, 22.3], [38.2, 38.3], [5.0, 6.0])
+        self.assertEqual(collection[0]['coordinates'], np.column_stack([x, y, z]).tolist())
+        self.assertEqual(collection[1]['coordinates'][1], result['features'][1]['geometry']['coordinates'])
+
+    def test_geometry(self):
+        t = get_transformer(from_srid=4326, to_srid=2100)
+        result = geojson_driver.transform(t, StringIO(json.dumps({'type': 'LineString', 'coordinates': [[22.0, 38.0], [22.1, 38.1]]})))
+        x, y = t([22.0, 22.1], [38.0, 38.1])
+        self.assertEqual(result['coordinates'], np.column_stack([x, y]).tolist())
+
+    def test_bbox_and_mixed_dimensions(self):
+        # the bounding boxes would be in the source system, they are dropped
+        t = get_transformer(from_srid=4326, to_srid=2100)
+        line = [[22.0, 38.0], [22.1, 38.1, 10.0], [22.2, 38.2, 20.0, 7.0]]
+        collection = {'type': 'FeatureCollection', 'bbox': [22, 38, 23, 39], 'features': [
+            {'type': 'Feature', 'bbox': [22, 38, 23, 39], 'properties': None,
+                'geometry': {'type': 'LineString', 'bbox': [22, 38, 23, 39], 'coordinates': line}},
+        ]}
+        result = geojson_driver.transform(t, StringIO(json.dumps(collection)))
+        streamed = json.loads(''.join(geojson_driver.transform_stream(t, StringIO(json.dumps(collection)))))
+        self.assertEqual(streamed, result)
+        self.assertNotIn('bbox', json.dumps(result))
+
+        coordinates = result['features'][0]['geometry']['coordinates']
+        self.assertEqual(coordinates[0], list(t(np.array([22.0]), np.array([38.0]))[i][0] for i in range(2)))
+        x, y, z = t(np.array([22.1, 22.2]), np.array([38.1, 38.2]), np.array([10.0, 20.0]))
+        self.assertEqual(coordinates[1:], [[x[0], y[0], z[0]], [x[1], y[1], z[1], 7.0]])
+
+    def test_stream(self):
+        t = get_transformer(from_srid=4326, to_srid=2100)
+        features = [{'type': 'Feature', 'properties': {'i': i, 'name': 'σημείο'},
+            'geometry': {'type': 'Point', 'coordinates': [22.0 + i/100.0, 38.0, float(i)]}} for i in range(5)]
+        collection = {'type': 'FeatureCollection', 'name': 'points', 'features': features, 'bbox': [1, 2, 3, 4]}
+        expected = geojson_driver.transform(t, StringIO(json.dumps(collection)))
+
+        chunks = list(geojson_driver.transform_stream(t, StringIO(json.dumps(collection, indent=2)), batch_size=2))
+        self.assertEqual(json.loads(''.join(chunks)), expected)
+        self.assertGreater(len(chunks), 3)
+
+        chunks = geojson_driver.transform_stream(t, StringIO(json.dumps(collection)), batch_size=2, ndjson=True)
+        self.assertEqual([json.loads(line) for line in ''.join(chunks).splitlines()], expected['features'])
+
+        # newline delimited input
+        sequence = '\n'.join(json.dumps(feat) for feat in features)
+        result = json.loads(''.join(geojson_driver.transform_stream(t, StringIO(sequence), batch_size=2)))
+        self.assertEqual(result['features'], expected['features'])
+
+        # single objects are returned as they are
+        result = json.loads(''.join(geojson_driver.transform_stream(t, StringIO(json.dumps(features[1])))))
+        self.assertEqual(result, expected['features'][1])
+
+        with self.assertRaises(ValueError):
+            list(geojson_driver.transform_stream(t, StringIO(json.dumps(collection)[:-10])))
+
+    def test_json_reader(self):
+        reader = geojson_driver._JSONReader(StringIO('[ {"a": [1, 2.5]} , 123456789, "x y"]'), read_size=4)
+        self.assertEqual(reader.expect('['), '[')
+        self.assertEqual(reader.decode(), {'a': [1, 2.5]})
+        reader.expect(',')
+        self.assertEqual(reader.decode(), 123456789)
+        reader.expect(',')
+        self.assertEqual(reader.decode(), 'x y')
+        self.assertEqual(reader.expect(']'), ']')
+        self.assertEqual(reader.peek(), '')
+
+        # values cut at the end of the buffer are read on
+        text = '[-2.5e-10, Infinity, "\\ud83d\\ude00 \\"\\u00e9", true, null]'
+        for read_size in range(1, 12):
+            self.assertEqual(geojson_driver._JSONReader(StringIO(text), read_size=read_size).decode(), json.loads(text))
+
+    def test_invalid_stream(self):
+        t = get_transformer(from_srid=4326, to_srid=2100)
+        for text in ['{"type": "FeatureCollection", "features": []]}',
+                '{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": null}]]}']:
+            with self.assertRaises(ValueError):
+                list(geojson_driver.transform_stream(t, StringIO(text)))
+
+        # invalid json is reported without reading the rest of the input
+        feature = json.dumps({'type': 'Feature', 'properties': None, 'geometry': {'type': 'Point', 'coordinates': [22.0, 38.0]}})
+        fp = StringIO('{"type": "FeatureCollection", "features": [{"type": x}, %s]}' % ', '.join([feature] * 20000))
+        with self.assertRaises(ValueError):
+            list(geojson_driver.transform_stream(t, fp))
+        self.assertLess(fp.tell(), len(fp.getvalue()) / 4)
+
+def make_geopackage(path, srs_id, geometries, big_endian=False):
+    # a minimal geopackage with a "points" feature table, its rtree index and its triggers
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+            organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+        INSERT INTO gpkg_spatial_ref_sys VALUES ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', NULL);
+        CREATE TABLE gpkg_contents (table_name TEXT PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT, description TEXT,
+            last_change DATETIME, min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER);
+        CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL);
+        CREATE TABLE points (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom GEOMETRY, name TEXT);
+        INSERT INTO gpkg_contents (table_name, data_type) VALUES ('points', 'features');
+        INSERT INTO gpkg_geometry_columns VALUES ('points', 'geom', 'GEOMETRY', -1, 2, 0);
+        CREATE VIRTUAL TABLE rtree_points_geom USING rtree(id, minx, maxx, miny, maxy);
+        CREATE TRIGGER rtree_points_geom_update1 AFTER UPDATE OF geom ON points
+            WHEN OLD.fid = NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom))
+            BEGIN
+                INSERT OR REPLACE INTO rtree_points_geom VALUES (
+                NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom));
+            END;
+    ''')
+    for i, geometry in enumerate(geometries):
+        blob = None
+        if geometry is not None:
+            blob = struct.pack('<2sBBi', b'GP', 0, 0x01, srs_id) + shapely.wkb.dumps(geometry, big_endian=big_endian)
+        connection.execute('INSERT INTO points (geom, name) VALUES (?, ?)', (blob, 'p%d' % i))
+    connection.commit()
+    connection.close()
+
+class GeoPackageDriverTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input_path = os.path.join(directory.name, 'input.gpkg')
+        self.output_path = os.path.join(directory.name, 'output.gpkg')
+
+    def read_geometries(self):
+        connection = sqlite3.connect(self.output_path)
+        rows = connection.execute('SELECT geom FROM points ORDER BY fid').fetchall()
+        connection.close()
+        return [shapely.wkb.loads(row[0][40:]) if row[0] is not None else None for row in rows]
+
+    def test_transform_file(self):
+        t = get_transformer(from_srid=1000005, to_srid=2100)
+        ring = [(566446.108, 2529618.096), (566546.108, 2529618.096), (566546.108, 2529718.096), (566446.108, 2529618.096)]
+        geometries = [
+            Point(566446.108, 2529618.096, 51.610),
+            LineString(ring),
+            Polygon(ring),
+            None,
+            Point(0.0, 0.0), # outside the hepos grid
+        ]
+        for big_endian in [False, True]:
+            make_geopackage(self.input_path, -1, geometries, big_endian=big_endian)
+            with self.assertRaises(Exception):
+                gpkg_driver.transform_file(t, self.input_path, self.output_path)
+            gpkg_driver.transform_file(t, self.input_path, self.output_path, invalid_points='mark', batch_size=2)
+
+            result = self.read_geometries()
+            self.assertEqual(result[0].coords[0], tuple(float(v[0]) for v in t([566446.108], [2529618.096], [51.610])))
+            x, y = t([p[0] for p in ring], [p[1] for p in ring])
+            self.assertEqual(list(result[1].coords), list(zip(x, y)))
+            self.assertEqual(list(result[2].exterior.coords), list(zip(x, y)))
+            self.assertEqual(result[3:], [None, None])
+
+            connection = sqlite3.connect(self.output_path)
+            status = [row[0] for row in connection.execute('SELECT transform_status FROM points ORDER BY fid')]
+            self.assertEqual(status, ['ok', 'ok', 'ok', 'ok', 'invalid'])
+            srs = connection.execute('SELECT organization, organization_coordsys_id FROM gpkg_spatial_ref_sys WHERE srs_id = 2100').fetchone()
+            self.assertEqual(srs, ('EPSG', 2100))
+            self.assertEqual(connection.execute('SELECT srs_id FROM gpkg_geometry_columns').fetchone()[0], 2100)
+            contents = connection.execute('SELECT srs_id, min_x, max_x FROM gpkg_contents').fetchone()
+            self.assertEqual(contents, (2100, min(x), max(x)))
+            # the rtree index is rebuilt with the new envelopes
+            rtree = connection.execute('SELECT id, minx, maxx FROM rtree_points_geom ORDER BY id').fetchall()
+            self.assertEqual([row[0] for row in rtree], [1, 2, 3])
+            self.assertAlmostEqual(rtree[1][2], max(x), delta=0.1)
+            triggers = connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall()
+            self.assertEqual(triggers, [('rtree_points_geom_update1',)])
+            connection.close()
+            os.remove(self.input_path)
+
+    def test_api(self):
+        make_geopackage(self.input_path, -1, [Point(566446.108, 2529618.096)])
+        with open(self.input_path, 'rb') as f:
+            response = self.client.post('/api/', {
+                'from_srid': 1000005, # htrs07 tm07
+                'to_srid': 2100,      # hgrs87 tm87
+                'input_type': 'gpkg',
+                'input': f,
+            })
+        self.assertEqual(response['Content-Type'], 'application/geopackage+sqlite3')
+        with open(self.output_path, 'wb') as f:
+            f.write(response.getvalue())
+        point = self.read_geometries()[0]
+        x, y = get_transformer(from_srid=1000005, to_srid=2100)([566446.108], [2529618.096])
+        self.assertEqual((point.x, point.y), (x[0], y[0]))
+
+class JobsTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.jobs_dir = os.path.join(directory.name, 'jobs')
+        os.makedirs(self.jobs_dir)
+        settings = self.settings(TRANSFORM_JOBS_DIR=self.jobs_dir, TRANSFORM_CSV_CHUNK_SIZE=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'x,y,z',
+            'input': StringIO('566446.108,2529618.096,51.610\n525000.011,2650967.938,172.591\n' * 3),
+        }
+
+    def wait(self, status_url):
+        for _ in range(100):
+            job = self.client.get(status_url).json()
+            if job['status'] in ['done', 'failed']:
+                return job
+            time.sleep(0.05)
+        self.fail('the job did not finish')
+
+    def test_job(self):
+        expected = self.client.post('/api/', self.params).json()
+        self.params['input'].seek(0)
+        response = self.client.post('/api/jobs/', self.params)
+        self.assertEqual(response.status_code, 202)
+        job = self.wait(response.json()['status_url'])
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['progress']['chunks'], 5)
+        self.assertEqual(job['progress']['input_bytes'], job['progress']['input_size'])
+
+        response = self.client.get(job['result_url'])
+        self.assertEqual(json.loads(response.getvalue()), expected)
+
+    def test_failed_and_expired_jobs(self):
+        self.params['input'] = StringIO('1,2,3\n')
+        job = self.client.post('/api/jobs/', self.params).json()
+        self.assertEqual(self.client.get(job['result_url']).status_code, 409)
+        job = self.wait(job['status_url'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(self.client.get(job['result_url']).status_code, 409)
+
+        with self.settings(TRANSFORM_JOBS_TTL=-1):
+            self.params['input'] = StringIO('566446.108,2529618.096,51.610\n')
+            job = self.client.post('/api/jobs/', self.params).json()
+            # the failed job expires
+            self.assertEqual(self.client.get(job['status_url']).status_code, 200)
+            time.sleep(0.5)
+            self.assertEqual(self.client.get(job['status_url']).status_code, 404)
+            self.assertEqual(self.client.get(job['result_url']).status_code, 404)
+
+    def add_job(self, status, touched=None, claimed=False):
+        # a job of another process, touched at the given time
+        job_id = uuid.uuid4()
+        os.makedirs(os.path.join(self.jobs_dir, job_id.hex, 'files'))
+        if claimed:
+            os.mkdir(os.path.join(self.jobs_dir, job_id.hex, 'claim'))
+            os.utime(os.path.join(self.jobs_dir, job_id.hex, 'claim'), (0, 0))
+        with open(os.path.join(self.jobs_dir, job_id.hex, 'files', 'input'), 'w') as f:
+            f.write(self.params['input'].getvalue())
+        fields = {name: str(value) for name, value in self.params.items() if name != 'input'}
+        path = os.path.join(self.jobs_dir, job_id.hex, 'job.json')
+        with open(path, 'w') as f:
+            json.dump({'id': job_id.hex, 'status': status, 'fields': fields, 'files': {'input': 'text/csv'},
+                'created': 0, 'started': None, 'finished': None, 'expires': None, 'error': None, 'result': None,
+                'progress': {'input_bytes': 0, 'input_size': 0, 'output_bytes': 0, 'chunks': 0}}, f)
+        if touched is not None:
+            os.utime(path, (touched, touched))
+        return job_id
+
+    def test_lost_jobs(self):
+        # jobs of a restarted process are not touched anymore, the queued ones are resumed
+        queued = self.add_job('queued', touched=1)
+        self.assertEqual(self.wait('/api/jobs/%s/' % queued)['status'], 'done')
+        running = self.add_job('running', touched=1)
+        job = self.client.get('/api/jobs/%s/' % running).json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertIsNotNone(job['expires'])
+        # resumed once and lost again
+        claimed = self.add_job('queued', touched=1, claimed=True)
+        self.assertEqual(self.client.get('/api/jobs/%s/' % claimed).json()['status'], 'failed')
+        # a job touched recently may run in another process
+        live = self.add_job('queued')
+        self.assertEqual(self.client.get('/api/jobs/%s/' % live).json()['status'], 'queued')
+
+        with self.settings(TRANSFORM_JOBS_TTL=-1):
+            lost = self.add_job('running', touched=1)
+            # the lost jobs expire and are deleted by the cleanup
+            job_queue.cleanup()
+            self.assertNotIn(lost.hex, os.listdir(self.jobs_dir))
+            self.assertIn(live.hex, os.listdir(self.jobs_dir))
+
+    def test_upload_size(self):
+        with self.settings(TRANSFORM_JOBS_MAX_UPLOAD_SIZE=10):
+            response = self.client.post('/api/jobs/', self.params)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(os.listdir(self.jobs_dir), [])
+        # the size of the files is checked too, when the length of the request is not known
+        with self.settings(TRANSFORM_JOBS_MAX_UPLOAD_SIZE=10), self.assertRaises(UploadTooLarge):
+            job_queue.submit({}, {'input': SimpleUploadedFile('input.csv', b'1,2,3\n' * 2)})
+        self.assertEqual(os.listdir(self.jobs_dir), [])
+
+    def test_unexpected_file_fields(self):
+        # the field names are not file names
+        self.params['../../escaped.txt'] = StringIO('data')
+        response = self.client.post('/api/jobs/', self.params)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(os.listdir(self.jobs_dir), [])
+        self.assertFalse(os.path.exists(os.path.join(self.jobs_dir, '..', 'escaped.txt')))
+
+class TransformFileCommandTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        os.makedirs(os.path.join(self.dir, 'in', 'sub'))
+        self.csv = '566446.108,2529618.096,51.610\n525000.011,2650967.938,172.591\n'
+        with open(os.path.join(self.dir, 'in', 'a.csv'), 'w') as f:
+            f.write(self.csv)
+        with gzip.open(os.path.join(self.dir, 'in', 'sub', 'b.csv.gz'), 'wt') as f:
+            f.write(self.csv)
+        np.save(os.path.join(self.dir, 'in', 'sub', 'c.npy'), np.array([[566446.108, 2529618.096, 51.610]]))
+
+    def run_command(self, *args, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('transform_file', *args, from_srid=1000005, to_srid=2100, csv_fields='x,y,z',
+            stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue()
+
+    def test_directory(self):
+        expected = self.client.post('/api/', {
+            'from_srid': 1000005, 'to_srid': 2100, 'input_type': 'csv', 'csv_fields': 'x,y,z', 'input': StringIO(self.csv),
+        }).json()['result']
+        for workers in [1, 2]:
+            out = os.path.join(self.dir, 'out%d' % workers)
+            stdout = self.run_command(os.path.join(self.dir, 'in'), output_dir=out, workers=workers)
+            self.assertIn('3 files, 5 points', stdout)
+            for name in ['a.csv', os.path.join('sub', 'b.csv')]:
+                with open(os.path.join(out, name)) as f:
+                    self.assertEqual(f.read(), expected)
+            coords = np.load(os.path.join(out, 'sub', 'c.npy'))
+            self.assertEqual(np.round(coords, 3).tolist(), [[566296.537, 4529332.307, 6.501]])
+
+    def test_next_to_input_and_failed_files(self):
+        path = os.path.join(self.dir, 'in', 'a.csv')
+        self.run_command(path)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'in', 'a_transformed.csv')))
+
+        with open(path, 'w') as f:
+            f.write('1,2,3\n')
+        with self.assertRaises(CommandError):
+            self.run_command(path)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'in', 'a_transformed.csv')))
+
+    def test_output_dir_of_the_inputs(self):
+        expected = self.client.post('/api/', {
+            'from_srid': 1000005, 'to_srid': 2100, 'input_type': 'csv', 'csv_fields': 'x,y,z', 'input': StringIO(self.csv),
+        }).json()['result']
+        directory = os.path.join(self.dir, 'in')
+        self.run_command(os.path.join(directory, 'a.csv'), output_dir=directory)
+        with open(os.path.join(directory, 'a.csv')) as f:
+            self.assertEqual(f.read(), self.csv)
+        with open(os.path.join(directory, 'a_transformed.csv')) as f:
+            self.assertEqual(f.read(), expected)
+
+        # the outputs of the first run are not inputs of the second one
+        for _ in range(2):
+            stdout = self.run_command(directory, output_dir=directory)
+            self.assertIn('3 files, 5 points', stdout)
+        self.assertEqual(sorted(os.listdir(os.path.join(directory, 'sub'))),
+            ['b.csv.gz', 'b_transformed.csv', 'c.npy', 'c_transformed.npy'])
+        with open(os.path.join(directory, 'sub', 'b_transformed.csv')) as f:
+            self.assertEqual(f.read(), expected)
+
+        # sub/b.csv.gz and sub/b.csv would both be written to sub/b_transformed.csv
+        with open(os.path.join(directory, 'sub', 'b.csv'), 'w') as f:
+            f.write(self.csv)
+        with self.assertRaises(CommandError):
+            self.run_command(directory, output_dir=directory)
+        with open(os.path.join(directory, 'sub', 'b.csv')) as f:
+            self.assertEqual(f.read(), self.csv)
+
+    def test_output_dir_below_the_inputs(self):
+        # the files of the output directory are not inputs of the second run
+        directory = os.path.join(self.dir, 'in')
+        out = os.path.join(directory, 'out')
+        for _ in range(2):
+            stdout = self.run_command(directory, output_dir=out)
+            self.assertIn('3 files, 5 points', stdout)
+        self.assertEqual(sorted(os.listdir(out)), ['a.csv', 'sub'])
+
+class BenchmarkCommandTest(TestCase):
+
+    def test_report(self):
+        path = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(os.remove, path)
+        routes = ['htrs07_to_hgrs87_hepos', 'hgrs87_to_hatt_okxe_auto', 'old_bessel_centroid_to_hgrs87']
+        call_command('benchmark', sizes='10,50', repeat=2, routes=routes, drivers=['csv', 'geojson_stream'],
+            label='test', output=path, stdout=StringIO(), stderr=StringIO())
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report['label'], 'test')
+        self.assertEqual(report['options']['sizes'], [10, 50])
+        results = report['results']
+        self.assertEqual([(r['group'], r['name'], r['points']) for r in results], [
+            ('route', name, n) for name in routes for n in [10, 50]
+        ] + [('driver', name, n) for n in [10, 50] for name in ['csv', 'geojson_stream']])
+        for r in results:
+            self.assertEqual(len(r['seconds']), 2)
+            self.assertEqual(r['best_seconds'], min(r['seconds']))
+        self.assertEqual(results[0]['steps'], ['hepos'])
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark', sizes='1e2,x', stdout=StringIO(), stderr=StringIO())
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTest(TestCase):
+
+    def sample(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start + ' '):
+                return float(line.split(' ')[-1])
+        return 0.0
+
+    def test_registry(self):
+        registry = Registry()
+        counter = registry.counter('requests_total', 'Requests.', ['route'])
+        histogram = registry.histogram('duration_seconds', 'Duration.', [], buckets=(0.1, 1))
+        counter.inc(route='a"b')
+        counter.inc(2, route='a"b')
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{route="a\\"b"} 3',
+            '# HELP duration_seconds Duration.',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{le="0.1"} 0',
+            'duration_seconds_bucket{le="1"} 1',
+            'duration_seconds_bucket{le="+Inf"} 2',
+            'duration_seconds_sum 5.5',
+            'duration_seconds_count 2',
+        ]) + '\n')
+        with self.assertRaises(ValueError):
+            counter.inc(other='a')
+
+    def test_endpoint(self):
+        route = '{route="HTRS07->HGRS87"}'
+        before = self.client.get('/metrics/').content.decode()
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'x,y,z',
+            'input': StringIO('566446.108,2529618.096,51.610\n525000.011,2650967.938,172.591\n'),
+        }
+        self.client.post('/api/', params)
+        params['input'] = StringIO('1,2,3\n')
+        self.client.post('/api/', params)
+
+        response = self.client.get('/metrics/')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        after = response.content.decode()
+        for name, increase in [
+            ('survgr_transform_requests_total{route="HTRS07->HGRS87",input_type="csv",status="200"}', 1),
+            ('survgr_transform_requests_total{route="HTRS07->HGRS87",input_type="csv",status="404"}', 1),
+            ('survgr_transform_request_duration_seconds_count' + route, 2),
+            ('survgr_transform_points_total' + route, 2),
+            ('survgr_transform_points_per_second_count' + route, 1),
+            ('survgr_upload_size_bytes_count{endpoint="transform"}', 2),
+        ]:
+            self.assertEqual(self.sample(after, name) - self.sample(before, name), increase, name)
+        self.assertIn('# TYPE survgr_pipeline_cache_hit_ratio gauge', after)
+        for name in ['survgr_proj_transformer_hits_total', 'survgr_hattblock_registry_size', 'survgr_hepos_grid_loads_total']:
+            self.assertIn('# HELP %s ' % name, after)
+        self.assertGreater(self.sample(after, 'survgr_proj_transformer_hits_total'), self.sample(before, 'survgr_proj_transformer_hits_total'))
+        self.assertEqual(self.sample(after, 'survgr_hattblock_registry_size'), Hattblock.objects.count())
+        self.assertGreater(self.sample(after, 'survgr_pipeline_cache_hits_total'), self.sample(before, 'survgr_pipeline_cache_hits_total'))
+
+    def test_access(self):
+        with self.settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get('/metrics/').status_code, 404)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, 401)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer other').status_code, 401)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_failed_stream(self):
+        route = '{route="HTRS07->HGRS87"}'
+        before = self.client.get('/metrics/').content.decode()
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'x,y,z',
+            'stream': 'true',
+            # the second chunk fails, after the response has started
+            'input': StringIO('566446.108,2529618.096,51.610\n1,2,3\n'),
+        }
+        with self.settings(TRANSFORM_CSV_CHUNK_SIZE=1):
+            response = self.client.post('/api/', params)
+            self.assertEqual(response.status_code, 200)
+            with self.assertRaises(IndexError):
+                b''.join(response.streaming_content)
+
+        after = self.client.get('/metrics/').content.decode()
+        for name, increase in [
+            ('survgr_transform_requests_total{route="HTRS07->HGRS87",input_type="csv",status="error"}', 1),
+            ('survgr_transform_requests_total{route="HTRS07->HGRS87",input_type="csv",status="200"}', 0),
+            ('survgr_transform_request_duration_seconds_count' + route, 1),
+            ('survgr_transform_points_total' + route, 0),
+            ('survgr_transform_points_per_second_count' + route, 0),
+        ]:
+            self.assertEqual(self.sample(after, name) - self.sample(before, name), increase, name)
+
+class PipelineCacheTest(TestCase):
+
+    def setUp(self):
+        pipeline_cache.clear()
+
+    def test_lru_eviction(self):
+        cache = PipelineCache(maxsize=2)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        self.assertEqual(cache.get('b', lambda: 2), 2)
+        self.assertEqual(cache.get('a', lambda: -1), 1) # hit, 'a' becomes most recent
+        self.assertEqual(cache.get('c', lambda: 3), 3)  # evicts 'b'
+        self.assertEqual(cache.get('b', lambda: 4), 4)
+        stats = cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 4)
+        self.assertEqual(stats['evictions'], 2)
+
+    def test_normalized_params(self):
+        hits = pipeline_cache.stats()['hits']
+        t1 = get_transformer(from_srid=1000000, to_srid=2100, from_hatt_id='27')
+        t2 = get_transformer(from_hatt_id=27, to_srid=2100)
+        self.assertIs(t1, t2)
+        t3 = get_transformer(to_srid=1000000, from_srid=2100, to_hatt_id=27, okxe_inverse_type='coeffs')
+        self.assertIsNot(t1, t3)
+        self.assertEqual(pipeline_cache.stats()['hits'], hits + 1)
+
+        # errors are not cached
+        with self.assertRaises(ValueError):
+            get_transformer(from_srid=1000000, to_srid=2100)
+        with self.assertRaises(ValueError):
+            get_transformer(from_srid=1000000, to_srid=2100)
+
+    def test_invalidation(self):
+        t1 = get_transformer(from_hatt_id=27, to_srid=2100)
+        hb = Hattblock.objects.get(id=27)
+        hb.save()
+        self.assertEqual(len(pipeline_cache), 0)
+        t2 = get_transformer(from_hatt_id=27, to_srid=2100)
+        self.assertIsNot(t1, t2)
+
+class ProjPoolTest(TestCase):
+
+    def test_shared_crs_per_thread_transformers(self):
+        pool = ProjPool(maxsize=4)
+        tm87 = '+proj=etmerc +lat_0=0 +lon_0=24 +k=0.9996 +x_0=500000 +y_0=0 +ellps=GRS80 +towgs84=-199.723,74.030,246.018 +units=m +no_defs'
+        ggrs87 = '+proj=longlat +ellps=GRS80 +towgs84=-199.723,74.030,246.018 +no_defs'
+        self.assertIs(pool.crs(tm87), pool.crs(tm87))
+        t1 = pool.transformer(tm87, ggrs87)
+        self.assertIs(t1, pool.transformer(tm87, ggrs87))
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.transformer(tm87, ggrs87)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(t1, other[0])
+        self.assertEqual(t1.transform(210057.870, 4356213.327), other[0].transform(210057.870, 4356213.327))
+
 class TransformAPITestHattGGRS87(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -702,6 +1545,21 @@ class TransformAPITestHattGGRS87(TestCase):
             self.assertTrue(np.array_equal(df_out['x'], self.df_expect['x']))
             self.assertTrue(np.array_equal(df_out['y'], self.df_expect['y']))
 
+    def test_csv_auto_hatt(self):
+        params = {
+            'from_srid': 2100,    # hgrs87 tm87
+            'to_srid':1000000,    # hatt
+            'to_hatt_id': 'auto',
+            'input_type': 'csv',
+            'csv_fields': 'id,x,y',
+            'input': StringIO(self.df_expect.to_csv(columns=['x','y'], header=False, index=True))
+        }
+        response = self.client.post('/api/', params)
+        df_out = pd.read_csv(StringIO(response.json()['result']), names=['id','x','y','hatt_id'], index_col='id')
+        self.assertTrue(np.array_equal(df_out['x'], self.df_in['x']))
+        self.assertTrue(np.array_equal(df_out['y'], self.df_in['y']))
+        self.assertEqual(list(df_out['hatt_id']), [27, 27, 27])
+
     def test_geojson(self):
         num_rows = len(self.df_in.index)
 
@@ -787,6 +1645,281 @@ class TransformAPITestHTRS07GGRS87(TestCase):
             self.assertTrue(np.array_equal(df_out['y'], self.df_expect['y']))
             self.assertTrue(np.array_equal(df_out['z'], self.df_expect['z']))
 
+    def test_csv_stream(self):
+        df_in = pd.concat([self.df_in]*3)
+        df_in.index = ['s%d' % i for i in range(len(df_in))]
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'id,x,y,z',
+            'input': StringIO(df_in.to_csv(sep=';', columns=['x','y','z'], header=False, index=True)),
+        }
+        expected = self.client.post('/api/', params).json()
+
+        params['input'].seek(0)
+        params['stream'] = 'true'
+        with self.settings(TRANSFORM_CSV_CHUNK_SIZE=4):
+            response = self.client.post('/api/', params)
+        self.assertTrue(response.streaming)
+        output = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(output, expected)
+
+        # errors in the first chunk still fail the request
+        params['input'] = StringIO('1;2;3\n')
+        with self.settings(TRANSFORM_CSV_CHUNK_SIZE=4):
+            response = self.client.post('/api/', params)
+        self.assertEqual(response.status_code, 404)
+
+    def test_async_view(self):
+        df_in = pd.concat([self.df_in]*3)
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'x,y,z',
+            'input': StringIO(df_in.to_csv(sep=',', columns=['x','y','z'], header=False, index=False)),
+        }
+        expected = self.client.post('/api/', params).json()
+        self.assertTrue(views.transform_async.csrf_exempt)
+
+        @async_to_sync
+        async def post(params):
+            params['input'].seek(0)
+            response = await views.transform_async(AsyncRequestFactory().post('/api/', params))
+            if not response.streaming:
+                return response, response.content
+            self.assertTrue(response.is_async)
+            return response, b''.join([chunk async for chunk in response])
+
+        response, content = post(params)
+        self.assertEqual(json.loads(content), expected)
+
+        params['stream'] = 'true'
+        with self.settings(TRANSFORM_CSV_CHUNK_SIZE=2):
+            response, content = post(params)
+        self.assertEqual(json.loads(content), expected)
+
+        params['input'] = StringIO('1,2,3\n')
+        response, content = post(params)
+        self.assertEqual(response.status_code, 404)
+
+    def test_timings(self):
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'x,y,z',
+            'input': StringIO(self.df_in.to_csv(sep=',', columns=['x','y','z'], header=False, index=False) * 3),
+        }
+        response = self.client.post('/api/', params)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        params['input'].seek(0)
+        with self.settings(TRANSFORM_SERVER_TIMING=True):
+            response = self.client.post('/api/', params)
+        self.assertRegex(response['Server-Timing'], r'csv_read;dur=[0-9.]+, hepos;dur=[0-9.]+, transform;dur=[0-9.]+, csv_format;dur=[0-9.]+, total;dur=[0-9.]+$')
+
+        # streams are logged when they end
+        params['input'].seek(0)
+        params['stream'] = 'true'
+        with self.settings(TRANSFORM_CSV_CHUNK_SIZE=2), self.assertLogs('transform.timing', 'INFO') as logs:
+            response = self.client.post('/api/', params)
+            self.assertEqual(logs.records, [])
+            response.getvalue()
+        self.assertEqual(logs.records[0].info, {'input_type': 'csv', 'from_srid': '1000005', 'to_srid': '2100', 'status': 200})
+        self.assertEqual(logs.records[0].timings['hepos']['points'], 6)
+        self.assertEqual(logs.records[0].timings['csv_format']['calls'], 3)
+
+    def test_geojson_stream(self):
+        features = [
+            {'type': 'Feature', 'properties': {'id': i}, 'geometry': {'type': 'Point', 'coordinates': [x, y, z]}}
+            for i, (x, y, z) in enumerate(self.df_in.values.tolist() * 3)
+        ]
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'geojson',
+            'input': StringIO(json.dumps({'type': 'FeatureCollection', 'features': features})),
+        }
+        expected = self.client.post('/api/', params).json()
+
+        params['input'].seek(0)
+        params['stream'] = 'true'
+        with self.settings(TRANSFORM_GEOJSON_BATCH_SIZE=4):
+            response = self.client.post('/api/', params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+
+        # errors in the first batch happen before the response starts
+        features[1]['geometry']['coordinates'] = [1e7, 1e7, 0]
+        params['input'] = StringIO(json.dumps({'type': 'FeatureCollection', 'features': features}))
+        with self.settings(TRANSFORM_GEOJSON_BATCH_SIZE=4):
+            response = self.client.post('/api/', params)
+        self.assertEqual(response.status_code, 404)
+
+    def test_npy(self):
+        xyz = self.df_in[['x','y','z']].values
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'npy',
+            'input': BytesIO(),
+        }
+        np.save(params['input'], xyz)
+        params['input'].seek(0)
+        response = self.client.post('/api/', params)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertEqual(len(json.loads(response['X-Transformation-Steps'])), 1)
+        result = np.load(BytesIO(response.getvalue()))
+        self.assertEqual(result.shape, (2, 3))
+        self.assertTrue(np.array_equal(result.round(3), self.df_expect[['x','y','z']].values))
+
+    def test_npz_mark_invalid_points(self):
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'npz',
+            'invalid_points': 'mark',
+            'input': BytesIO(),
+        }
+        np.savez(params['input'], id=np.array(['s1', 's2', 's3']),
+            x=np.append(self.df_in['x'].values, 0.0), y=np.append(self.df_in['y'].values, 0.0), # outside the hepos grid
+            z=np.append(self.df_in['z'].values, 0.0))
+        params['input'].seek(0)
+        result = np.load(BytesIO(self.client.post('/api/', params).getvalue()))
+        self.assertEqual(list(result['id']), ['s1', 's2', 's3'])
+        self.assertEqual(list(result['valid']), [True, True, False])
+        self.assertTrue(np.array_equal(result['x'][:2].round(3), self.df_expect['x']))
+        self.assertTrue(np.isnan(result['y'][2]))
+
+    def test_npz_shape(self):
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'npz',
+            'invalid_points': 'mark',
+            'input': BytesIO(),
+        }
+        # the points of both rows are the same, the outputs keep the (2, 2) shape
+        x, y, z = (np.tile(self.df_in[name].values, (2, 1)) for name in ['x', 'y', 'z'])
+        np.savez(params['input'], x=x, y=y, z=z)
+        params['input'].seek(0)
+        result = np.load(BytesIO(self.client.post('/api/', params).getvalue()))
+        for name in ['x', 'y', 'z', 'valid']:
+            self.assertEqual(result[name].shape, (2, 2))
+        self.assertTrue(result['valid'].all())
+        self.assertTrue(np.array_equal(result['x'].round(3), np.tile(self.df_expect['x'].values, (2, 1))))
+
+        params['input'] = BytesIO()
+        np.savez(params['input'], x=x, y=y.ravel())
+        params['input'].seek(0)
+        self.assertEqual(self.client.post('/api/', params).status_code, 404)
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def test_arrow_and_parquet(self):
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(self.df_in.reset_index())
+        inputs = {'arrow': BytesIO(), 'parquet': BytesIO()}
+        with pa.ipc.new_file(inputs['arrow'], table.schema) as writer:
+            writer.write_table(table)
+        pq.write_table(table, inputs['parquet'])
+        for input_type, read in [('arrow', lambda f: pa.ipc.open_file(f).read_all()), ('parquet', pq.read_table)]:
+            inputs[input_type].seek(0)
+            params = {
+                'from_srid':1000005, # htrs07 tm07
+                'to_srid': 2100,     # hgrs87 tm87
+                'input_type': input_type,
+                'input': inputs[input_type],
+            }
+            response = self.client.post('/api/', params)
+            self.assertIn('X-Transformation-Steps', response)
+            df_out = read(BytesIO(response.getvalue())).to_pandas().set_index('id')
+            self.assertTrue(np.array_equal(df_out[['x','y','z']].round(3), self.df_expect[['x','y','z']]))
+
+    def test_file_output(self):
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'id,x,y,z',
+            'input': StringIO(self.df_in.to_csv(sep=';', columns=['x','y','z'], header=False, index=True)),
+        }
+        expected = self.client.post('/api/', params).json()
+        params['input'].seek(0)
+        params['output'] = 'file'
+        response = self.client.post('/api/', params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response.getvalue().decode(), expected['result'])
+        self.assertEqual(json.loads(response['X-Transformation-Steps']), expected['steps'])
+
+        features = [
+            {'type': 'Feature', 'properties': {'id': i}, 'geometry': {'type': 'Point', 'coordinates': [x, y, z]}}
+            for i, (x, y, z) in enumerate(self.df_in.values.tolist())
+        ]
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'geojson',
+            'input': StringIO(json.dumps({'type': 'FeatureCollection', 'features': features})),
+        }
+        expected = self.client.post('/api/', params).json()
+        params['input'].seek(0)
+        params['output'] = 'file'
+        response = self.client.post('/api/', params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = response.getvalue().decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected['result']['features'])
+        self.assertEqual(json.loads(response['X-Transformation-Steps']), expected['steps'])
+
+        params['input'] = StringIO('{"type": "FeatureCollection", "features": [1, 2')
+        self.assertEqual(self.client.post('/api/', params).status_code, 404)
+
+    def test_compressed_input_and_output(self):
+        text = self.df_in.to_csv(sep=';', columns=['x','y','z'], header=False, index=True)
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'id,x,y,z',
+            'input': StringIO(text),
+        }
+        expected = self.client.post('/api/', params).json()
+
+        inputs = [gzip.compress(text.encode())]
+        if compression.zstandard is not None:
+            inputs.append(compression.zstandard.ZstdCompressor().compress(text.encode()))
+        for data in inputs:
+            for stream in ['false', 'true']:
+                params['input'] = BytesIO(data)
+                params['stream'] = stream
+                response = self.client.post('/api/', params, HTTP_ACCEPT_ENCODING='gzip, deflate')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(json.loads(gzip.decompress(response.getvalue())), expected)
+
+        # not accepted
+        params['input'] = BytesIO(inputs[0])
+        response = self.client.post('/api/', params, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.getvalue()), expected)
+
+    def test_decompressed_stream(self):
+        class Unseekable(BytesIO):
+            def seek(self, *args):
+                raise OSError('not seekable')
+        text = 'a;b\n1;2\n3;4\n' * 10000
+        data = gzip.compress(text.encode())
+        stream = compression.decompressed(Unseekable(data))
+        self.assertEqual(stream.read(4), b'a;b\n')
+        self.assertEqual(stream.read(), text[4:].encode())
+
+        reader = compression.PrefixedReader('a;b\n1;', StringIO('2\n3;4\n'))
+        self.assertEqual(reader.readline(), 'a;b\n')
+        self.assertEqual(reader.readline(), '1;2\n')
+        self.assertEqual(reader.read(), '3;4\n')
+
     def test_csv_yxz(self):
         for sep in [',', ', ', ';', '\t', ' ']:
             sep_with_space = sep == ', '
@@ -905,3 +2038,45 @@ class TransformAPITestHTRS07GGRS87(TestCase):
             self.assertTrue(abs(geom['coordinates'][i][2] -
                 self.df_expect.iloc[i]['z']) < 0.001)
 
+    def test_csv_mark_invalid_points(self):
+        df_in = self.df_in.copy()
+        df_in.loc['s3'] = [0.0, 0.0, 10.0] # outside the hepos grid
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'csv',
+            'csv_fields': 'id,x,y,z',
+            'input': StringIO(df_in.to_csv(columns=['x','y','z'], header=False, index=True)),
+        }
+        response = self.client.post('/api/', params)
+        self.assertEqual(response.status_code, 404)
+
+        params['input'].seek(0)
+        params['invalid_points'] = 'mark'
+        response = self.client.post('/api/', params)
+        output = response.json()
+        df_out = pd.read_csv(StringIO(output['result']), names=['id','x','y','z','status'], index_col='id')
+        self.assertEqual(list(df_out['status']), ['ok', 'ok', 'invalid'])
+        self.assertTrue(np.array_equal(df_out['x'][:2], self.df_expect['x']))
+        self.assertTrue(np.array_equal(df_out['z'][:2], self.df_expect['z']))
+        self.assertTrue(df_out.loc['s3', ['x','y','z']].isna().all())
+
+    def test_geojson_mark_invalid_points(self):
+        features = [
+            {'type': 'Feature', 'properties': {'name': name}, 'geometry': {'type': 'Point', 'coordinates': xy}}
+            for name, xy in [('in', [566446.108, 2529618.096, 51.610]), ('out', [0.0, 0.0, 0.0])]
+        ]
+        params = {
+            'from_srid':1000005, # htrs07 tm07
+            'to_srid': 2100,     # hgrs87 tm87
+            'input_type': 'geojson',
+            'invalid_points': 'mark',
+            'input': StringIO(json.dumps({'type': 'FeatureCollection', 'features': features})),
+        }
+        response = self.client.post('/api/', params)
+        result = response.json()['result']
+        feat_in, feat_out = result['features']
+        self.assertEqual(feat_in['properties']['transform_status'], 'ok')
+        self.assertEqual(round(feat_in['geometry']['coordinates'][0], 3), 566296.537)
+        self.assertEqual(feat_out['properties']['transform_status'], 'invalid')
+        self.assertIsNone(feat_out['geometry'])
@@ -0,0 +1,138 @@
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Timing instrumentation of the transformations.
+#
+# The wall time and the number of points of the compilation, of each step of the
+# transformers and of the driver phases (parsing, formatting) are added to the Timings
+# of the current context, if any. Timings are collected in a "with collect()" block,
+# so the cost without one is a context variable lookup per step.
+# Phases with the same name (i.e. the chunks of a stream) are summed.
+
+logger = logging.getLogger('transform.timing')
+
+_current = contextvars.ContextVar('transform_timings', default=None)
+
+class Timings(object):
+	'''
+	Wall time (seconds), number of points and number of calls of each named phase, in the order they first ran.
+	'''
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.phases = {}
+		self.started = time.perf_counter()
+
+	def add(self, name, seconds, points=None):
+		# the chunks of a parallel run add from several threads
+		with self._lock:
+			phase = self.phases.get(name)
+			if phase is None:
+				phase = self.phases[name] = {'seconds': 0.0, 'points': 0, 'calls': 0}
+			phase['seconds'] += seconds
+			phase['calls'] += 1
+			if points is not None:
+				phase['points'] += points
+
+	def elapsed(self):
+		return time.perf_counter() - self.started
+
+	def as_dict(self):
+		with self._lock:
+			return {name: dict(phase) for name, phase in self.phases.items()}
+
+	def server_timing(self):
+		'''
+		Value of the Server-Timing response header, durations in milliseconds.
+		'''
+		metrics = ['%s;dur=%.3f' % (name, phase['seconds'] * 1000) for name, phase in self.as_dict().items()]
+		metrics.append('total;dur=%.3f' % (self.elapsed() * 1000))
+		return ', '.join(metrics)
+
+	def __str__(self):
+		phases = ['%s=%.1fms/%dpts' % (name, phase['seconds'] * 1000, phase['points']) for name, phase in self.as_dict().items()]
+		return ' '.join(phases + ['total=%.1fms' % (self.elapsed() * 1000)])
+
+def current():
+	'''
+	Returns the Timings being collected in this context, None if none.
+	'''
+	return _current.get()
+
+@contextmanager
+def collect():
+	'''
+	Collects the timings of the transformations run in the block, in a new Timings.
+	'''
+	timings = Timings()
+	token = _current.set(timings)
+	try:
+		yield timings
+	finally:
+		_current.reset(token)
+
+def record(name, seconds, points=None):
+	timings = _current.get()
+	if timings is not None:
+		timings.add(name, seconds, points)
+
+@contextmanager
+def timed(name, points=None):
+	'''
+	Records the wall time of the block as the phase name.
+	'''
+	timings = _current.get()
+	if timings is None:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		timings.add(name, time.perf_counter() - start, points)
+
+def timed_iter(name, iterable):
+	'''
+	Iterates over iterable, recording the time taken to produce each item as the phase name.
+	'''
+	if _current.get() is None:
+		yield from iterable
+		return
+	iterator = iter(iterable)
+	while True:
+		with timed(name):
+			item = next(iterator, _END)
+		if item is _END:
+			return
+		yield item
+
+_END = object()
+
+def log(timings, info):
+	'''
+	Logs the timings of a request, with its info (a dict, i.e. the input type), as text and as the
+	"timings" and "info" attributes of the log record for structured handlers.
+	'''
+	if logger.isEnabledFor(logging.INFO):
+		logger.info('%s %s', ' '.join('%s=%s' % item for item in info.items()), timings,
+			extra={'timings': timings.as_dict(), 'info': info})
+
+def bound(iterable, context, on_end):
+	'''
+	Produces the items of iterable in context (a contextvars.Context), i.e. the chunks of a
+	streaming response that are produced after the view has returned. Calls on_end(completed)
+	when it ends, completed is False for failed or closed (i.e. client disconnected) streams.
+	'''
+	iterator = iter(iterable)
+	completed = False
+	try:
+		while True:
+			item = context.run(next, iterator, _END)
+			if item is _END:
+				break
+			yield item
+		completed = True
+	finally:
+		on_end(completed)
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 import enum
+import time
 
-import pyproj
 import numpy as np
 
 from .hatt.models import Hattblock
-from .hatt.okxe_transformer import OKXETransformer
+from .hatt.registry import hattblock_registry
+from .hatt.okxe_transformer import OKXETransformer, OKXEBatchTransformer
 from .hatt.proj_generate import proj_text as hatt_proj_text_generate
 from .htrs.hepos_transformer import HeposTransformer
+from .cache import pipeline_cache
+from .proj_pool import proj_pool, pipeline_steps
+from .parallel import chunk_executor
+from . import timing
 from procrustes import deserialize as deserialize_procrustes
 
 @enum.unique
@@ -73,18 +78,45 @@ HATT_NEW_SRID = 1000000
 HATT_OLD_SRID = 1000008
 TM07_SRID = 1000005
 TM87_SRID = 2100
+NEW_BESSEL_SRID = 4815
 PROCRUSTES_SRID = 1000006
 
+# from_hatt_id / to_hatt_id value for the automatic hatt block lookup of each point
+AUTO_HATT = 'auto'
+
 class TransformerError(Exception):
 	pass
 
 class ProjTransformer(object):
 
 	def __init__(self, from_proj, to_proj):
-		self._transformer = pyproj.Transformer.from_proj(from_proj, to_proj)
+		self._from_proj = from_proj
+		self._to_proj = to_proj
+		# create (and validate) the transformer for this thread at compile time
+		proj_pool.transformer(from_proj, to_proj)
+
+	def __call__(self, x, y, z=None):
+		return proj_pool.transformer(self._from_proj, self._to_proj).transform(x, y, z)
+
+	def proj_steps(self):
+		# the steps of the coordinate operation chosen by PROJ, used for pipeline fusion
+		return pipeline_steps(proj_pool.transformer(self._from_proj, self._to_proj).to_proj4())
+
+class ProjPipelineTransformer(object):
+	'''
+	Runs the steps of consecutive PROJ expressible transformers as a single PROJ pipeline,
+	so that the coordinates pass through PROJ once instead of once per transformer.
+	'''
+	def __init__(self, steps):
+		self._steps = list(steps)
+		self._pipeline = ' '.join(['+proj=pipeline'] + ['+step %s' % step for step in self._steps])
+		proj_pool.pipeline(self._pipeline)
 
 	def __call__(self, x, y, z=None):
-		return self._transformer.transform(x, y, z)
+		return proj_pool.pipeline(self._pipeline).transform(x, y, z)
+
+	def proj_steps(self):
+		return list(self._steps)
 
 class ProcrustesTransformer(object):
 
@@ -104,6 +136,93 @@ class ProcrustesTransformer(object):
 		x, y = out_coords[:, 0], out_coords[:, 1]
 		return tuple(filter(lambda array: array is not None, [x, y, z]))
 
+class AutoHattTransformer(object):
+	'''
+	OKXE transformation with automatic hatt block lookup.
+	Each point is assigned to the hatt block that contains it and is transformed
+	with the coefficients of its own block, all blocks in one batched OKXE call.
+	Forward: from a system of the old greek datum (proj4text) to GGRS87 / TM87.
+	Inverse: from GGRS87 / TM87 to the Hatt projection of each point's block (proj4text None),
+	or to another system of the old greek datum.
+	Points outside of all the blocks are invalid.
+	'''
+	supports_masked = True
+
+	def __init__(self, proj4text, inverse, iterative_inverse=True):
+		self._proj4text = proj4text
+		self._inverse = inverse
+		self._blocks, coeffs, self._spatial_index = hattblock_registry.snapshot()
+		self._okxe = OKXEBatchTransformer(coeffs, inverse=inverse, iterative_inverse=iterative_inverse)
+		# the block polygons are in geographic coordinates of the old greek datum
+		self._locator = ProjTransformer(REF_SYS[TM87_SRID].proj4text if inverse else proj4text,
+			REF_SYS[NEW_BESSEL_SRID].proj4text)
+
+	def __call__(self, x, y, z=None, masked=False, hatt_ids=None):
+		shape = np.shape(x)
+		x = np.array(x, dtype=np.float64).ravel()
+		y = np.array(y, dtype=np.float64).ravel()
+
+		rows = self._spatial_index.locate(*self._locator(x, y))
+		found = rows >= 0
+		if not masked and not found.all():
+			raise IndexError('points outside of the hatt blocks')
+		rows[~found] = 0
+
+		if not self._inverse:
+			self._project_blocks(rows, x, y, to_hatt=True)
+			x, y = self._okxe(rows, x, y)
+		else:
+			x, y = self._okxe(rows, x, y)
+			if self._proj4text is not None:
+				self._project_blocks(rows, x, y, to_hatt=False)
+
+		x[~found] = np.nan
+		y[~found] = np.nan
+		if hatt_ids is not None:
+			block_ids = np.array([block.id for block in self._blocks], dtype=np.int64)
+			hatt_ids.append(np.where(found, block_ids[rows], -1).reshape(shape))
+
+		x, y = x.reshape(shape), y.reshape(shape)
+		return (x, y) if z is None else (x, y, z)
+
+	def _project_blocks(self, rows, x, y, to_hatt):
+		# one projection call per block, between its hatt projection and proj4text (in place)
+		order = np.argsort(rows, kind='stable')
+		starts = np.flatnonzero(np.diff(rows[order])) + 1
+		for group in np.split(order, starts):
+			if group.size == 0:
+				continue
+			block = self._blocks[rows[group[0]]]
+			if to_hatt:
+				transformer = proj_pool.transformer(self._proj4text, block.proj4text)
+			else:
+				transformer = proj_pool.transformer(block.proj4text, self._proj4text)
+			x[group], y[group] = transformer.transform(x[group], y[group])
+
+class _AutoHattblock(object):
+	# stands in for the hatt block parameters with the automatic hatt block lookup
+	id = None
+	name = 'αυτόματη επιλογή φύλλου'
+	proj4text = None
+
+def _specialize_refsys(srid, params, side):
+	'''
+	Returns the reference system of srid, with the proj4 definition of the hatt block (new bessel)
+	or the hatt centroid (old bessel) of the side ('from' or 'to') of the transformation parameters.
+	'''
+	srs = REF_SYS[srid]
+	if srid == HATT_NEW_SRID:
+		hattblock = params['%s_hattblock' % side]
+		return ReferenceSystem(name = '%s (%s)' % (srs.name, hattblock.name),
+					  datum = srs.datum,
+					  proj4text = hattblock.proj4text)
+	elif srid == HATT_OLD_SRID:
+		phi0, lambda0 = params['%s_hatt_centroid' % side]
+		return ReferenceSystem(name = '%s (Φο=%.2f, Λο=%.2f)' % (srs.name, phi0, lambda0),
+					  datum = srs.datum,
+					  proj4text = hatt_proj_text_generate(phi0, lambda0))
+	return srs
+
 class WorkHorseTransformer(object):
 	'''
 	Transforms points from ref. system 1 to ref. system 2 using other sub-transformers:
@@ -111,6 +230,7 @@ class WorkHorseTransformer(object):
 		- OKXETransformer
 		- HeposTransformer
 		- ProcrustesTransformer
+		- AutoHattTransformer
 	Transformers are functors that get called with x, y and maybe z numpy arrays as arguments
 	and return x, y, maybe z numpy arrays transformed.
 	Keyword arguments can be:
@@ -121,28 +241,46 @@ class WorkHorseTransformer(object):
 		Hatt params:
 		-from_hatt_id: for the NEW_BESSEL datum, the id of the 1:50000 hatt block (given by OKXE service) if ref. system 1 is a hattblock.
 		-to_hatt_id: for the NEW_BESSEL datum the id of the 1:50000 hatt block if ref. system 2 is a hattblock.
+		 Either id can be 'auto', then the block of each point is found from its position. This needs
+		 the points in a non Hatt system (i.e. TM3 zones for from_hatt_id), and when ref. system 2 is Hatt
+		 the output coordinates are in the block of each point (see hatt_ids in __call__).
 		-okxe_inverse_type: for the NEW_BESSEL datum, if the okxe inverse transform will be iterative or use the respective inverse coefficients
 		-from_hatt_centroid: for the OLD_BESSEL datum, a centroid for the hatt source projection
 		-to_hatt_centroid: for the OLD_BESSEL datum, a centroid for the hatt destination projection
+		Hepos params:
+		-hepos_mode: for the HTRS07 datum, 'grid' (default) applies the Hepos grid with numpy,
+		 'proj' runs the whole transformation in PROJ with the converted grid (approximate to a few mm)
 	'''
 
 	def __init__(self, **params):
+		start = time.perf_counter()
 		self.transformers = []
 		self.transformation_steps = []
 		self.log = []
+		self._hepos_mode = params.get('hepos_mode', 'grid')
+		# large arrays are transformed in chunks on the chunk executor (see _run)
+		self.parallel = True
+		# true if the output coordinates are in the hatt block of each point
+		self.outputs_hatt_ids = False
 
 		# add hattblock objects to the parameters, needed in _compile function
 		if 'from_hatt_id' in params:
 			if 'from_srid' not in params: params['from_srid'] = HATT_NEW_SRID
 			try:
-				params['from_hattblock'] = Hattblock.objects.get(id=params['from_hatt_id'])
+				if params['from_hatt_id'] == AUTO_HATT:
+					params['from_hattblock'] = _AutoHattblock()
+				else:
+					params['from_hattblock'] = hattblock_registry.get(params['from_hatt_id'])
 			except Hattblock.DoesNotExist:
 				raise ValueError("Parameter Error: Hatt block with id=%d does not exist" % params['from_hatt_id'])
 
 		if 'to_hatt_id' in params:
 			if 'to_srid' not in params: params['to_srid'] = HATT_NEW_SRID
 			try:
-				params['to_hattblock'] = Hattblock.objects.get(id=params['to_hatt_id'])
+				if params['to_hatt_id'] == AUTO_HATT:
+					params['to_hattblock'] = _AutoHattblock()
+				else:
+					params['to_hattblock'] = hattblock_registry.get(params['to_hatt_id'])
 			except Hattblock.DoesNotExist:
 				raise ValueError('Parameter Error: Hatt block with id "%d" does not exist' % params['to_hatt_id'])
 
@@ -157,8 +295,11 @@ class WorkHorseTransformer(object):
 				elif key == 'to_hattblock':
 					key = 'to_hatt_id'
 				raise ValueError('Parameter Error: "%s" parameter is required' % key)
+			self._fuse_proj_steps()
 		else:
 			transformer = ProcrustesTransformer(params['procrustes'])
+			# the procrustes model comes from the session and is never shared, it is run serially
+			self.parallel = False
 			self.transformers.append(transformer)
 			self.log.append('Procrustes Transformation')
 			if transformer.accuracy == float('inf'):
@@ -169,6 +310,14 @@ class WorkHorseTransformer(object):
 		# if any key error happens this will throw above
 		self.from_refsys = REF_SYS[params['from_srid']]
 		self.to_refsys = REF_SYS[params['to_srid']]
+		# the output srid and reference system, specialized for the hatt block or centroid
+		# (its proj4text is None with the automatic hatt block lookup, the output is in the block of each point)
+		self.to_srid = params['to_srid']
+		self.output_refsys = _specialize_refsys(self.to_srid, params, 'to')
+		# the names of the steps in the timings
+		self.step_names = _step_names(self.transformers)
+		self.compile_seconds = time.perf_counter() - start
+		timing.record('compile', self.compile_seconds)
 
 	def _compute_tranform_accuracy(self, refsys1, refsys2):
 
@@ -228,34 +377,24 @@ class WorkHorseTransformer(object):
 				elif from_srid == HATT_OLD_SRID and params['from_hatt_centroid'] == params['to_hatt_centroid']:
 					return # end
 
-		srs1 = REF_SYS[from_srid]
-		srs2 = REF_SYS[to_srid]
 		# specialize proj4 definition for any of the reference systems that are hatt blocks
-		if from_srid == HATT_NEW_SRID:
-			srs1 = ReferenceSystem(name = '%s (%s)' % (srs1.name, params['from_hattblock'].name), 
-						  datum = srs1.datum,
-						  proj4text = params['from_hattblock'].proj4text)
-		elif from_srid == HATT_OLD_SRID:
-			phi0, lambda0 = params['from_hatt_centroid']
-			srs1 = ReferenceSystem(name = '%s (Φο=%.2f, Λο=%.2f)' % (srs1.name, phi0, lambda0),
-							datum = srs1.datum,
-							proj4text = hatt_proj_text_generate(phi0, lambda0))
-
-		if to_srid == HATT_NEW_SRID:
-			srs2 = ReferenceSystem(name = '%s (%s)' % (srs2.name, params['to_hattblock'].name),
-						  datum = srs2.datum,
-						  proj4text = params['to_hattblock'].proj4text)
-		elif to_srid == HATT_OLD_SRID:
-			phi0, lambda0 = params['to_hatt_centroid']
-			srs2 = ReferenceSystem(name = '%s (Φο=%.2f, Λο=%.2f)' % (srs2.name, phi0, lambda0),
-							datum = srs2.datum,
-							proj4text = hatt_proj_text_generate(phi0, lambda0))
+		srs1 = _specialize_refsys(from_srid, params, 'from')
+		srs2 = _specialize_refsys(to_srid, params, 'to')
 
 		bessel_to_bessel = (srs1.datum == Datum.NEW_BESSEL and srs2.datum == Datum.OLD_BESSEL) or (srs1.datum == Datum.OLD_BESSEL and srs2.datum == Datum.NEW_BESSEL)
 
 		# check if from-datum is the old greek (new bessel), so we can use OKXE transformation
 		if not bessel_to_bessel and srs1.datum == Datum.NEW_BESSEL and srs2.datum != Datum.NEW_BESSEL:
 			block = params['from_hattblock']
+			if isinstance(block, _AutoHattblock):
+				if from_srid == HATT_NEW_SRID:
+					raise ValueError('Parameter Error: the hatt block of Hatt coordinates cannot be found automatically')
+				# projection to each point's block and OKXE in one step
+				self.transformers.append(AutoHattTransformer(srs1.proj4text, inverse=False))
+				self.log.append('%s --(OKXE, %s)--> %s' % (srs1.name, block.name, REF_SYS[TM87_SRID].name))
+				self.transformation_steps.append(self._compute_tranform_accuracy(REF_SYS[HATT_NEW_SRID], REF_SYS[TM87_SRID]))
+				self._compile(from_srid=TM87_SRID, to_srid=to_srid)
+				return # end
 			# if not hatt projected ref. sys. but on greek datum... i.e. TM03 --> HATT
 			if from_srid != HATT_NEW_SRID:
 				self._compile(from_srid=from_srid, to_srid=HATT_NEW_SRID, to_hattblock=block) # using ProjTransformer
@@ -276,6 +415,13 @@ class WorkHorseTransformer(object):
 				is_iterative_inverse = True #default
 			# we need to transform from ggrs/greek grid to hatt so...we call recursively with ggrs / greek grid
 			self._compile(from_srid=from_srid, to_srid=TM87_SRID)
+			if isinstance(block, _AutoHattblock):
+				# OKXE and projection from each point's block in one step
+				self.transformers.append(AutoHattTransformer(srs2.proj4text, inverse=True, iterative_inverse=is_iterative_inverse))
+				self.log.append('%s --(OKXE, %s)--> %s %s' % (REF_SYS[TM87_SRID].name, block.name, srs2.name, "iter" if is_iterative_inverse else "coeffs"))
+				self.transformation_steps.append(self._compute_tranform_accuracy(REF_SYS[TM87_SRID], REF_SYS[HATT_NEW_SRID]))
+				self.outputs_hatt_ids = to_srid == HATT_NEW_SRID
+				return # end
 			# and then transform from ggrs / greek grid to hatt map block
 			self.transformers.append(OKXETransformer(block.get_coeffs(), inverse=True, iterative_inverse=is_iterative_inverse))
 			self.log.append('%s --(OKXE)--> %s (%s) %s' % (REF_SYS[TM87_SRID].name, REF_SYS[HATT_NEW_SRID].name, block.name, "iter" if is_iterative_inverse else "coeffs"))
@@ -290,7 +436,7 @@ class WorkHorseTransformer(object):
 			# transform to TM07 projection if in HTRS datum
 			self._compile(from_srid=from_srid, to_srid=TM07_SRID)
 			# HTRS/TM07 --> GGRS/Greek Grid
-			self.transformers.append(HeposTransformer(inverse=False))
+			self.transformers.append(HeposTransformer(inverse=False, mode=self._hepos_mode))
 			self.log.append('%s --(Hepos)--> %s' % (REF_SYS[TM07_SRID].name, REF_SYS[TM87_SRID].name))
 			self.transformation_steps.append(self._compute_tranform_accuracy(REF_SYS[TM07_SRID], REF_SYS[TM87_SRID]))
 			# call recursively with ggrs / greek grid
@@ -304,7 +450,7 @@ class WorkHorseTransformer(object):
 			params['to_srid'] = TM87_SRID
 			self._compile(**params)
 			# then use Hepos transformation : GGRS87/GG --> HTRS / TM07
-			self.transformers.append(HeposTransformer(inverse=True))
+			self.transformers.append(HeposTransformer(inverse=True, mode=self._hepos_mode))
 			# update log
 			self.log.append('%s --(Hepos)--> %s' % (REF_SYS[TM87_SRID].name, REF_SYS[TM07_SRID].name))
 			self.transformation_steps.append(self._compute_tranform_accuracy(REF_SYS[TM87_SRID], REF_SYS[TM07_SRID]))
@@ -313,11 +459,54 @@ class WorkHorseTransformer(object):
 			return # end
 		
 		# last and general transformation
+		if srs1.proj4text is None or srs2.proj4text is None:
+			raise ValueError('Parameter Error: automatic hatt block lookup is not supported for this transformation')
 		self.transformers.append(ProjTransformer(srs1.proj4text, srs2.proj4text))
 		self.log.append('%s --> %s' % (srs1.name, srs2.name))
 		self.transformation_steps.append(self._compute_tranform_accuracy(srs1, srs2))
 
-	def __call__(self, x, y, z=None):
+	def _fuse_proj_steps(self):
+		'''
+		Optimization pass after compilation: merges neighbouring transformers
+		that can be expressed as PROJ steps into a single ProjPipelineTransformer.
+		The log and the transformation steps are not affected.
+		'''
+		fused = []
+		group = []
+		for f in self.transformers + [None]:
+			steps = f.proj_steps() if hasattr(f, 'proj_steps') else None
+			if steps is not None:
+				group.append((f, steps))
+				continue
+			if len(group) == 1:
+				fused.append(group[0][0])
+			elif len(group) > 1:
+				fused.append(ProjPipelineTransformer([step for _, steps in group for step in steps]))
+			group = []
+			if f is not None:
+				fused.append(f)
+		self.transformers = fused
+
+	def __call__(self, x, y, z=None, hatt_ids=None):
+		'''
+		hatt_ids: optional list, receives the array with the hatt block id of each point
+		when the output is in automatically found hatt blocks (see outputs_hatt_ids).
+		'''
+		return self._run(x, y, z, masked=False, hatt_ids=hatt_ids)
+
+	def transform_masked(self, x, y, z=None, hatt_ids=None):
+		'''
+		Batch mode: transforms all the points without failing the whole batch for a few bad ones.
+		Returns the transformed coordinates and a boolean validity mask.
+		Invalid points (i.e. outside the Hepos grid or unprojectable) get non finite coordinates.
+		'''
+		coords = self._run(x, y, z, masked=True, hatt_ids=hatt_ids)
+		valid = np.ones(np.shape(coords[0]), dtype=bool)
+		for array in coords:
+			valid &= np.isfinite(array)
+		return coords, valid
+
+	def _run(self, x, y, z, masked, hatt_ids=None):
 		# create numpy array to modify in place
 		# fastest method for proj4 library and modifies in place for the custom methods
 		x = np.asarray(x)
@@ -325,14 +514,113 @@ class WorkHorseTransformer(object):
 		if z is not None:
 			z = np.asarray(z)
 
-		if z is not None:
-			for f in self.transformers:
-				x, y, z = f(x, y, z)
+		timings = timing.current()
+		start = time.perf_counter()
+		if self.parallel and x.ndim == 1 and chunk_executor.should_split(x.shape[0]):
+			coords = self._run_parallel(x, y, z, masked, hatt_ids)
 		else:
-			for f in self.transformers:
-				x, y  = f(x, y)
+			coords = self._run_steps(x, y, z, masked, hatt_ids)
+		if timings is not None:
+			# the whole call, its points are the points transformed
+			timings.add('transform', time.perf_counter() - start, x.size)
+		return coords
+
+	def _run_parallel(self, x, y, z, masked, hatt_ids):
+		'''
+		Runs the steps on chunks of the arrays on the chunk executor. Every step transforms
+		each point independently of the others, so the result is identical to the serial run.
+		'''
+		def run_chunk(start, stop):
+			chunk_hatt_ids = [] if hatt_ids is not None else None
+			coords = self._run_steps(x[start:stop], y[start:stop], z[start:stop] if z is not None else None,
+				masked, chunk_hatt_ids)
+			return coords, chunk_hatt_ids
+
+		with timing.timed('parallel', x.shape[0]):
+			results = chunk_executor.map(run_chunk, chunk_executor.chunks(x.shape[0]))
+		coords = tuple(np.concatenate([result[0][i] for result in results]) for i in range(len(results[0][0])))
+		if hatt_ids is not None and results[0][1]:
+			hatt_ids.append(np.concatenate([result[1][0] for result in results]))
+		return coords
+
+	def _run_steps(self, x, y, z, masked, hatt_ids):
+		timings = timing.current()
+		for name, f in zip(self.step_names, self.transformers):
+			kwargs = {}
+			if masked and getattr(f, 'supports_masked', False):
+				kwargs['masked'] = True
+			if hatt_ids is not None and isinstance(f, AutoHattTransformer):
+				kwargs['hatt_ids'] = hatt_ids
+			if timings is None:
+				xyz = f(x, y, z, **kwargs)
+			else:
+				start = time.perf_counter()
+				xyz = f(x, y, z, **kwargs)
+				timings.add(name, time.perf_counter() - start, np.size(x))
+			if z is not None:
+				x, y, z = xyz
+			else:
+				x, y = xyz[0], xyz[1]
 
 		return tuple(filter(lambda array: array is not None, [x, y, z]))
 
 	def log_str(self):
 		return '\n'.join(list(self.log))
+
+	def timings(self):
+		'''
+		Returns a context manager that collects the wall time and the number of points of each step
+		(see step_names) of the transformations run in its block, also of the drivers, i.e.:
+			with transformer.timings() as timings:
+				transformer(x, y)
+			timings.as_dict()
+		'''
+		return timing.collect()
+
+# names of the steps in the timings
+_STEP_NAMES = {
+	ProjTransformer: 'proj',
+	ProjPipelineTransformer: 'proj',
+	HeposTransformer: 'hepos',
+	OKXETransformer: 'okxe',
+	AutoHattTransformer: 'okxe_auto',
+	ProcrustesTransformer: 'procrustes',
+}
+
+def _step_names(transformers):
+	# the name of each step, numbered if there are more steps of its kind (i.e. proj, hepos, proj_2)
+	names = []
+	counts = {}
+	for f in transformers:
+		name = _STEP_NAMES.get(type(f), type(f).__name__)
+		counts[name] = counts.get(name, 0) + 1
+		names.append(name if counts[name] == 1 else '%s_%d' % (name, counts[name]))
+	return names
+
+def _pipeline_key(params):
+	'''
+	Normalizes the WorkHorseTransformer parameters that affect compilation into a hashable tuple.
+	'''
+	def hatt_id(key):
+		if key not in params:
+			return None
+		return AUTO_HATT if params[key] == AUTO_HATT else int(params[key])
+	from_hatt_id = hatt_id('from_hatt_id')
+	to_hatt_id = hatt_id('to_hatt_id')
+	from_srid = params.get('from_srid', HATT_NEW_SRID if from_hatt_id is not None else None)
+	to_srid = params.get('to_srid', HATT_NEW_SRID if to_hatt_id is not None else None)
+	from_centroid = tuple(float(v) for v in params['from_hatt_centroid']) if 'from_hatt_centroid' in params else None
+	to_centroid = tuple(float(v) for v in params['to_hatt_centroid']) if 'to_hatt_centroid' in params else None
+	okxe_inverse_type = params.get('okxe_inverse_type', 'iterative')
+	hepos_mode = params.get('hepos_mode', 'grid')
+	return (from_srid, to_srid, from_hatt_id, to_hatt_id, from_centroid, to_centroid, okxe_inverse_type, hepos_mode)
+
+def get_transformer(**params):
+	'''
+	Returns a compiled WorkHorseTransformer for the given parameters,
+	reusing a previously compiled one from the pipeline cache when possible.
+	Procrustes transformations depend on session data and are never cached.
+	'''
+	if 'procrustes' in params:
+		return WorkHorseTransformer(**params)
+	return pipeline_cache.get(_pipeline_key(params), lambda: WorkHorseTransformer(**params))
@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'transform'
 urlpatterns = [
     path('', views.index, name='index'),
-    path('api/', views.transform, name='transform'),
+    path('api/', views.transform_async if settings.ASYNC_VIEWS else views.transform, name='transform'),
+    path('api/jobs/', views.job_submit, name='job_submit'),
+    path('api/jobs/<uuid:job_id>/', views.job_status, name='job_status'),
+    path('api/jobs/<uuid:job_id>/result/', views.job_result, name='job_result'),
     #url(r'^api/hattblock/(\d{1,3})/$', views.hattblock_info, name='hattblock'),
 ]
@@ -1,13 +1,48 @@
 import json
+import uuid
+import logging
+import itertools
+import contextvars
 from io import TextIOWrapper
 
-from django.http import HttpResponse, Http404
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, Http404
 from django.shortcuts import render
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
+from survgr.compression import decompressed, decompressed_file, compress_response
+from survgr.async_views import async_view
+from survgr.metrics import registry, DURATION_BUCKETS, SIZE_BUCKETS
 from .hatt.models import Hattblock
-from .transform import WorkHorseTransformer, DATUMS, REF_SYS
-from .drivers import csv_driver, geojson_driver
+from .hatt.registry import hattblock_registry
+from .transform import get_transformer, DATUMS, REF_SYS, HATT_NEW_SRID
+from .jobs import job_queue, DONE, UploadTooLarge
+from . import timing
+from .drivers import csv_driver, geojson_driver, npy_driver, arrow_driver, parquet_driver, gpkg_driver
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = registry.counter('survgr_transform_requests_total',
+	'Requests of the transform api.', ['route', 'input_type', 'status'])
+REQUEST_DURATION = registry.histogram('survgr_transform_request_duration_seconds',
+	'Duration of the requests of the transform api, until the end of streamed responses.', ['route'], DURATION_BUCKETS)
+POINTS = registry.counter('survgr_transform_points_total',
+	'Points transformed by the transform api.', ['route'])
+THROUGHPUT = registry.histogram('survgr_transform_points_per_second',
+	'Points transformed per second of each request of the transform api.', ['route'],
+	(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7))
+UPLOAD_SIZE = registry.histogram('survgr_upload_size_bytes',
+	'Size of the uploaded files (as sent, before decompression).', ['endpoint'], SIZE_BUCKETS)
+
+# binary input types: driver, output content type and file name
+BINARY_DRIVERS = {
+	'npy': (npy_driver, 'application/octet-stream', 'result.npy'),
+	'npz': (npy_driver, 'application/octet-stream', 'result.npz'),
+	'arrow': (arrow_driver, 'application/vnd.apache.arrow.file', 'result.arrow'),
+	'parquet': (parquet_driver, 'application/vnd.apache.parquet', 'result.parquet'),
+	'gpkg': (gpkg_driver, 'application/geopackage+sqlite3', 'result.gpkg'),
+}
 
 def index(request):
 	q = [{'srid':srid, 'name':rs.name, 'datum': DATUMS[rs.datum]}  for srid, rs in REF_SYS.items()]
@@ -15,7 +50,7 @@ def index(request):
 
 def hattblock_info(request, id):
 	try:
-		hb = Hattblock.objects.get(id=id)
+		hb = hattblock_registry.get(id)
 	except Hattblock.DoesNotExist:
 		raise Http404
 
@@ -24,49 +59,150 @@ def hattblock_info(request, id):
 		'name': hb.name,
 		'center_lon': hb.center_lon,
 		'center_lat': hb.center_lat,
-		'okxe_coefficients': {c.type: c.value for c in hb.okxecoefficient_set.all()}
+		'okxe_coefficients': hb.get_coeff_dict()
 	}
 	return json_response(hb)
 
 @csrf_exempt
+@compress_response
 def transform(request):
+	with timing.collect() as timings:
+		response = run_transform(request.POST, request.FILES)
+		# the chunks of streaming responses are produced after the view returns, in this context
+		context = contextvars.copy_context()
+	if getattr(settings, 'TRANSFORM_SERVER_TIMING', False):
+		response['Server-Timing'] = timings.server_timing()
+
+	info = {name: request.POST.get(name) for name in ['input_type', 'from_srid', 'to_srid']}
+	info['status'] = response.status_code
+	def finished(completed=True):
+		# the status was sent before a streamed response failed
+		if not completed:
+			info['status'] = 'error'
+		_record_metrics(request, info, timings)
+		timing.log(timings, info)
+	if response.streaming:
+		response.streaming_content = timing.bound(response.streaming_content, context, finished)
+	else:
+		finished()
+	return response
+
+# for ASGI servers, the transformation runs on the compute executor
+transform_async = async_view(transform)
+
+def _datum_route(post):
+	# the datums of the transformation (i.e. HTRS07->HGRS87), the route label of the metrics
+	datums = []
+	for side in ['from', 'to']:
+		srid = post.get('%s_srid' % side) or (HATT_NEW_SRID if '%s_hatt_id' % side in post else None)
+		try:
+			datums.append(REF_SYS[int(srid)].datum.name)
+		except (KeyError, TypeError, ValueError):
+			return 'unknown'
+	return '->'.join(datums)
+
+def _record_metrics(request, info, timings):
+	route = _datum_route(request.POST)
+	seconds = timings.elapsed()
+	# user given values are not labels, they would grow the metrics without bound
+	input_type = info['input_type'] if info['input_type'] in ['csv', 'geojson'] + list(BINARY_DRIVERS) else 'other'
+	REQUESTS.inc(route=route, input_type=input_type, status=info['status'])
+	REQUEST_DURATION.observe(seconds, route=route)
+	if 'input' in request.FILES:
+		UPLOAD_SIZE.observe(request.FILES['input'].size, endpoint='transform')
+	points = timings.as_dict().get('transform', {}).get('points', 0)
+	if points and info['status'] == 200:
+		POINTS.inc(points, route=route)
+		THROUGHPUT.observe(points / seconds, route=route)
+
+def transformer_params(post):
+	'''
+	Returns the WorkHorseTransformer parameters of the api form fields (post).
+	'''
 	params = {}
-	for n, v in request.POST.items():
-		if n in ['from_srid', 'to_srid', 'from_hatt_id', 'to_hatt_id']:
+	for n, v in post.items():
+		if n in ['from_srid', 'to_srid']:
 			params[n] = int(v)
+		if n in ['from_hatt_id', 'to_hatt_id']:
+			# 'auto' finds the hatt block of each point
+			params[n] = v if v == 'auto' else int(v)
 		if n in ['from_hatt_centroid', 'to_hatt_centroid']:
 			latlon = json.loads(v)
 			params[n] = (latlon['lat'], latlon['lon'])
 
-	if 'okxe_inverse_type' in request.POST:
-		params['okxe_inverse_type'] = request.POST['okxe_inverse_type']
+	if 'okxe_inverse_type' in post:
+		params['okxe_inverse_type'] = post['okxe_inverse_type']
+
+	if 'hepos_mode' in post:
+		params['hepos_mode'] = post['hepos_mode']
+	return params
+
+def run_transform(post, files):
+	'''
+	Runs the transformation of the api for the form fields (post) and the uploaded files (files),
+	returns the response. The jobs run it too, with their stored fields and files.
+	'''
+	params = transformer_params(post)
 
 	# TODO: Add better exception support
 	try:
-		if 'procrustes' in request.FILES:
-			params['procrustes'] = json.loads(request.FILES['procrustes'].read())
+		if 'procrustes' in files:
+			params['procrustes'] = json.loads(files['procrustes'].read())
+
+		transformer = get_transformer(**params)
+		logger.debug('transformation:\n%s', transformer.log_str())
 
-		transformer = WorkHorseTransformer(**params)
-		print(transformer.log_str())
+		input_type = post['input_type']
+		# fail the request or mark the points that cannot be transformed
+		invalid_points = post.get('invalid_points', 'fail')
+		upload = files['input']
+		if input_type in BINARY_DRIVERS:
+			# binary coordinate columns in and out, the steps go in a header
+			driver, content_type, filename = BINARY_DRIVERS[input_type]
+			result = driver.transform(transformer, decompressed_file(upload.file, upload.content_type), invalid_points=invalid_points)
+			return binary_response(result, content_type, filename, transformer.transformation_steps)
 
-		input_type = request.POST['input_type']
-		inp = TextIOWrapper(request.FILES['input'].file, encoding='utf-8')
+		# gzip or zstd compressed inputs are decompressed as they are read
+		inp = TextIOWrapper(decompressed(upload.file, upload.content_type), encoding='utf-8')
+		# output=file sends the result itself (csv, or newline delimited geojson features)
+		# instead of the json document, with the steps in a header
+		file_output = post.get('output') == 'file'
 		if input_type == "csv":
 			#decimal degrees need 9 decimals for ~1mm accuracy, meters need 3
 			#so xy will either be degrees or meters and z will be meters
 			#http://wiki.gis.com/wiki/index.php/Decimal_degrees
 			xy_decimals = 9 if transformer.to_refsys.is_longlat() else 3
 			z_decimals = 3
+			if post.get('stream') == 'true' or file_output:
+				# transform and send the csv in chunks, for large inputs
+				chunks = csv_driver.transform_stream(transformer, inp,
+					(xy_decimals, xy_decimals, z_decimals),
+					fieldnames=post['csv_fields'],
+					invalid_points=invalid_points,
+					chunksize=getattr(settings, 'TRANSFORM_CSV_CHUNK_SIZE', 100000))
+				if file_output:
+					return streaming_file_response(chunks, "text/csv; charset=utf-8", transformer.transformation_steps)
+				return streaming_json_response("csv", chunks, transformer.transformation_steps)
 			csv_result = csv_driver.transform(transformer, inp,
 			    (xy_decimals, xy_decimals, z_decimals),
-				fieldnames=request.POST['csv_fields'])
+				fieldnames=post['csv_fields'],
+				invalid_points=invalid_points)
 			return json_response({
 				"type": "csv",
 				"result": csv_result.read(),
 				"steps": transformer.transformation_steps,
 			})
 		elif input_type == "geojson":
-			gj_result = geojson_driver.transform(transformer, inp)
+			if post.get('stream') == 'true' or file_output:
+				# read, transform and send the features in batches, for large inputs
+				chunks = geojson_driver.transform_stream(transformer, inp,
+					invalid_points=invalid_points,
+					batch_size=getattr(settings, 'TRANSFORM_GEOJSON_BATCH_SIZE', 10000),
+					ndjson=file_output)
+				if file_output:
+					return streaming_file_response(chunks, "application/x-ndjson; charset=utf-8", transformer.transformation_steps)
+				return streaming_json_response("geojson", chunks, transformer.transformation_steps, is_text=False)
+			gj_result = geojson_driver.transform(transformer, inp, invalid_points=invalid_points)
 			return json_response({
 				"type": "geojson",
 				"result": gj_result,
@@ -75,7 +211,91 @@ def transform(request):
 	except Exception as e:
 		return HttpResponse('Bad data', status=404)
 
+def _job_info(job):
+	# the public state of a job
+	job_id = uuid.UUID(job['id'])
+	info = {name: job[name] for name in ['id', 'status', 'progress', 'created', 'started', 'finished', 'expires', 'error']}
+	info['status_url'] = reverse('transform:job_status', args=[job_id])
+	info['result_url'] = reverse('transform:job_result', args=[job_id])
+	return info
+
+@csrf_exempt
+def job_submit(request):
+	'''
+	Queues a transformation job, with the same fields and files as the api. Returns the job state.
+	'''
+	if request.method != 'POST':
+		return HttpResponse(status=405)
+	# before the upload is received, when its length is known
+	content_length = request.META.get('CONTENT_LENGTH') or '0'
+	if content_length.isdigit() and int(content_length) > job_queue.max_upload_size:
+		return HttpResponse('the files of a job are limited to %d bytes' % job_queue.max_upload_size, status=413)
+	try:
+		job = job_queue.submit(request.POST.dict(), request.FILES)
+	except UploadTooLarge as e:
+		return HttpResponse(str(e), status=413)
+	except ValueError as e:
+		return HttpResponse(str(e), status=400)
+	return json_response(_job_info(job), status=202)
+
+def job_status(request, job_id):
+	job = job_queue.get(job_id.hex)
+	if job is None:
+		raise Http404
+	return json_response(_job_info(job))
+
+@compress_response
+def job_result(request, job_id):
+	'''
+	Sends the result of a finished job, the same as the response of the api for its fields.
+	'''
+	job = job_queue.get(job_id.hex)
+	if job is None:
+		raise Http404
+	if job['status'] != DONE:
+		return json_response(_job_info(job), status=409)
+	response = FileResponse(open(job_queue.result_path(job['id']), 'rb'), content_type=job['result']['content_type'])
+	for name, value in job['result']['headers'].items():
+		response[name] = value
+	return response
+
 # utility
 def json_response(data, status=200):
 	return HttpResponse(json.dumps(data, ensure_ascii=False), content_type="application/json; charset=utf-8", status=status)
 
+def binary_response(fp, content_type, filename, steps):
+	# the result file is sent in blocks and closed at the end
+	response = FileResponse(fp, content_type=content_type, as_attachment=True, filename=filename)
+	# header values must be ascii, the steps are escaped by json
+	response['X-Transformation-Steps'] = json.dumps(steps)
+	return response
+
+def streaming_file_response(chunks, content_type, steps):
+	'''
+	Streams the chunks of a text result as the response body, with the steps in a header.
+	'''
+	# produce the first (non empty) chunk now, so that bad input still gets an error response
+	first = next((chunk for chunk in chunks if chunk), '')
+	response = StreamingHttpResponse(itertools.chain([first], chunks), content_type=content_type)
+	# header values must be ascii, the steps are escaped by json
+	response['X-Transformation-Steps'] = json.dumps(steps)
+	return response
+
+def streaming_json_response(result_type, chunks, steps, is_text=True):
+	'''
+	Streams the same {"type", "result", "steps"} document as json_response,
+	with the result written chunk by chunk as the chunks are produced.
+	The chunks are parts of a string result (is_text) or of the json text of the result.
+	'''
+	# produce the first (non empty) chunk now, so that bad input still gets an error response
+	first = next((chunk for chunk in chunks if chunk), '')
+
+	def content():
+		quote = '"' if is_text else ''
+		yield '{"type": %s, "result": %s' % (json.dumps(result_type), quote)
+		for chunk in itertools.chain([first], chunks):
+			yield json.dumps(chunk, ensure_ascii=False)[1:-1] if is_text else chunk
+		yield '%s, "steps": %s}' % (quote, json.dumps(steps, ensure_ascii=False))
+
+	return StreamingHttpResponse(content(), content_type="application/json; charset=utf-8")
+